@@ -1,11 +1,14 @@
+import asyncio
 import json
 import os
+import queue
 import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from tqdm import tqdm
 
 from agent.agent import *
+from agent.pipeline import *
 
 from tstool.analyzer.TS_analyzer import *
 from tstool.analyzer.Cpp_TS_analyzer import *
@@ -22,10 +25,13 @@ from tstool.dfbscan_extractor.Python.Python_NPD_extractor import *
 from tstool.dfbscan_extractor.Go.Go_NPD_extractor import *
 
 from llmtool.LLM_utils import *
+from llmtool.LLM_budget import *
+from llmtool.LLM_batch import *
 from llmtool.dfbscan.intra_dataflow_analyzer import *
 from llmtool.dfbscan.path_validator import *
 
 from memory.semantic.dfbscan_state import *
+from memory.report.report_writer import *
 from memory.syntactic.function import *
 from memory.syntactic.value import *
 
@@ -34,6 +40,75 @@ from ui.logger import *
 BASE_PATH = Path(__file__).resolve().parents[2]
 
 
+class SrcValueTask:
+    """
+    The progress of a source value through the stages of the scan pipeline
+    """
+
+    def __init__(self, src_value: Value, src_function: Optional[Function]) -> None:
+        """
+        :param src_value: the source value
+        :param src_function: the function containing the source value
+        """
+        self.src_value = src_value
+        self.src_function = src_function
+        # The values in the worklist whose intra-procedural analysis is not finished
+        self.pending_worklist_item_num = 0
+        # The batches of path validation not finished
+        self.pending_batch_num = 0
+        # In an offline scan, whether a prompt of the source value has been exported
+        self.is_pending = False
+        # The first exception raised when processing the source value
+        self.exception: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        return
+
+    def add_worklist_items(self, item_num: int) -> None:
+        with self._lock:
+            self.pending_worklist_item_num += item_num
+
+    def finish_worklist_item(self) -> bool:
+        """
+        :return: whether the propagation of the source value is complete
+        """
+        with self._lock:
+            self.pending_worklist_item_num -= 1
+            return self.pending_worklist_item_num == 0
+
+    def add_batches(self, batch_num: int) -> None:
+        with self._lock:
+            self.pending_batch_num += batch_num
+
+    def finish_batch(self) -> bool:
+        """
+        :return: whether the paths of the source value are validated
+        """
+        with self._lock:
+            self.pending_batch_num -= 1
+            return self.pending_batch_num == 0
+
+    def is_failed(self) -> bool:
+        with self._lock:
+            return self.exception is not None
+
+    def fail(self, exception: BaseException) -> None:
+        with self._lock:
+            if isinstance(exception, ResponsePendingError):
+                self.is_pending = True
+            elif self.exception is None:
+                self.exception = exception
+
+    def get_exception(self) -> Optional[BaseException]:
+        """
+        :return: the exception of the source value, which is ResponsePendingError if the
+        source value waits for the responses of an offline batch
+        """
+        with self._lock:
+            if self.exception is None and self.is_pending:
+                return ResponsePendingError()
+            return self.exception
+
+
 class DFBScanAgent(Agent):
     def __init__(
         self,
@@ -47,6 +122,33 @@ class DFBScanAgent(Agent):
         call_depth: int,
         max_neural_workers: int = 30,
         agent_id: int = 0,
+        resume_dir: Optional[str] = None,
+        checkpoint_interval: int = 60,
+        intra_dfa_batch_size: int = 1,
+        path_validation_batch_size: int = 1,
+        max_llm_token_num: Optional[int] = None,
+        max_llm_query_num: Optional[int] = None,
+        max_scan_seconds: Optional[float] = None,
+        async_inference: bool = False,
+        use_llm_cache: bool = False,
+        llm_cache_path: Optional[str] = None,
+        llm_cache_max_entry_num: int = 100000,
+        intra_dfa_deadline: Optional[float] = None,
+        path_validation_deadline: Optional[float] = None,
+        intra_dfa_max_output_length: Optional[int] = None,
+        path_validation_max_output_length: Optional[int] = None,
+        intra_dfa_stop_sequences: Optional[List[str]] = None,
+        path_validation_stop_sequences: Optional[List[str]] = None,
+        export_prompts_path: Optional[str] = None,
+        import_responses_path: Optional[str] = None,
+        intra_dfa_model_name: Optional[str] = None,
+        path_validation_model_name: Optional[str] = None,
+        intra_dfa_escalation_model_name: Optional[str] = None,
+        path_validation_escalation_model_name: Optional[str] = None,
+        intra_dfa_structured_output: bool = False,
+        max_symbolic_workers: int = 30,
+        intra_dfa_workers: Optional[int] = None,
+        path_validation_workers: Optional[int] = None,
     ) -> None:
         self.bug_type = bug_type
         self.is_reachable = is_reachable
@@ -58,16 +160,38 @@ class DFBScanAgent(Agent):
 
         self.model_name = model_name
         self.temperature = temperature
+        # Each LLM tool may use its own model, and escalate to a stronger one
+        self.tool_models = {
+            "intra_dfa": (
+                intra_dfa_model_name or model_name,
+                intra_dfa_escalation_model_name,
+            ),
+            "path_validator": (
+                path_validation_model_name or model_name,
+                path_validation_escalation_model_name,
+            ),
+        }
 
         self.call_depth = call_depth
         self.max_neural_workers = max_neural_workers
+        # The LLM stages are sized independently, by max_neural_workers by default
+        self.max_symbolic_workers = max_symbolic_workers
+        self.intra_dfa_workers = intra_dfa_workers or max_neural_workers
+        self.path_validation_workers = path_validation_workers or max_neural_workers
+        self.intra_dfa_batch_size = intra_dfa_batch_size
+        self.path_validation_batch_size = path_validation_batch_size
+        self.async_inference = async_inference
         self.MAX_QUERY_NUM = 5
 
         self.lock = threading.Lock()
 
         with self.lock:
             self.log_dir_path = f"{BASE_PATH}/log/dfbscan/{self.model_name}/{self.bug_type}/{self.language}/{self.project_name}/{time.strftime('%Y-%m-%d-%H-%M-%S', time.localtime())}-{agent_id}"
-            self.res_dir_path = f"{BASE_PATH}/result/dfbscan/{self.model_name}/{self.bug_type}/{self.language}/{self.project_name}/{time.strftime('%Y-%m-%d-%H-%M-%S', time.localtime())}-{agent_id}"
+            if resume_dir is not None:
+                # Continue the scan in the result directory of the previous run
+                self.res_dir_path = os.path.abspath(resume_dir)
+            else:
+                self.res_dir_path = f"{BASE_PATH}/result/dfbscan/{self.model_name}/{self.bug_type}/{self.language}/{self.project_name}/{time.strftime('%Y-%m-%d-%H-%M-%S', time.localtime())}-{agent_id}"
             if not os.path.exists(self.log_dir_path):
                 os.makedirs(self.log_dir_path)
             self.logger = Logger(self.log_dir_path + "/" + "dfbscan.log")
@@ -75,24 +199,96 @@ class DFBScanAgent(Agent):
             if not os.path.exists(self.res_dir_path):
                 os.makedirs(self.res_dir_path)
 
-        # LLM tools used by DFBScanAgent
+        # LLM tools used by DFBScanAgent, sharing the same budget and persistent cache
+        self.budget = LLMBudget(max_llm_token_num, max_llm_query_num, max_scan_seconds)
+        self.persistent_cache: Optional[LLMResponseCache] = None
+        if use_llm_cache:
+            self.persistent_cache = LLMResponseCache(
+                (
+                    llm_cache_path
+                    if llm_cache_path is not None
+                    else f"{BASE_PATH}/cache/llm_response_cache.db"
+                ),
+                llm_cache_max_entry_num,
+            )
+        # Offline scan: the prompts missing responses are exported instead of being sent
+        self.batch_exporter: Optional[LLMBatchExporter] = None
+        if export_prompts_path is not None:
+            self.batch_exporter = LLMBatchExporter(export_prompts_path)
         self.intra_dfa = IntraDataFlowAnalyzer(
-            self.model_name,
+            self.tool_models["intra_dfa"][0],
             self.temperature,
             self.language,
             self.MAX_QUERY_NUM,
             self.logger,
+            self.budget,
+            self.persistent_cache,
+            intra_dfa_deadline,
+            intra_dfa_max_output_length,
+            intra_dfa_stop_sequences,
+            batch_exporter=self.batch_exporter,
+            escalation_model_name=self.tool_models["intra_dfa"][1],
+            is_structured_output=intra_dfa_structured_output,
         )
         self.path_validator = PathValidator(
-            self.model_name,
+            self.tool_models["path_validator"][0],
             self.temperature,
             self.language,
             self.MAX_QUERY_NUM,
             self.logger,
+            self.budget,
+            self.persistent_cache,
+            path_validation_deadline,
+            path_validation_max_output_length,
+            path_validation_stop_sequences,
+            batch_exporter=self.batch_exporter,
+            escalation_model_name=self.tool_models["path_validator"][1],
         )
 
-        self.src_values, self.sink_values = self.__obtain_extractor().extract_all()
+        # The extractor is stateless, so it is built once and shared by the workers
+        self.extractor = self.__obtain_extractor()
+        self.src_values, self.sink_values = self.extractor.extract_all()
         self.state = DFBScanState(self.src_values, self.sink_values)
+        self.report_writer = BugReportWriter(self.res_dir_path)
+
+        # The stages of the scan pipeline, connected by bounded queues. The values propagated
+        # to by the intra-procedural analysis are fed back to the preparation stage, whose queue
+        # is unbounded, so that the stages never wait for each other in a cycle.
+        self.preparation_stage = PipelineStage(
+            "preparation", self.__prepare_intra_dfa, self.max_symbolic_workers
+        )
+        self.intra_dfa_stage = PipelineStage(
+            "intra-dfa",
+            self.__run_intra_dfa,
+            self.intra_dfa_workers,
+            2 * self.intra_dfa_workers,
+        )
+        self.path_collection_stage = PipelineStage(
+            "path-collection",
+            self.__collect_paths,
+            self.max_symbolic_workers,
+            2 * self.max_symbolic_workers,
+        )
+        self.path_validation_stage = PipelineStage(
+            "path-validation",
+            self.__validate_paths,
+            self.path_validation_workers,
+            2 * self.path_validation_workers,
+        )
+        self.finished_tasks: "queue.Queue[SrcValueTask]" = queue.Queue()
+
+        # Checkpointing: source values are identified by their string forms across runs
+        self.checkpoint_path = self.res_dir_path + "/checkpoint.json"
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint_time = time.time()
+        self.completed_src_values: Set[str] = set()
+
+        # Cache indicating whether a function contains sink values
+        self.sink_function_ids: Dict[int, bool] = {}
+        if resume_dir is not None:
+            self.__load_checkpoint()
+        if import_responses_path is not None:
+            self.__import_responses(import_responses_path)
         return
 
     def __obtain_extractor(self) -> DFBScanExtractor:
@@ -116,6 +312,254 @@ class DFBScanAgent(Agent):
             f"Unsupported bug type: {self.bug_type} in {self.language}"
         )
 
+    def __get_scan_setting(self) -> Dict:
+        """
+        Get the settings that must be identical when a scan is resumed
+        """
+        scan_setting = {
+            "bug_type": self.bug_type,
+            "is_reachable": self.is_reachable,
+            "project_path": os.path.abspath(self.project_path),
+            "language": self.language,
+            "model_name": self.model_name,
+            "temperature": self.temperature,
+            "call_depth": self.call_depth,
+        }
+        # The models of the tools are only recorded if they are configured separately
+        if any(
+            tool_models != (self.model_name, None)
+            for tool_models in self.tool_models.values()
+        ):
+            scan_setting["tool_models"] = {
+                tool_name: list(tool_models)
+                for tool_name, tool_models in self.tool_models.items()
+            }
+        return scan_setting
+
+    def __save_checkpoint(self, force: bool = False) -> None:
+        """
+        Save the scan progress, the bug report index, and the LLM responses to the result directory.
+        :param force: save the checkpoint even if the checkpoint interval has not elapsed
+        """
+        with self.lock:
+            if (
+                not force
+                and time.time() - self.last_checkpoint_time < self.checkpoint_interval
+            ):
+                return
+            checkpoint = {
+                "scan_setting": self.__get_scan_setting(),
+                "completed_src_values": sorted(self.completed_src_values),
+                "state": self.state.to_checkpoint(),
+                "llm_tools": {
+                    "intra_dfa": self.intra_dfa.dump_response_cache(),
+                    "path_validator": self.path_validator.dump_response_cache(),
+                },
+            }
+            tmp_path = self.checkpoint_path + ".tmp"
+            with open(tmp_path, "w") as checkpoint_file:
+                json.dump(checkpoint, checkpoint_file)
+            os.replace(tmp_path, self.checkpoint_path)
+            self.last_checkpoint_time = time.time()
+        self.logger.print_log(
+            f"Checkpoint saved: {len(self.completed_src_values)} source value(s) completed"
+        )
+
+    def __load_checkpoint(self) -> None:
+        """
+        Restore the progress of a previous run from the checkpoint in the result directory.
+        The completed source values are skipped, and the LLM responses are reused.
+        """
+        if not os.path.exists(self.checkpoint_path):
+            raise FileNotFoundError(f"No checkpoint found in {self.res_dir_path}")
+        with open(self.checkpoint_path, "r") as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+
+        if checkpoint["scan_setting"] != self.__get_scan_setting():
+            raise ValueError(
+                f"The checkpoint in {self.res_dir_path} was created with different settings: "
+                f"{checkpoint['scan_setting']}"
+            )
+
+        self.completed_src_values = set(checkpoint["completed_src_values"])
+        self.state.load_checkpoint(checkpoint["state"])
+        self.intra_dfa.load_response_cache(checkpoint["llm_tools"]["intra_dfa"])
+        self.path_validator.load_response_cache(
+            checkpoint["llm_tools"]["path_validator"]
+        )
+
+        # Index the bug reports streamed after the last checkpoint as well
+        previous_reports = self.report_writer.read_reports()
+        self.state.restore_bug_report_index(
+            [
+                report["fingerprint"]
+                for report in previous_reports.values()
+                if "fingerprint" in report
+            ],
+            max([int(report_id) for report_id in previous_reports], default=-1) + 1,
+        )
+
+        self.logger.print_console(
+            f"Resume from {self.res_dir_path}: "
+            f"{len(self.completed_src_values)} source value(s) completed, "
+            f"{len(previous_reports)} bug report(s) found"
+        )
+        return
+
+    def __import_responses(self, import_responses_path: str) -> None:
+        """
+        Load the responses of the prompts exported by the previous round of an offline scan.
+        The responses are checkpointed with the other responses of the LLM tools.
+        """
+        responses = read_batch_responses(import_responses_path)
+        for tool in (self.intra_dfa, self.path_validator):
+            tool.load_response_cache(responses.get(type(tool).__name__, {}))
+        self.logger.print_console(
+            f"Imported {sum(len(tool_responses) for tool_responses in responses.values())} "
+            f"response(s) from {import_responses_path}"
+        )
+        return
+
+    def __get_sink_distance(
+        self, src_function: Function, sink_function_ids: Dict[int, bool]
+    ) -> Optional[int]:
+        """
+        Compute the number of call graph hops from the function of a source value to the nearest
+        function containing sink values, bounded by the call depth.
+        The hops follow the propagation in __update_worklist: arguments flow to callees, and
+        parameters/return values flow to callers.
+        :param src_function: the function containing the source value
+        :param sink_function_ids: the cache indicating whether a function contains sink values
+        :return: the distance, or None if no sink is reachable within the call depth
+        """
+        visited = {src_function.function_id}
+        frontier = [src_function]
+        for distance in range(self.call_depth + 1):
+            next_frontier = []
+            for function in frontier:
+                if function.function_id not in sink_function_ids:
+                    sink_function_ids[function.function_id] = (
+                        len(self.extractor.extract_sinks(function)) > 0
+                    )
+                if sink_function_ids[function.function_id]:
+                    return distance
+
+                neighbors = self.ts_analyzer.get_all_callee_functions(function)
+                if function.paras or function.retvals:
+                    neighbors += self.ts_analyzer.get_all_caller_functions(function)
+                for neighbor in neighbors:
+                    if neighbor.function_id not in visited:
+                        visited.add(neighbor.function_id)
+                        next_frontier.append(neighbor)
+            frontier = next_frontier
+        return None
+
+    def __prefilter_src_values(self, src_values: List[Value]) -> List[Value]:
+        """
+        Discard the source values that cannot reach any sink within the call depth
+        in the call graph before any LLM call.
+        Only applicable to the bug types requiring the source to reach a sink.
+        :param src_values: the source values
+        :return: the source values that may reach sinks
+        """
+        if not self.is_reachable or len(src_values) == 0:
+            return src_values
+
+        remaining_src_values = []
+        for src_value in src_values:
+            src_function = self.ts_analyzer.get_function_from_localvalue(src_value)
+            if src_function is None:
+                continue
+            if (
+                self.__get_sink_distance(src_function, self.sink_function_ids)
+                is not None
+            ):
+                remaining_src_values.append(src_value)
+
+        pruned_num = len(src_values) - len(remaining_src_values)
+        self.logger.print_console(
+            f"Reachability pre-filter: pruned {pruned_num} of {len(src_values)} source value(s) "
+            f"({pruned_num / len(src_values):.1%})"
+        )
+        return remaining_src_values
+
+    def __prioritize_src_values(self, src_values: List[Value]) -> List[Value]:
+        """
+        Order the source values so that the LLM budget is spent on the most promising ones first:
+        the source values closer to sinks in the call graph, and then the ones in functions with
+        more callers.
+        :param src_values: the source values
+        :return: the source values in the order of processing
+        """
+        priorities: Dict[int, Tuple[int, int]] = {}
+        for src_value in src_values:
+            src_function = self.ts_analyzer.get_function_from_localvalue(src_value)
+            if src_function is None or src_function.function_id in priorities:
+                continue
+            distance = None
+            if self.is_reachable:
+                distance = self.__get_sink_distance(
+                    src_function, self.sink_function_ids
+                )
+            fan_in = len(self.ts_analyzer.get_all_caller_functions(src_function))
+            priorities[src_function.function_id] = (
+                distance if distance is not None else self.call_depth + 1,
+                -fan_in,
+            )
+
+        def get_priority(src_value: Value) -> Tuple[int, int]:
+            src_function = self.ts_analyzer.get_function_from_localvalue(src_value)
+            if src_function is None:
+                return (self.call_depth + 1, 0)
+            return priorities[src_function.function_id]
+
+        # The sort is stable, so source values of the same priority keep their order
+        return sorted(src_values, key=get_priority)
+
+    def __report_unexplored_src_values(self, src_values: List[Value]) -> None:
+        """
+        Dump the source values left unexplored when the LLM budget is exhausted.
+        A scan completing all its source values with exactly the budget is not reported.
+        :param src_values: the source values scheduled in this run
+        """
+        unexplored_src_values = [
+            str(src_value)
+            for src_value in src_values
+            if str(src_value) not in self.completed_src_values
+        ]
+        if len(unexplored_src_values) == 0:
+            return
+        unexplored_path = self.res_dir_path + "/unexplored_src_values.json"
+        with open(unexplored_path, "w") as unexplored_file:
+            json.dump(unexplored_src_values, unexplored_file, indent=4)
+        self.logger.print_console(
+            f"LLM budget exhausted ({self.budget}). "
+            f"{len(unexplored_src_values)} source value(s) left unexplored, "
+            f"which have been dumped to {unexplored_path}"
+        )
+        self.logger.print_console(
+            f"Continue the scan with a new budget with --resume {self.res_dir_path}"
+        )
+        return
+
+    def __report_exported_prompts(self) -> None:
+        """
+        Tell how to continue an offline scan with the responses of the exported prompts
+        """
+        assert self.batch_exporter is not None
+        request_num = self.batch_exporter.get_request_num()
+        if request_num == 0:
+            self.logger.print_console("No prompt exported. The offline scan is complete.")
+            return
+        self.logger.print_console(
+            f"{request_num} prompt(s) exported to {self.batch_exporter.path}"
+        )
+        self.logger.print_console(
+            f"Continue the scan with --resume {self.res_dir_path} "
+            f"--import-responses <responses of the prompts>"
+        )
+        return
+
     def __update_worklist(
         self,
         input: IntraDataFlowAnalyzerInput,
@@ -393,6 +837,7 @@ class DFBScanAgent(Agent):
     # TOBE deprecated
     def start_scan_sequential(self) -> None:
         self.logger.print_console("Start data-flow bug scanning...")
+        self.report_writer.start()
 
         # Total number of source values
         total_src_values = len(self.src_values)
@@ -417,48 +862,7 @@ class DFBScanAgent(Agent):
                         continue
 
                     # Construct the input for intra-procedural data-flow analysis
-                    sinks_in_function = self.__obtain_extractor().extract_sinks(
-                        start_function
-                    )
-                    sink_values = [
-                        (
-                            sink.name,
-                            sink.line_number - start_function.start_line_number + 1,
-                        )
-                        for sink in sinks_in_function
-                    ]
-
-                    call_statements = []
-                    for call_site_node in start_function.function_call_site_nodes:
-                        file_content = self.ts_analyzer.code_in_files[
-                            start_function.file_path
-                        ]
-                        call_site_line_number = (
-                            file_content[: call_site_node.start_byte].count("\n") + 1
-                        )
-                        call_site_name = file_content[
-                            call_site_node.start_byte : call_site_node.end_byte
-                        ]
-                        call_statements.append((call_site_name, call_site_line_number))
-
-                    ret_values = [
-                        (
-                            ret.name,
-                            ret.line_number - start_function.start_line_number + 1,
-                        )
-                        for ret in (
-                            start_function.retvals
-                            if start_function.retvals is not None
-                            else []
-                        )
-                    ]
-                    df_input = IntraDataFlowAnalyzerInput(
-                        start_function,
-                        start_value,
-                        sink_values,
-                        call_statements,
-                        ret_values,
-                    )
+                    df_input = self.__get_intra_dfa_input(start_value, start_function)
 
                     # Invoke the intra-procedural data-flow analysis
                     df_output = self.intra_dfa.invoke(
@@ -519,21 +923,16 @@ class DFBScanAgent(Agent):
                             relevant_functions,
                             pv_output.explanation_str,
                         )
-                        self.state.update_bug_report(bug_report)
-
-                # Dump bug reports
-                bug_report_dict = {
-                    bug_report_id: bug.to_dict()
-                    for bug_report_id, bug in self.state.bug_reports.items()
-                }
-                with open(
-                    self.res_dir_path + "/detect_info.json", "w"
-                ) as bug_info_file:
-                    json.dump(bug_report_dict, bug_info_file, indent=4)
+                        report_id = self.state.update_bug_report(bug_report)
+                        if report_id is not None:
+                            self.report_writer.append(report_id, bug_report)
 
                 # Update the progress bar
                 pbar.update(1)
 
+        # Compact the streamed bug reports into detect_info.json
+        self.report_writer.close()
+
         # Final summary
         total_bug_number = len(self.state.bug_reports.values())
         self.logger.print_console(
@@ -547,33 +946,207 @@ class DFBScanAgent(Agent):
             self.logger.print_console(log_file)
         return
 
+    def __get_intra_dfa_input(
+        self, start_value: Value, start_function: Function
+    ) -> IntraDataFlowAnalyzerInput:
+        """
+        Construct the input for intra-procedural data-flow analysis.
+        The sinks, call statements, and return values are sorted by their lines, so that the
+        same function always yields the same prompt, whose digest keys the response cache,
+        the recordings, and the offline batches.
+        :param start_value: the value from which the propagation starts
+        :param start_function: the function containing the start value
+        :return: the input of IntraDataFlowAnalyzer
+        """
+        sinks_in_function = self.extractor.extract_sinks(start_function)
+        sink_values = [
+            (sink.name, sink.line_number - start_function.start_line_number + 1)
+            for sink in sinks_in_function
+        ]
+
+        call_statements = []
+        for call_site_node in start_function.function_call_site_nodes:
+            file_content = self.ts_analyzer.code_in_files[start_function.file_path]
+            call_site_line_number = (
+                file_content[: call_site_node.start_byte].count("\n") + 1
+            )
+            call_site_name = file_content[
+                call_site_node.start_byte : call_site_node.end_byte
+            ]
+            call_statements.append((call_site_name, call_site_line_number))
+
+        # The return values of a function are a set, whose order varies across processes
+        ret_values = [
+            (ret.name, ret.line_number - start_function.start_line_number + 1)
+            for ret in (
+                start_function.retvals if start_function.retvals is not None else []
+            )
+        ]
+        sink_values.sort(key=lambda sink_value: (sink_value[1], sink_value[0]))
+        call_statements.sort(
+            key=lambda call_statement: (call_statement[1], call_statement[0])
+        )
+        ret_values.sort(key=lambda ret_value: (ret_value[1], ret_value[0]))
+        return IntraDataFlowAnalyzerInput(
+            start_function, start_value, sink_values, call_statements, ret_values
+        )
+
+    def __get_intra_dfa_batches(
+        self, src_values: List[Value]
+    ) -> List[List[IntraDataFlowAnalyzerInput]]:
+        """
+        Group the source values in the same function into batches of intra-procedural analysis.
+        The outputs of a batch are cached per source value, so that the first intra-procedural
+        analysis of each source value in the pipeline hits the cache.
+        :param src_values: the source values to be processed
+        :return: the batches with more than one input
+        """
+        if self.intra_dfa_batch_size <= 1:
+            return []
+
+        inputs_per_function: Dict[int, List[IntraDataFlowAnalyzerInput]] = {}
+        for src_value in src_values:
+            src_function = self.ts_analyzer.get_function_from_localvalue(src_value)
+            if src_function is None:
+                continue
+            if src_function.function_id not in inputs_per_function:
+                inputs_per_function[src_function.function_id] = []
+            inputs_per_function[src_function.function_id].append(
+                self.__get_intra_dfa_input(src_value, src_function)
+            )
+
+        batches: List[List[IntraDataFlowAnalyzerInput]] = []
+        for inputs in inputs_per_function.values():
+            for i in range(0, len(inputs), self.intra_dfa_batch_size):
+                batch = inputs[i : i + self.intra_dfa_batch_size]
+                if len(batch) > 1:
+                    batches.append(batch)
+        if len(batches) > 0:
+            self.logger.print_console(
+                f"Batched intra-procedural analysis: {len(batches)} prompt(s) for "
+                f"{sum(len(batch) for batch in batches)} source value(s)"
+            )
+        return batches
+
+    def __batch_intra_dfa(
+        self, src_values: List[Value], executor: ThreadPoolExecutor
+    ) -> None:
+        """
+        Analyze the source values in the same function with batched prompts.
+        :param src_values: the source values to be processed
+        :param executor: the executor running the batched prompts
+        """
+        futures = [
+            executor.submit(
+                self.intra_dfa.invoke_batch, batch, IntraDataFlowAnalyzerOutput
+            )
+            for batch in self.__get_intra_dfa_batches(src_values)
+        ]
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except ResponsePendingError:
+                continue
+            except Exception as e:
+                self.logger.print_log("Error in batched intra-procedural analysis:", e)
+        return
+
+    async def __abatch_intra_dfa(
+        self, src_values: List[Value], semaphore: asyncio.Semaphore
+    ) -> None:
+        """
+        Asynchronous counterpart of __batch_intra_dfa
+        :param src_values: the source values to be processed
+        :param semaphore: the semaphore bounding the number of intra-procedural analyses in flight
+        """
+
+        async def invoke_batch(batch: List[IntraDataFlowAnalyzerInput]) -> None:
+            async with semaphore:
+                await self.intra_dfa.ainvoke_batch(batch, IntraDataFlowAnalyzerOutput)
+
+        results = await asyncio.gather(
+            *[
+                invoke_batch(batch)
+                for batch in self.__get_intra_dfa_batches(src_values)
+            ],
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception) and not isinstance(
+                result, ResponsePendingError
+            ):
+                self.logger.print_log(
+                    "Error in batched intra-procedural analysis:", result
+                )
+        return
+
     def start_scan(self) -> None:
         self.logger.print_console("Start data-flow bug scanning in parallel...")
-        self.logger.print_console(f"Max number of workers: {self.max_neural_workers}")
-
-        # Total number of source values
-        total_src_values = len(self.src_values)
+        self.logger.print_console(
+            f"Max number of workers: {self.intra_dfa_workers} (intra-procedural analysis), "
+            f"{self.path_validation_workers} (path validation)"
+        )
 
-        # Process each source value in parallel with a progress bar
-        with tqdm(
-            total=total_src_values, desc="Processing Source Values", unit="src"
-        ) as pbar:
-            with ThreadPoolExecutor(max_workers=self.max_neural_workers) as executor:
-                futures = [
-                    executor.submit(self.__process_src_value, src_value)
-                    for src_value in self.src_values
-                ]
-                for future in as_completed(futures):
-                    try:
-                        future.result()
-                    except Exception as e:
-                        self.logger.print_log("Error processing source value:", e)
-                    finally:
-                        # Update the progress bar after each source value is processed
-                        pbar.update(1)
+        # Skip the source values completed in the resumed run
+        pending_src_values = [
+            src_value
+            for src_value in self.src_values
+            if str(src_value) not in self.completed_src_values
+        ]
+        pending_src_values = self.__prefilter_src_values(pending_src_values)
+        pending_src_values = self.__prioritize_src_values(pending_src_values)
+
+        self.report_writer.start()
+        try:
+            with tqdm(
+                total=len(pending_src_values),
+                desc="Processing Source Values",
+                unit="src",
+            ) as pbar:
+                if self.async_inference:
+                    asyncio.run(self.__scan_src_values_async(pending_src_values, pbar))
+                else:
+                    self.__scan_src_values_pipelined(pending_src_values, pbar)
+        except KeyboardInterrupt:
+            self.logger.print_console(
+                f"Resume the scan with --resume {self.res_dir_path}"
+            )
+            raise
+        finally:
+            self.__save_checkpoint(force=True)
+            if self.batch_exporter is not None:
+                self.batch_exporter.write()
+            # Compact the streamed bug reports into detect_info.json
+            bug_report_dict = self.report_writer.close()
+
+        if self.budget.is_exhausted():
+            self.__report_unexplored_src_values(pending_src_values)
+        if self.batch_exporter is not None:
+            self.__report_exported_prompts()
 
         # Final summary
-        total_bug_number = len(self.state.bug_reports.values())
+        self.logger.print_console(f"LLM usage: {self.budget}")
+        for tool in (self.intra_dfa, self.path_validator):
+            self.logger.print_console(tool.get_usage_summary())
+        rate_limiters = []
+        circuit_breakers = []
+        for tool in (self.intra_dfa, self.path_validator):
+            for model in (tool.model, tool.escalation_model):
+                if model is not None and model.rate_limiter not in rate_limiters:
+                    rate_limiters.append(model.rate_limiter)
+                    circuit_breakers.append(model.circuit_breaker)
+        for rate_limiter in rate_limiters:
+            self.logger.print_console(f"Rate limiter: {rate_limiter}")
+        for circuit_breaker in circuit_breakers:
+            self.logger.print_console(f"Retries: {circuit_breaker}")
+        for key_pool in get_key_pools():
+            self.logger.print_console(f"API keys: {key_pool}")
+        if self.persistent_cache is not None:
+            self.logger.print_console(f"LLM response cache: {self.persistent_cache}")
+        recorder = self.intra_dfa.model.recorder
+        if recorder.is_recording() or recorder.is_replaying():
+            self.logger.print_console(f"LLM {recorder.mode}: {recorder}")
+        total_bug_number = len(bug_report_dict)
         self.logger.print_console(
             f"{total_bug_number} bug(s) was/were detected in total."
         )
@@ -585,123 +1158,399 @@ class DFBScanAgent(Agent):
             self.logger.print_console(log_file)
         return
 
-    def __process_src_value(self, src_value: Value) -> None:
-        worklist = []
+    def __scan_src_values_pipelined(
+        self, src_values: List[Value], pbar: tqdm
+    ) -> None:
+        """
+        Process the source values in a staged pipeline, i.e., the preparation of the
+        intra-procedural analysis, the intra-procedural analysis, the collection of the potential
+        buggy paths, and the path validation, each of which has its own pool of worker threads.
+        The two LLM stages stay busy with different source values, and the values in the worklist
+        of a source value are analyzed in parallel.
+        :param src_values: the source values in the order of processing
+        :param pbar: the progress bar
+        """
+        with ThreadPoolExecutor(max_workers=self.intra_dfa_workers) as executor:
+            self.__batch_intra_dfa(src_values, executor)
+
+        stages = [
+            self.preparation_stage,
+            self.intra_dfa_stage,
+            self.path_collection_stage,
+            self.path_validation_stage,
+        ]
+        for stage in stages:
+            stage.start()
+        # Bound the source values in the pipeline, so that both LLM stages are kept busy while
+        # the earlier source values are finished first
+        max_src_value_num = self.intra_dfa_workers + self.path_validation_workers
+        src_value_num = 0
+        next_index = 0
+        try:
+            while True:
+                # Stop scheduling new source values once the budget is exhausted
+                while (
+                    next_index < len(src_values)
+                    and src_value_num < max_src_value_num
+                    and not self.budget.is_exhausted()
+                ):
+                    self.__submit_src_value(src_values[next_index])
+                    next_index += 1
+                    src_value_num += 1
+                if src_value_num == 0:
+                    break
+                task = self.finished_tasks.get()
+                src_value_num -= 1
+                self.__finish_src_value(task.src_value, task.get_exception(), pbar)
+        except KeyboardInterrupt:
+            self.logger.print_console(
+                "Scan interrupted. Waiting for the running source values..."
+            )
+            raise
+        finally:
+            for stage in stages:
+                stage.stop()
+        return
+
+    def __submit_src_value(self, src_value: Value) -> None:
+        """
+        Start processing a source value from its intra-procedural analysis
+        """
         src_function = self.ts_analyzer.get_function_from_localvalue(src_value)
+        task = SrcValueTask(src_value, src_function)
         if src_function is None:
+            self.finished_tasks.put(task)
             return
-        initial_context = CallContext(False)
+        task.add_worklist_items(1)
+        self.preparation_stage.put(
+            (task, src_value, src_function, CallContext(False))
+        )
+        return
 
-        worklist.append((src_value, src_function, initial_context))
-        while len(worklist) > 0:
-            (start_value, start_function, call_context) = worklist.pop(0)
-            if len(call_context.context) > self.call_depth:
-                continue
+    def __prepare_intra_dfa(
+        self, item: Tuple[SrcValueTask, Value, Function, CallContext]
+    ) -> None:
+        """
+        Stage 1: construct the input of the intra-procedural analysis of a value in the worklist
+        """
+        task, start_value, start_function, call_context = item
+        try:
+            if not task.is_failed() and len(call_context.context) <= self.call_depth:
+                df_input = self.__get_intra_dfa_input(start_value, start_function)
+                self.intra_dfa_stage.put((task, df_input, start_value, call_context))
+                return
+        except Exception as e:
+            task.fail(e)
+        self.__finish_worklist_item(task)
+        return
 
-            # Construct the input for intra-procedural data-flow analysis
-            sinks_in_function = self.__obtain_extractor().extract_sinks(start_function)
-            sink_values = [
-                (sink.name, sink.line_number - start_function.start_line_number + 1)
-                for sink in sinks_in_function
-            ]
+    def __run_intra_dfa(
+        self,
+        item: Tuple[SrcValueTask, IntraDataFlowAnalyzerInput, Value, CallContext],
+    ) -> None:
+        """
+        Stage 2: invoke the intra-procedural analysis of a value in the worklist, and feed the
+        values it propagates to back to the preparation stage.
+        In an offline scan, the values whose prompts are exported are not propagated in this
+        round, while the rest of the worklist is explored to export all the prompts of the frontier.
+        """
+        task, df_input, start_value, call_context = item
+        try:
+            if not task.is_failed():
+                df_output = self.intra_dfa.invoke(df_input, IntraDataFlowAnalyzerOutput)
+                if df_output is not None:
+                    delta_worklist = self.__propagate(
+                        df_input, df_output, start_value, call_context
+                    )
+                    task.add_worklist_items(len(delta_worklist))
+                    for next_value, next_function, next_call_context in delta_worklist:
+                        self.preparation_stage.put(
+                            (task, next_value, next_function, next_call_context)
+                        )
+        except Exception as e:
+            task.fail(e)
+        self.__finish_worklist_item(task)
+        return
 
-            call_statements = []
-            for call_site_node in start_function.function_call_site_nodes:
-                file_content = self.ts_analyzer.code_in_files[start_function.file_path]
-                call_site_line_number = (
-                    file_content[: call_site_node.start_byte].count("\n") + 1
-                )
-                call_site_name = file_content[
-                    call_site_node.start_byte : call_site_node.end_byte
+    def __finish_worklist_item(self, task: SrcValueTask) -> None:
+        """
+        Forward a source value to the path collection once its propagation is complete
+        """
+        if task.finish_worklist_item():
+            self.path_collection_stage.put(task)
+        return
+
+    def __collect_paths(self, task: SrcValueTask) -> None:
+        """
+        Stage 3: collect the potential buggy paths of a source value and pack them into batches
+        of path validation. The paths are validated once the propagation is complete.
+        """
+        try:
+            if not task.is_failed() and not task.is_pending:
+                pv_batches = self.__get_path_validation_batches(task.src_value)
+                if len(pv_batches) > 0:
+                    task.add_batches(len(pv_batches))
+                    for pv_batch in pv_batches:
+                        self.path_validation_stage.put((task, pv_batch))
+                    return
+        except Exception as e:
+            task.fail(e)
+        self.finished_tasks.put(task)
+        return
+
+    def __validate_paths(
+        self, item: Tuple[SrcValueTask, List[PathValidatorInput]]
+    ) -> None:
+        """
+        Stage 4: validate a batch of potential buggy paths and generate bug reports
+        """
+        task, pv_batch = item
+        try:
+            if not task.is_failed():
+                # Skip the paths whose bugs have been reported after the batches were packed
+                pv_batch = [
+                    pv_input
+                    for pv_input in pv_batch
+                    if not self.__is_reported(task.src_value, pv_input)
                 ]
-                call_statements.append((call_site_name, call_site_line_number))
+                pv_outputs = self.path_validator.invoke_batch(
+                    pv_batch, PathValidatorOutput
+                )
+                self.__report_bugs(task.src_value, pv_batch, pv_outputs)
+        except Exception as e:
+            task.fail(e)
+        if task.finish_batch():
+            self.finished_tasks.put(task)
+        return
 
-            ret_values = [
-                (ret.name, ret.line_number - start_function.start_line_number + 1)
-                for ret in (
-                    start_function.retvals if start_function.retvals is not None else []
+    async def __scan_src_values_async(
+        self, src_values: List[Value], pbar: tqdm
+    ) -> None:
+        """
+        Process the source values on an event loop, where the LLM requests are in flight
+        without holding threads. The requests of the intra-procedural analysis and the path
+        validation are bounded by separate semaphores, so that the two stages are sized
+        independently.
+        :param src_values: the source values in the order of processing
+        :param pbar: the progress bar
+        """
+        intra_dfa_semaphore = asyncio.Semaphore(self.intra_dfa_workers)
+        path_validation_semaphore = asyncio.Semaphore(self.path_validation_workers)
+        await self.__abatch_intra_dfa(src_values, intra_dfa_semaphore)
+
+        # The tasks are scheduled in the order of src_values. Each LLM request acquires
+        # the semaphore of its stage, so that the earlier source values are served first.
+        tasks = {
+            asyncio.ensure_future(
+                self.__aprocess_src_value(
+                    src_value, intra_dfa_semaphore, path_validation_semaphore
                 )
-            ]
-            df_input = IntraDataFlowAnalyzerInput(
-                start_function, start_value, sink_values, call_statements, ret_values
+            ): src_value
+            for src_value in src_values
+        }
+        pending_tasks = set(tasks)
+        while len(pending_tasks) > 0:
+            done_tasks, pending_tasks = await asyncio.wait(
+                pending_tasks, return_when=asyncio.FIRST_COMPLETED
             )
+            for task in done_tasks:
+                self.__finish_src_value(tasks[task], task.exception(), pbar)
+        return
+
+    def __finish_src_value(
+        self, src_value: Value, exception: Optional[BaseException], pbar: tqdm
+    ) -> None:
+        """
+        Record the result of processing a source value
+        :param src_value: the source value
+        :param exception: the exception raised when processing the source value, if any
+        :param pbar: the progress bar
+        """
+        if exception is None:
+            self.completed_src_values.add(str(src_value))
+        elif not isinstance(exception, (BudgetExhaustedError, ResponsePendingError)):
+            self.logger.print_log("Error processing source value:", exception)
+        # Update the progress bar after each source value is processed
+        pbar.update(1)
+        self.__save_checkpoint()
+        return
 
-            # Invoke the intra-procedural data-flow analysis
-            df_output = self.intra_dfa.invoke(df_input, IntraDataFlowAnalyzerOutput)
+    async def __aprocess_src_value(
+        self,
+        src_value: Value,
+        intra_dfa_semaphore: asyncio.Semaphore,
+        path_validation_semaphore: asyncio.Semaphore,
+    ) -> None:
+        """
+        Process a source value on the event loop: its worklist is propagated by the
+        intra-procedural analysis, and then its potential buggy paths are validated.
+        In an offline scan, the values whose prompts are exported are not propagated
+        in this round, while the rest of the worklist is explored to export all the
+        prompts of the frontier.
+        :param src_value: the source value
+        :param intra_dfa_semaphore: the semaphore bounding the intra-procedural analyses in flight
+        :param path_validation_semaphore: the semaphore bounding the path validations in flight
+        """
+        src_function = self.ts_analyzer.get_function_from_localvalue(src_value)
+        if src_function is None:
+            return
 
+        is_pending = False
+        worklist = [(src_value, src_function, CallContext(False))]
+        while len(worklist) > 0:
+            (start_value, start_function, call_context) = worklist.pop(0)
+            if len(call_context.context) > self.call_depth:
+                continue
+
+            df_input = self.__get_intra_dfa_input(start_value, start_function)
+            try:
+                async with intra_dfa_semaphore:
+                    df_output = await self.intra_dfa.ainvoke(
+                        df_input, IntraDataFlowAnalyzerOutput
+                    )
+            except ResponsePendingError:
+                is_pending = True
+                continue
             if df_output is None:
                 continue
+            worklist.extend(
+                self.__propagate(df_input, df_output, start_value, call_context)
+            )
+        if is_pending:
+            raise ResponsePendingError()
+
+        for pv_batch in self.__get_path_validation_batches(src_value):
+            pv_batch = [
+                pv_input
+                for pv_input in pv_batch
+                if not self.__is_reported(src_value, pv_input)
+            ]
+            try:
+                async with path_validation_semaphore:
+                    pv_outputs = await self.path_validator.ainvoke_batch(
+                        pv_batch, PathValidatorOutput
+                    )
+            except ResponsePendingError:
+                is_pending = True
+                continue
+            self.__report_bugs(src_value, pv_batch, pv_outputs)
+        if is_pending:
+            raise ResponsePendingError()
+        return
 
-            for path_index in range(len(df_output.reachable_values)):
-                reachable_values_in_single_path = set([])
-                for value in df_output.reachable_values[path_index]:
-                    reachable_values_in_single_path.add((value, call_context))
-                self.state.update_reachable_values_per_path(
-                    (start_value, call_context), reachable_values_in_single_path
-                )
+    def __propagate(
+        self,
+        df_input: IntraDataFlowAnalyzerInput,
+        df_output: IntraDataFlowAnalyzerOutput,
+        start_value: Value,
+        call_context: CallContext,
+    ) -> List[Tuple[Value, Function, CallContext]]:
+        """
+        Record the output of intra-procedural data-flow analysis in the state
+        and compute the values to be analyzed next.
+        :return: the delta of the worklist
+        """
+        delta_worklist = []
+        for path_index in range(len(df_output.reachable_values)):
+            reachable_values_in_single_path = set([])
+            for value in df_output.reachable_values[path_index]:
+                reachable_values_in_single_path.add((value, call_context))
+            self.state.update_reachable_values_per_path(
+                (start_value, call_context), reachable_values_in_single_path
+            )
 
-                delta_worklist = self.__update_worklist(
-                    df_input, df_output, call_context, path_index
-                )
-                worklist.extend(delta_worklist)
+            delta_worklist.extend(
+                self.__update_worklist(df_input, df_output, call_context, path_index)
+            )
+        return delta_worklist
 
-        # Collect potential buggy paths
+    def __get_path_validation_batches(
+        self, src_value: Value
+    ) -> List[List[PathValidatorInput]]:
+        """
+        Collect the potential buggy paths of a source value and pack them into batches
+        of path validation. The shorter paths, which are cheaper and more likely to be
+        feasible, are validated first.
+        :param src_value: the source value
+        :return: the batches
+        """
         self.__collect_potential_buggy_paths(src_value, (src_value, CallContext(False)))
 
         # If no potential buggy paths are found, return early
         if src_value not in self.state.potential_buggy_paths:
-            return
+            return []
 
-        # Validate buggy paths and generate bug reports
+        pv_inputs: List[PathValidatorInput] = []
         for buggy_path in self.state.potential_buggy_paths[src_value].values():
             values_to_functions = {
                 value: self.ts_analyzer.get_function_from_localvalue(value)
                 for value in buggy_path
             }
-
-            functions: Set[Function] = set()
-            for func in values_to_functions.values():
-                if func is not None:
-                    functions.add(func)
-
-            if self.state.check_existence(src_value, functions):
-                continue
-
             pv_input = PathValidatorInput(
                 self.bug_type,
                 buggy_path,
                 values_to_functions,
             )
-            pv_output = self.path_validator.invoke(pv_input, PathValidatorOutput)
+            if self.__is_reported(src_value, pv_input):
+                continue
+            pv_inputs.append(pv_input)
+
+        # The paths are collected by traversing sets, so the ties are broken by the values,
+        # which keeps the batches, and hence the prompts, the same across processes
+        pv_inputs.sort(
+            key=lambda pv_input: (
+                len(pv_input.values),
+                [str(value) for value in pv_input.values],
+            )
+        )
+        pv_batches = self.path_validator.pack_batches(
+            pv_inputs, self.path_validation_batch_size
+        )
+        pv_batches.sort(
+            key=lambda pv_batch: min(len(pv_input.values) for pv_input in pv_batch)
+        )
+        return pv_batches
 
-            if pv_output is None:
+    def __report_bugs(
+        self,
+        src_value: Value,
+        pv_inputs: List[PathValidatorInput],
+        pv_outputs: List[Optional[PathValidatorOutput]],
+    ) -> None:
+        """
+        Generate bug reports for the paths validated as reachable
+        """
+        for pv_input, pv_output in zip(pv_inputs, pv_outputs):
+            if pv_output is None or not pv_output.is_reachable:
                 continue
 
-            if pv_output.is_reachable:
-                relevant_functions = {}
-                for value in buggy_path:
-                    function = self.ts_analyzer.get_function_from_localvalue(value)
-                    if function is not None:
-                        relevant_functions[function.function_id] = function
+            relevant_functions = {}
+            for value in pv_input.values:
+                function = self.ts_analyzer.get_function_from_localvalue(value)
+                if function is not None:
+                    relevant_functions[function.function_id] = function
 
-                bug_report = BugReport(
-                    self.bug_type,
-                    src_value,
-                    relevant_functions,
-                    pv_output.explanation_str,
-                )
-                self.state.update_bug_report(bug_report)
-                bug_report_dict = {
-                    bug_report_id: bug.to_dict()
-                    for bug_report_id, bug in self.state.bug_reports.items()
-                }
-
-                with open(
-                    self.res_dir_path + "/detect_info.json", "w"
-                ) as bug_info_file:
-                    json.dump(bug_report_dict, bug_info_file, indent=4)
+            bug_report = BugReport(
+                self.bug_type,
+                src_value,
+                relevant_functions,
+                pv_output.explanation_str,
+            )
+            report_id = self.state.update_bug_report(bug_report)
+            if report_id is not None:
+                self.report_writer.append(report_id, bug_report)
         return
 
+    def __is_reported(self, src_value: Value, pv_input: PathValidatorInput) -> bool:
+        """
+        Check whether the bug along the path has been reported
+        """
+        functions: Set[Function] = set()
+        for func in pv_input.values_to_functions.values():
+            if func is not None:
+                functions.add(func)
+        return self.state.check_existence(src_value, functions)
+
     def get_agent_state(self) -> DFBScanState:
         return self.state
 
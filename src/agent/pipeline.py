@@ -0,0 +1,70 @@
+import queue
+import threading
+from typing import Any, Callable, List
+
+
+class PipelineStage:
+    """
+    A stage of a pipeline, where a pool of worker threads handles the items of a queue.
+    A bounded queue applies back pressure: putting an item blocks while the queue is full,
+    so that an upstream stage does not run ahead of the stage.
+    """
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(
+        self,
+        name: str,
+        handle: Callable[[Any], None],
+        worker_num: int,
+        queue_size: int = 0,
+    ) -> None:
+        """
+        :param name: the name of the stage, which names its worker threads
+        :param handle: the function handling an item, which is expected not to raise
+        :param worker_num: the number of worker threads
+        :param queue_size: the maximum number of queued items. 0 means unbounded.
+        """
+        self.name = name
+        self.handle = handle
+        self.worker_num = max(1, worker_num)
+        self.queue: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+        self.workers: List[threading.Thread] = []
+        self.is_stopped = threading.Event()
+        return
+
+    def start(self) -> None:
+        for i in range(self.worker_num):
+            worker = threading.Thread(
+                target=self.__work, name=f"{self.name}-{i}", daemon=True
+            )
+            worker.start()
+            self.workers.append(worker)
+
+    def put(self, item: Any) -> None:
+        """
+        Queue an item, blocking while the queue is full. The item is dropped once the stage
+        is stopped.
+        """
+        while not self.is_stopped.is_set():
+            try:
+                self.queue.put(item, timeout=PipelineStage.POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def stop(self) -> None:
+        """
+        Stop the stage once the running items are handled. The queued items are dropped.
+        """
+        self.is_stopped.set()
+        for worker in self.workers:
+            worker.join()
+
+    def __work(self) -> None:
+        while not self.is_stopped.is_set():
+            try:
+                item = self.queue.get(timeout=PipelineStage.POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            self.handle(item)
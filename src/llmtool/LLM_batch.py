@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+
+class ResponsePendingError(Exception):
+    """
+    Raised when an LLM tool exports its prompt to an offline batch instead of querying the model.
+    The response is available in a later round, once the batch is answered.
+    """
+
+    pass
+
+
+def get_batch_custom_id(tool_name: str, prompt_digest: str) -> str:
+    """
+    Identify a prompt in the batch by the LLM tool and the digest of the prompt
+    """
+    return f"{tool_name}-{prompt_digest}"
+
+
+def parse_batch_custom_id(custom_id: str) -> Tuple[str, str]:
+    """
+    :return: the name of the LLM tool and the digest of the prompt
+    """
+    tool_name, _, prompt_digest = custom_id.rpartition("-")
+    return tool_name, prompt_digest
+
+
+class LLMBatchExporter:
+    """
+    Collect the prompts of a round of an offline scan and write them to a JSON Lines file.
+    Each line is a request of the batch API of OpenAI, i.e., a custom id and the body of
+    a chat completion request, which any batch runner can answer.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        :param path: the path of the exported prompts
+        """
+        self.path = path
+        self.requests: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        return
+
+    def add(self, custom_id: str, body: Dict[str, Any]) -> None:
+        """
+        Add a request to the batch. A prompt exported several times is kept once.
+        """
+        with self._lock:
+            if custom_id not in self.requests:
+                self.requests[custom_id] = {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": body,
+                }
+        return
+
+    def get_request_num(self) -> int:
+        with self._lock:
+            return len(self.requests)
+
+    def write(self) -> None:
+        """
+        Write the requests of the batch, replacing the file atomically
+        """
+        export_dir = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(export_dir, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as export_file:
+                for request in self.requests.values():
+                    export_file.write(json.dumps(request) + "\n")
+        os.replace(tmp_path, self.path)
+        return
+
+
+def get_batch_response_text(result: Dict[str, Any]) -> Optional[str]:
+    """
+    Get the response text of a line of the batch results. The supported formats are
+    - {"custom_id": ..., "response": "<text>"}
+    - the output of the batch API of OpenAI, i.e., {"custom_id": ..., "response": {"body": <chat completion>}}
+    - the results of the batch API of Anthropic, i.e., {"custom_id": ..., "result": {"message": <message>}}
+    :return: the text, or None if the request failed
+    """
+    response = result.get("response")
+    if isinstance(response, str):
+        return response
+    if isinstance(response, dict):
+        if response.get("status_code", 200) != 200:
+            return None
+        choices = response.get("body", {}).get("choices", [])
+        if len(choices) == 0:
+            return None
+        return choices[0].get("message", {}).get("content")
+
+    message = (result.get("result") or {}).get("message")
+    if isinstance(message, dict):
+        for block in message.get("content", []):
+            if block.get("type") == "tool_use":
+                # A structured answer submitted by tool calling
+                return json.dumps(block.get("input"))
+        return "".join(
+            block.get("text", "")
+            for block in message.get("content", [])
+            if block.get("type") == "text"
+        )
+    return None
+
+
+def read_batch_responses(path: str) -> Dict[str, Dict[str, str]]:
+    """
+    Read the responses of an offline batch
+    :param path: the path of the JSON Lines file of the responses
+    :return: the map from the names of the LLM tools to the maps from prompt digests to responses
+    """
+    responses: Dict[str, Dict[str, str]] = {}
+    with open(path, "r", encoding="utf-8") as response_file:
+        for line in response_file:
+            if line.strip() == "":
+                continue
+            result = json.loads(line)
+            text = get_batch_response_text(result)
+            if not text:
+                continue
+            tool_name, prompt_digest = parse_batch_custom_id(result["custom_id"])
+            responses.setdefault(tool_name, {})[prompt_digest] = text
+    return responses
@@ -0,0 +1,106 @@
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class BudgetExhaustedError(Exception):
+    """
+    Raised when an LLM tool is about to query the model after the budget is exhausted
+    """
+
+    pass
+
+
+class LLMBudget:
+    """
+    A budget of LLM queries shared by all the LLM tools of an agent.
+    Each limit is optional. The budget is exhausted once any limit is reached.
+    """
+
+    def __init__(
+        self,
+        max_token_num: Optional[int] = None,
+        max_query_num: Optional[int] = None,
+        max_seconds: Optional[float] = None,
+    ) -> None:
+        """
+        :param max_token_num: the maximum number of input and output tokens
+        :param max_query_num: the maximum number of queries
+        :param max_seconds: the maximum wall-clock time in seconds, counted from the creation
+        """
+        self.max_token_num = max_token_num
+        self.max_query_num = max_query_num
+        self.max_seconds = max_seconds
+
+        self.start_time = time.time()
+        self.token_num = 0
+        self.query_num = 0
+        # The numbers of input and output tokens per model
+        self.model_token_nums: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+        return
+
+    def reserve_query(self) -> None:
+        """
+        Reserve a query before it is sent, so that concurrent queries cannot exceed the query limit
+        Raise BudgetExhaustedError if the budget is exhausted
+        """
+        if self.is_exhausted():
+            raise BudgetExhaustedError(f"LLM budget exhausted: {self}")
+        with self._lock:
+            if self.max_query_num is not None and self.query_num >= self.max_query_num:
+                raise BudgetExhaustedError(f"LLM budget exhausted: {self}")
+            self.query_num += 1
+
+    def charge(
+        self,
+        input_token_num: int,
+        output_token_num: int,
+        model_name: Optional[str] = None,
+    ) -> None:
+        """
+        Charge the budget with the tokens of a finished query
+        :param input_token_num: the number of input tokens
+        :param output_token_num: the number of output tokens
+        :param model_name: the model answering the query, for the per-model accounting
+        """
+        with self._lock:
+            self.token_num += input_token_num + output_token_num
+            if model_name is not None:
+                token_nums = self.model_token_nums.setdefault(model_name, [0, 0])
+                token_nums[0] += input_token_num
+                token_nums[1] += output_token_num
+
+    def is_exhausted(self) -> bool:
+        """
+        Check whether any limit of the budget is reached
+        """
+        with self._lock:
+            if self.max_token_num is not None and self.token_num >= self.max_token_num:
+                return True
+            if self.max_query_num is not None and self.query_num >= self.max_query_num:
+                return True
+        if (
+            self.max_seconds is not None
+            and time.time() - self.start_time >= self.max_seconds
+        ):
+            return True
+        return False
+
+    def __str__(self) -> str:
+        def usage(used: float, limit: Optional[float]) -> str:
+            return f"{used}" if limit is None else f"{used}/{limit}"
+
+        budget_str = (
+            f"tokens: {usage(self.token_num, self.max_token_num)}, "
+            f"queries: {usage(self.query_num, self.max_query_num)}, "
+            f"seconds: {usage(round(time.time() - self.start_time), self.max_seconds)}"
+        )
+        for model_name, (input_token_num, output_token_num) in sorted(
+            self.model_token_nums.items()
+        ):
+            budget_str += (
+                f"\n  {model_name}: {input_token_num} input token(s), "
+                f"{output_token_num} output token(s)"
+            )
+        return budget_str
@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+class LLMResponseCache:
+    """
+    Persistent LLM response cache shared across runs and processes.
+    The responses are stored in an SQLite database in WAL mode, keyed by the model, the temperature,
+    the LLM tool, the version of the prompt template, and the digest of the prompt.
+    The least recently used responses are evicted when the number of entries exceeds the limit.
+    """
+
+    EVICTION_CHECK_INTERVAL = 100
+
+    def __init__(self, db_path: str, max_entry_num: int = 100000) -> None:
+        """
+        :param db_path: the path of the SQLite database
+        :param max_entry_num: the maximum number of cached responses
+        """
+        self.db_path = db_path
+        self.max_entry_num = max_entry_num
+
+        self.hit_num = 0
+        self.miss_num = 0
+        self.put_num = 0
+        self._lock = threading.Lock()
+        # SQLite connections cannot be shared by threads
+        self._local = threading.local()
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        connection = self.__get_connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                model TEXT NOT NULL,
+                temperature REAL NOT NULL,
+                tool TEXT NOT NULL,
+                template_version TEXT NOT NULL,
+                prompt_digest TEXT NOT NULL,
+                response TEXT NOT NULL,
+                last_access_time REAL NOT NULL,
+                PRIMARY KEY (model, temperature, tool, template_version, prompt_digest)
+            )
+            """
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access_time ON responses (last_access_time)"
+        )
+        connection.commit()
+        return
+
+    def __get_connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # The timeout waits for the write lock held by other threads or processes
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(
+        self,
+        model: str,
+        temperature: float,
+        tool: str,
+        template_version: str,
+        prompt_digest: str,
+    ) -> Optional[str]:
+        """
+        Look up a response and refresh its access time
+        :return: the cached response, or None if it is not cached
+        """
+        key = (model, temperature, tool, template_version, prompt_digest)
+        connection = self.__get_connection()
+        row = connection.execute(
+            "SELECT response FROM responses WHERE model = ? AND temperature = ? AND tool = ? "
+            "AND template_version = ? AND prompt_digest = ?",
+            key,
+        ).fetchone()
+        with self._lock:
+            if row is None:
+                self.miss_num += 1
+                return None
+            self.hit_num += 1
+
+        connection.execute(
+            "UPDATE responses SET last_access_time = ? WHERE model = ? AND temperature = ? "
+            "AND tool = ? AND template_version = ? AND prompt_digest = ?",
+            (time.time(),) + key,
+        )
+        connection.commit()
+        return row[0]
+
+    def put(
+        self,
+        model: str,
+        temperature: float,
+        tool: str,
+        template_version: str,
+        prompt_digest: str,
+        response: str,
+    ) -> None:
+        """
+        Store a response, and evict the least recently used responses if the cache is full
+        """
+        connection = self.__get_connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                model,
+                temperature,
+                tool,
+                template_version,
+                prompt_digest,
+                response,
+                time.time(),
+            ),
+        )
+        connection.commit()
+
+        with self._lock:
+            self.put_num += 1
+            if self.put_num % LLMResponseCache.EVICTION_CHECK_INTERVAL != 0:
+                return
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Evict the least recently used responses beyond the maximum number of entries
+        """
+        connection = self.__get_connection()
+        entry_num = connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if entry_num <= self.max_entry_num:
+            return
+        connection.execute(
+            "DELETE FROM responses WHERE rowid IN "
+            "(SELECT rowid FROM responses ORDER BY last_access_time LIMIT ?)",
+            (entry_num - self.max_entry_num,),
+        )
+        connection.commit()
+
+    def __str__(self) -> str:
+        total_num = self.hit_num + self.miss_num
+        hit_rate = self.hit_num / total_num if total_num > 0 else 0.0
+        return (
+            f"{self.hit_num} hit(s), {self.miss_num} miss(es), "
+            f"hit rate {hit_rate:.1%} ({self.db_path})"
+        )
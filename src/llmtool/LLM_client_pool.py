@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import weakref
+from typing import Any, Callable, Dict, Hashable
+
+import httpx
+
+
+class LLMClientPool:
+    """
+    Provider SDK clients shared by all LLM instances in the process.
+    A client is created once per key, e.g., the provider, the API key, and the base URL, and reused
+    across threads, so that its HTTP connections are kept alive between requests instead of being
+    re-established with a TLS handshake per request.
+    Async clients are bound to the event loop creating them, so they are pooled per event loop.
+    """
+
+    def __init__(self, max_connection_num: int = 100) -> None:
+        """
+        :param max_connection_num: the maximum number of (keep-alive) connections of a client
+        """
+        self.max_connection_num = max_connection_num
+        self._clients: Dict[Hashable, Any] = {}
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Hashable, Any]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
+        return
+
+    def configure(self, max_connection_num: int) -> None:
+        """
+        Set the size of the connection pools. Only the clients created afterwards are affected.
+        """
+        with self._lock:
+            self.max_connection_num = max_connection_num
+
+    def get_http_client_kwargs(self) -> Dict[str, Any]:
+        """
+        Get the keyword arguments of the HTTP clients used by the SDK clients
+        """
+        return {
+            "limits": httpx.Limits(
+                max_connections=self.max_connection_num,
+                max_keepalive_connections=self.max_connection_num,
+            )
+        }
+
+    def get_client(self, key: Hashable, create_client: Callable[[], Any]) -> Any:
+        """
+        Get the client of the key, which is created by create_client on the first request
+        """
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = create_client()
+            return self._clients[key]
+
+    def get_async_client(self, key: Hashable, create_client: Callable[[], Any]) -> Any:
+        """
+        Get the async client of the key in the running event loop
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            if key not in clients:
+                clients[key] = create_client()
+            return clients[key]
+
+
+_client_pool = LLMClientPool()
+
+
+def get_client_pool() -> LLMClientPool:
+    """
+    Get the client pool shared in the process
+    """
+    return _client_pool
@@ -0,0 +1,56 @@
+import threading
+from typing import Dict, Optional
+
+
+class LLMEndpoint:
+    """
+    An OpenAI-compatible endpoint serving a model, e.g., a vLLM or llama.cpp server.
+    A model registered with an endpoint is queried at the endpoint instead of the provider
+    selected by its name.
+    """
+
+    DEFAULT_API_KEY = "EMPTY"
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: Optional[str] = None,
+        timeout: float = 100,
+    ) -> None:
+        """
+        :param base_url: the base URL of the API, e.g., http://localhost:8000/v1
+        :param api_key: the API key. Local servers usually accept any key.
+        :param timeout: the timeout of a request in seconds
+        """
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key or LLMEndpoint.DEFAULT_API_KEY
+        self.timeout = timeout
+        return
+
+    def get_provider(self) -> str:
+        """
+        Get the name of the endpoint as a provider, so that the requests to the endpoint share
+        a rate limiter and a connection pool
+        """
+        return f"endpoint:{self.base_url}"
+
+
+_endpoints: Dict[str, LLMEndpoint] = {}
+_endpoints_lock = threading.Lock()
+
+
+def register_endpoint(model_name: str, endpoint: LLMEndpoint) -> None:
+    """
+    Serve the model by the endpoint in the process
+    :param model_name: the model id at the endpoint
+    """
+    with _endpoints_lock:
+        _endpoints[model_name] = endpoint
+
+
+def get_endpoint(model_name: str) -> Optional[LLMEndpoint]:
+    """
+    Get the endpoint serving the model, or None if the model is served by its provider
+    """
+    with _endpoints_lock:
+        return _endpoints.get(model_name)
@@ -0,0 +1,233 @@
+import threading
+import time
+from typing import Dict, List, Optional
+
+# The policies selecting the API key of a request
+ROUND_ROBIN = "round-robin"
+LEAST_LOADED = "least-loaded"
+KEY_SELECTIONS = [ROUND_ROBIN, LEAST_LOADED]
+
+# An API key rejected with these status codes, e.g., revoked or without credit, never succeeds
+# again during the scan
+KEY_ERROR_STATUS_CODES = {401, 402, 403}
+QUOTA_ERROR_MESSAGES = (
+    "insufficient_quota",
+    "exceeded your current quota",
+    "credit balance is too low",
+)
+
+
+def get_key_error(error: BaseException) -> Optional[str]:
+    """
+    Check whether an exception raised by a provider SDK is caused by the API key itself,
+    i.e., an exhausted quota or an authentication error, rather than by the request
+    :return: the description of the error, or None if the key is not at fault
+    """
+    # OpenAI responds to an exhausted quota with 429 and the error code insufficient_quota
+    message = str(error).lower()
+    if getattr(error, "code", None) == "insufficient_quota" or any(
+        quota_message in message for quota_message in QUOTA_ERROR_MESSAGES
+    ):
+        return "exhausted quota"
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        # google.api_core exceptions expose the HTTP status as code
+        status_code = getattr(error, "code", None)
+    if status_code in KEY_ERROR_STATUS_CODES:
+        return f"status {status_code}"
+    return None
+
+
+class APIKey:
+    """
+    The requests sent with an API key of a provider
+    """
+
+    def __init__(self, api_key: str) -> None:
+        """
+        :param api_key: the API key
+        """
+        self.api_key = api_key
+        self.in_flight_num = 0
+        self.request_num = 0
+        self.rate_limited_num = 0
+        self.blocked_until = 0.0
+        self.backoff = APIKeyPool.INITIAL_BACKOFF
+        # The error removing the key from the pool, if any
+        self.removal_reason: Optional[str] = None
+        return
+
+    def get_masked_key(self) -> str:
+        """
+        Identify the key in the logs without revealing it
+        """
+        return "..." + self.api_key[-4:]
+
+
+class APIKeyPool:
+    """
+    The API keys of an LLM provider, shared by all LLM instances in the process.
+    Each request is sent with one of the keys, selected round-robin or by the fewest requests
+    in flight, so that the requests of a scan draw on the quotas of all the keys.
+    - A key responded with 429 is not selected until its Retry-After, or an exponential backoff,
+      while the other keys keep serving the requests.
+    - A key rejected by an authentication or quota error is removed from the pool.
+    """
+
+    INITIAL_BACKOFF = 1.0
+    MAX_BACKOFF = 60.0
+
+    def __init__(
+        self, provider: str, api_keys: List[str], selection: str = LEAST_LOADED
+    ) -> None:
+        """
+        :param provider: the name of the provider
+        :param api_keys: the API keys of the provider
+        :param selection: the policy selecting the key of a request
+        """
+        self.provider = provider
+        self.keys = [APIKey(api_key) for api_key in dict.fromkeys(api_keys)]
+        self.selection = selection
+        self.next_index = 0
+        self._lock = threading.Lock()
+        return
+
+    def configure(self, selection: str) -> None:
+        with self._lock:
+            self.selection = selection
+
+    def acquire(self) -> Optional[str]:
+        """
+        Select the API key of a request. If all the keys are rate-limited, the key unblocked
+        first is selected.
+        :return: the API key, or None if all the keys have been removed
+        """
+        with self._lock:
+            active_keys = [key for key in self.keys if key.removal_reason is None]
+            if len(active_keys) == 0:
+                return None
+            now = time.monotonic()
+            available_keys = [key for key in active_keys if key.blocked_until <= now]
+            if len(available_keys) == 0:
+                available_keys = [min(active_keys, key=lambda key: key.blocked_until)]
+
+            # Start from the key after the last selected one, which breaks the ties
+            # of the least-loaded selection in the round-robin order
+            available_keys.sort(
+                key=lambda key: (self.keys.index(key) - self.next_index)
+                % len(self.keys)
+            )
+            selected_key = available_keys[0]
+            if self.selection == LEAST_LOADED:
+                selected_key = min(available_keys, key=lambda key: key.in_flight_num)
+            self.next_index = (self.keys.index(selected_key) + 1) % len(self.keys)
+
+            selected_key.in_flight_num += 1
+            selected_key.request_num += 1
+            return selected_key.api_key
+
+    def release(
+        self,
+        api_key: str,
+        error: Optional[BaseException] = None,
+        is_rate_limited: bool = False,
+        retry_after: Optional[float] = None,
+    ) -> bool:
+        """
+        Release the API key of a finished request
+        :param api_key: the API key
+        :param error: the error of a failed request, if any
+        :param is_rate_limited: whether the provider rejected the request with 429
+        :param retry_after: the Retry-After of the 429 response in seconds, if any
+        :return: whether the failure is charged to the key while another key may serve the
+        request, in which case the request is retried with another key
+        """
+        with self._lock:
+            key = self.__get_key(api_key)
+            if key is None:
+                return False
+            key.in_flight_num -= 1
+            if error is None:
+                key.backoff = APIKeyPool.INITIAL_BACKOFF
+                return False
+
+            now = time.monotonic()
+            key_error = get_key_error(error)
+            if key_error is not None:
+                if key.removal_reason is None:
+                    key.removal_reason = key_error
+                # The request waits for a rate-limited key rather than failing
+                return any(
+                    other_key.removal_reason is None for other_key in self.keys
+                )
+            if not is_rate_limited:
+                return False
+            key.rate_limited_num += 1
+            delay = retry_after if retry_after is not None else key.backoff
+            key.backoff = min(key.backoff * 2, APIKeyPool.MAX_BACKOFF)
+            key.blocked_until = max(key.blocked_until, now + delay)
+            # If all the keys are rate-limited, the provider is rate-limited as a whole
+            return any(
+                other_key.removal_reason is None and other_key.blocked_until <= now
+                for other_key in self.keys
+            )
+
+    def __get_key(self, api_key: str) -> Optional[APIKey]:
+        for key in self.keys:
+            if key.api_key == api_key:
+                return key
+        return None
+
+    def __str__(self) -> str:
+        with self._lock:
+            key_details = []
+            for key in self.keys:
+                key_detail = (
+                    f"{key.get_masked_key()}: {key.request_num} request(s), "
+                    f"{key.rate_limited_num} rate-limited"
+                )
+                if key.removal_reason is not None:
+                    key_detail += f", removed ({key.removal_reason})"
+                key_details.append(key_detail)
+            return f"{self.provider}: " + "; ".join(key_details)
+
+
+_key_selection = LEAST_LOADED
+
+_key_pools: Dict[str, APIKeyPool] = {}
+_key_pools_lock = threading.Lock()
+
+
+def configure_key_selection(selection: str) -> None:
+    """
+    Set the policy selecting the API keys of all the providers
+    """
+    global _key_selection
+    with _key_pools_lock:
+        _key_selection = selection
+        for key_pool in _key_pools.values():
+            key_pool.configure(selection)
+
+
+def get_key_pools() -> List[APIKeyPool]:
+    """
+    Get the API key pools of the providers queried so far
+    """
+    with _key_pools_lock:
+        return list(_key_pools.values())
+
+
+def get_key_pool(provider: str, api_keys: str) -> APIKeyPool:
+    """
+    Get the API key pool of a provider, which is shared in the process
+    :param provider: the name of the provider
+    :param api_keys: the API keys of the provider separated by ':', read on the first request
+    """
+    with _key_pools_lock:
+        if provider not in _key_pools:
+            _key_pools[provider] = APIKeyPool(
+                provider,
+                [api_key for api_key in api_keys.split(":") if api_key != ""],
+                _key_selection,
+            )
+        return _key_pools[provider]
@@ -0,0 +1,56 @@
+import hashlib
+import re
+from typing import Dict, List
+
+
+class PromptTemplate:
+    """
+    A prompt template compiled into static segments and slots, such as <FUNCTION>.
+    Rendering fills all the slots in a single pass, so the filled values, e.g., program code,
+    are never scanned for slots again. The slots without values are kept as they are.
+    """
+
+    SLOT_PATTERN = re.compile(r"<([A-Z_]+)>")
+
+    def __init__(self, text: str, prefix: str = "") -> None:
+        """
+        :param text: the text of the template
+        :param prefix: the part of the template before text, which is the same in all the prompts,
+        e.g., the task, the rules, and the examples. Providers cache the prompt prefixes, so the
+        prefix may only contain the slots with the same values in a run, e.g., <BUG_TYPE>.
+        """
+        self.text = prefix + text
+        # The split alternates between static segments (even indexes) and slot names (odd indexes)
+        parts = PromptTemplate.SLOT_PATTERN.split(self.text)
+        self.segments: List[str] = parts[0::2]
+        self.slots: List[str] = parts[1::2]
+        self.prefix = prefix
+        self.prefix_slots: List[str] = PromptTemplate.SLOT_PATTERN.findall(prefix)
+        self.hash = hashlib.sha256(self.text.encode("utf-8")).hexdigest()
+        return
+
+    def render(self, values: Dict[str, str]) -> str:
+        """
+        Fill the slots of the template
+        :param values: the map from slot names, e.g., FUNCTION, to their values
+        :return: the prompt
+        """
+        parts = [self.segments[0]]
+        for slot, segment in zip(self.slots, self.segments[1:]):
+            value = values.get(slot)
+            parts.append(value if value is not None else f"<{slot}>")
+            parts.append(segment)
+        return "".join(parts)
+
+    def get_prefix_length(self, values: Dict[str, str]) -> int:
+        """
+        Get the length of the rendered prefix of the template
+        :param values: the values of the slots in the prefix
+        :return: the number of characters of the prompt shared by all the prompts
+        """
+        length = len(self.prefix)
+        for slot in self.prefix_slots:
+            value = values.get(slot)
+            if value is not None:
+                length += len(value) - len(slot) - 2
+        return length
@@ -0,0 +1,282 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+
+
+class TokenBucket:
+    """
+    A token bucket refilled at a constant rate per minute.
+    Reservations may overdraw the bucket, in which case the caller waits until the debt is refilled.
+    """
+
+    def __init__(self, rate_per_minute: Optional[float] = None) -> None:
+        """
+        :param rate_per_minute: the refill rate and the capacity. None means unlimited.
+        """
+        self.rate_per_minute = rate_per_minute
+        self.tokens = rate_per_minute if rate_per_minute is not None else 0.0
+        self.last_refill_time = time.monotonic()
+        return
+
+    def reserve(self, amount: float, now: float) -> float:
+        """
+        Take tokens from the bucket. Not thread-safe; the caller holds the lock.
+        :param amount: the number of tokens
+        :param now: the current monotonic time
+        :return: the number of seconds to wait before the reserved tokens are available
+        """
+        if self.rate_per_minute is None:
+            return 0.0
+        rate_per_second = self.rate_per_minute / 60
+        self.tokens = min(
+            self.rate_per_minute,
+            self.tokens + (now - self.last_refill_time) * rate_per_second,
+        )
+        self.last_refill_time = now
+        self.tokens -= amount
+        return max(0.0, -self.tokens / rate_per_second)
+
+
+class RateLimiter:
+    """
+    Client-side rate limiter of an LLM provider, shared by all LLM instances in the process.
+    - Requests and tokens per minute are bounded by token buckets.
+    - The number of concurrent requests is adjusted by AIMD: it increases by one per round trip
+      and is halved when the provider responds with 429, or reduced when the latency inflates.
+      Like TCP slow start, it doubles per round trip until the first decrease.
+    - A 429 response blocks all the requests until its Retry-After, or an exponential backoff.
+    """
+
+    POLL_INTERVAL = 0.05
+    LATENCY_INFLATION_FACTOR = 2.0
+    INITIAL_BACKOFF = 1.0
+    MAX_BACKOFF = 60.0
+
+    def __init__(
+        self,
+        provider: str,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        initial_concurrency: int = 8,
+        max_concurrency: int = 256,
+    ) -> None:
+        """
+        :param provider: the name of the provider
+        :param requests_per_minute: the maximum number of requests per minute. None means unlimited.
+        :param tokens_per_minute: the maximum number of tokens per minute. None means unlimited.
+        :param initial_concurrency: the initial number of concurrent requests
+        :param max_concurrency: the maximum number of concurrent requests
+        """
+        self.provider = provider
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.concurrency_limit = float(min(initial_concurrency, max_concurrency))
+        self.in_flight_num = 0
+
+        self.blocked_until = 0.0
+        self.backoff = RateLimiter.INITIAL_BACKOFF
+        self.min_latency: Optional[float] = None
+        self.avg_latency = 0.0
+        self.last_decrease_time = 0.0
+        self.is_slow_start = True
+
+        self.rate_limited_num = 0
+        self._lock = threading.Lock()
+        return
+
+    def configure(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+    ) -> None:
+        """
+        Set the limits of the provider, e.g., according to the quota of the API key
+        """
+        with self._lock:
+            self.request_bucket = TokenBucket(requests_per_minute)
+            self.token_bucket = TokenBucket(tokens_per_minute)
+            if max_concurrency is not None:
+                self.max_concurrency = max_concurrency
+                self.concurrency_limit = min(self.concurrency_limit, max_concurrency)
+
+    def is_token_limited(self) -> bool:
+        """
+        Check whether the tokens per minute are limited, i.e., whether the token numbers of the
+        requests matter
+        """
+        return self.token_bucket.rate_per_minute is not None
+
+    def acquire(self, token_num: int) -> None:
+        """
+        Block until a request with the given number of input tokens may be sent
+        """
+        while True:
+            is_acquired, wait_time = self.__try_acquire(token_num)
+            if wait_time > 0:
+                time.sleep(wait_time)
+            if is_acquired:
+                return
+
+    async def aacquire(self, token_num: int) -> None:
+        """
+        Asynchronous counterpart of acquire, which does not block the event loop
+        """
+        while True:
+            is_acquired, wait_time = self.__try_acquire(token_num)
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+            if is_acquired:
+                return
+
+    def __try_acquire(self, token_num: int) -> Tuple[bool, float]:
+        """
+        :return: whether a concurrency slot is acquired, and the number of seconds to wait
+        before sending the request or retrying the acquisition
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                # Spread the waiting requests, so that they do not retry in lockstep
+                wait_time = self.blocked_until - now
+                return False, wait_time + random.uniform(0, 0.1 * wait_time)
+            if self.in_flight_num >= int(self.concurrency_limit):
+                return False, RateLimiter.POLL_INTERVAL
+            self.in_flight_num += 1
+            wait_time = max(
+                self.request_bucket.reserve(1, now),
+                self.token_bucket.reserve(token_num, now),
+            )
+            return True, wait_time
+
+    def release(
+        self,
+        latency: Optional[float] = None,
+        output_token_num: int = 0,
+        is_rate_limited: bool = False,
+        retry_after: Optional[float] = None,
+    ) -> None:
+        """
+        Release the concurrency slot of a finished request and adjust the concurrency limit
+        :param latency: the latency of a successful request. None if the request failed.
+        :param output_token_num: the number of output tokens, charged to the token bucket
+        :param is_rate_limited: whether the provider rejected the request with 429
+        :param retry_after: the Retry-After of the 429 response in seconds, if any
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.in_flight_num -= 1
+            self.token_bucket.reserve(output_token_num, now)
+
+            if is_rate_limited:
+                self.rate_limited_num += 1
+                # Concurrent 429 responses within a round trip are one congestion signal
+                self.__decrease(0.5, now)
+                delay = retry_after if retry_after is not None else self.backoff
+                self.backoff = min(self.backoff * 2, RateLimiter.MAX_BACKOFF)
+                self.blocked_until = max(self.blocked_until, now + delay)
+                return
+
+            if latency is None:
+                return
+            self.backoff = RateLimiter.INITIAL_BACKOFF
+            if self.min_latency is None or latency < self.min_latency:
+                self.min_latency = latency
+            self.avg_latency = (
+                latency
+                if self.avg_latency == 0
+                else 0.8 * self.avg_latency + 0.2 * latency
+            )
+            if self.avg_latency > RateLimiter.LATENCY_INFLATION_FACTOR * self.min_latency:
+                self.__decrease(0.9, now)
+            else:
+                increment = 1 if self.is_slow_start else 1 / self.concurrency_limit
+                self.concurrency_limit = min(
+                    float(self.max_concurrency), self.concurrency_limit + increment
+                )
+
+    def __decrease(self, factor: float, now: float) -> None:
+        if now - self.last_decrease_time < self.avg_latency:
+            return
+        self.concurrency_limit = max(1.0, self.concurrency_limit * factor)
+        self.last_decrease_time = now
+        self.is_slow_start = False
+
+    def __str__(self) -> str:
+        return (
+            f"{self.provider}: concurrency limit {int(self.concurrency_limit)}, "
+            f"{self.rate_limited_num} rate-limited request(s)"
+        )
+
+
+_rate_limiters: Dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str) -> RateLimiter:
+    """
+    Get the rate limiter of a provider, which is shared in the process
+    """
+    with _rate_limiters_lock:
+        if provider not in _rate_limiters:
+            _rate_limiters[provider] = RateLimiter(provider)
+        return _rate_limiters[provider]
+
+
+def get_status_code(error: BaseException) -> Optional[int]:
+    """
+    Get the HTTP status of an exception raised by a provider SDK, if any
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        # google.api_core exceptions expose the HTTP status as code
+        status_code = getattr(error, "code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """
+    Check whether an exception raised by a provider SDK is a 429 response.
+    The message is only checked if the exception has no HTTP status, since the message of
+    another error may contain 429 in a token count, a key fragment, or a request id.
+    """
+    status_code = get_status_code(error)
+    if status_code is not None:
+        return status_code == 429
+    message = str(error).lower()
+    return re.search(r"\b429\b", message) is not None or "rate limit" in message
+
+
+def get_retry_after(error: BaseException) -> Optional[float]:
+    """
+    Get the Retry-After of a 429 response in seconds, if the SDK exposes the response headers
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is None:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        # Retry-After may also be an HTTP date
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class LLMRecorder:
+    """
+    Record and replay of LLM inferences, shared by all LLM instances in the process.
+    - In the record mode, each inference, i.e., the prompt, the response, the usage, and the latency,
+      is appended to a JSON Lines file as soon as the response arrives.
+    - In the replay mode, the responses are served from the file by the digest of the model,
+      the system role, and the prompt, without any request to the provider.
+      A prompt recorded several times is answered with its responses in the recorded order,
+      and the last response is repeated once they are used up.
+    """
+
+    def __init__(self) -> None:
+        self.mode: Optional[str] = None
+        self.path: Optional[str] = None
+        self.is_latency_replayed = False
+
+        self.record_num = 0
+        self.hit_num = 0
+        self.miss_num = 0
+        self._entries: Dict[str, List[Dict]] = {}
+        self._lock = threading.Lock()
+        return
+
+    def configure(
+        self, mode: Optional[str], path: str, is_latency_replayed: bool = False
+    ) -> None:
+        """
+        :param mode: "record", "replay", or None to disable the recorder
+        :param path: the path of the recording
+        :param is_latency_replayed: whether a replayed response is returned after its recorded latency
+        """
+        with self._lock:
+            self.mode = mode
+            self.path = path
+            self.is_latency_replayed = is_latency_replayed
+            self._entries = {}
+            if mode == "record":
+                record_dir = os.path.dirname(os.path.abspath(path))
+                os.makedirs(record_dir, exist_ok=True)
+            elif mode == "replay":
+                self.__load()
+        return
+
+    def __load(self) -> None:
+        """
+        Load the recording. A truncated last line, e.g., of an interrupted run, is skipped.
+        """
+        assert self.path is not None
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self._entries.setdefault(entry["key"], []).append(entry)
+        return
+
+    def is_recording(self) -> bool:
+        return self.mode == "record"
+
+    def is_replaying(self) -> bool:
+        return self.mode == "replay"
+
+    @staticmethod
+    def get_key(
+        model_name: str,
+        system_role: str,
+        message: str,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> str:
+        """
+        Get the digest identifying an inference in the recording
+        :param history: the earlier turns of a multi-turn exchange, if any
+        """
+        key: List[Any] = [model_name, system_role, message]
+        if history:
+            key.append(history)
+        return hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()
+
+    def record(
+        self,
+        model_name: str,
+        system_role: str,
+        message: str,
+        output: str,
+        usage: Optional[Tuple[int, int, int]],
+        latency: float,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> None:
+        """
+        Append an inference to the recording
+        :param latency: the number of seconds of the inference, including retries
+        :param history: the earlier turns of a multi-turn exchange, if any
+        """
+        assert self.path is not None
+        line = json.dumps(
+            {
+                "key": LLMRecorder.get_key(model_name, system_role, message, history),
+                "model": model_name,
+                "history": history,
+                "prompt": message,
+                "response": output,
+                "usage": list(usage) if usage is not None else None,
+                "latency": latency,
+            }
+        )
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self.record_num += 1
+        return
+
+    def __take(
+        self,
+        model_name: str,
+        system_role: str,
+        message: str,
+        history: Optional[List[Dict[str, str]]],
+    ) -> Tuple[str, Optional[Tuple[int, int, int]], float]:
+        """
+        Take the next recorded response of the prompt
+        :return: the response, the usage, and the latency. The response is empty if the prompt
+        is not recorded.
+        """
+        key = LLMRecorder.get_key(model_name, system_role, message, history)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.miss_num += 1
+                return "", None, 0.0
+            self.hit_num += 1
+            entry = entries.pop(0) if len(entries) > 1 else entries[0]
+        usage = tuple(entry["usage"]) if entry["usage"] is not None else None
+        return entry["response"], usage, entry["latency"]  # type: ignore[return-value]
+
+    def replay(
+        self,
+        model_name: str,
+        system_role: str,
+        message: str,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> Tuple[str, Optional[Tuple[int, int, int]]]:
+        """
+        Replay the response of the prompt
+        :return: the response and the usage
+        """
+        output, usage, latency = self.__take(model_name, system_role, message, history)
+        if self.is_latency_replayed:
+            time.sleep(latency)
+        return output, usage
+
+    async def areplay(
+        self,
+        model_name: str,
+        system_role: str,
+        message: str,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> Tuple[str, Optional[Tuple[int, int, int]]]:
+        """
+        Asynchronous counterpart of replay, which awaits the recorded latency on the event loop
+        """
+        output, usage, latency = self.__take(model_name, system_role, message, history)
+        if self.is_latency_replayed:
+            await asyncio.sleep(latency)
+        return output, usage
+
+    def __str__(self) -> str:
+        if self.is_recording():
+            return f"{self.record_num} inference(s) recorded ({self.path})"
+        return f"{self.hit_num} replayed, {self.miss_num} not recorded ({self.path})"
+
+
+_llm_recorder = LLMRecorder()
+
+
+def get_llm_recorder() -> LLMRecorder:
+    """
+    Get the recorder shared in the process
+    """
+    return _llm_recorder
@@ -0,0 +1,255 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+import httpx
+
+from llmtool.LLM_rate_limiter import get_status_code, is_rate_limit_error
+
+# The kinds of failed requests
+RATE_LIMITED = "rate_limited"
+TIMEOUT = "timeout"
+SERVER_ERROR = "server_error"
+CLIENT_ERROR = "client_error"
+EMPTY_RESPONSE = "empty_response"
+OTHER_ERROR = "other_error"
+# A request failed by its API key, e.g., a rate-limited or revoked key, retried with another key
+KEY_ERROR = "key_error"
+
+# Client errors (4xx) are caused by the request itself, e.g., an invalid API key or a prompt
+# exceeding the context window, so they fail again if retried. A request timeout, a conflict,
+# and a rate limit are transient.
+RETRYABLE_CLIENT_STATUS_CODES = {408, 409, 429}
+
+
+def is_timeout_error(error: BaseException) -> bool:
+    """
+    Check whether an exception raised by a provider SDK is a request timeout
+    """
+    if isinstance(error, (httpx.TimeoutException, TimeoutError)):
+        return True
+    # The SDKs wrap the timeouts of their HTTP clients, e.g., openai.APITimeoutError,
+    # anthropic.APITimeoutError, and google.api_core.exceptions.DeadlineExceeded
+    return type(error).__name__ in {"APITimeoutError", "DeadlineExceeded"}
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    Classify an exception raised by a provider SDK
+    :return: the kind of the failed request
+    """
+    # The HTTP status decides if any, and the message is only checked without it
+    status_code = get_status_code(error)
+    if status_code is not None:
+        if status_code == 429:
+            return RATE_LIMITED
+        if status_code == 408:
+            return TIMEOUT
+        if (
+            400 <= status_code < 500
+            and status_code not in RETRYABLE_CLIENT_STATUS_CODES
+        ):
+            return CLIENT_ERROR
+        if status_code >= 500:
+            return SERVER_ERROR
+    elif is_rate_limit_error(error):
+        return RATE_LIMITED
+    if is_timeout_error(error) or isinstance(error, asyncio.TimeoutError):
+        return TIMEOUT
+    return OTHER_ERROR
+
+
+class RetryPolicy:
+    """
+    Retry policy of the LLM requests, shared by all LLM instances in the process.
+    A failed request is retried after an exponential backoff with full jitter, so that the
+    requests failed by the same outage do not retry in lockstep. Client errors are not retried,
+    and rate-limited requests wait for the rate limiter instead of the backoff. A request failed by
+    its API key is retried immediately with another key.
+    """
+
+    def __init__(
+        self,
+        max_attempt_num: int = 5,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 30.0,
+    ) -> None:
+        """
+        :param max_attempt_num: the maximum number of attempts of a request
+        :param initial_backoff: the maximum backoff in seconds after the first attempt
+        :param max_backoff: the maximum backoff in seconds
+        """
+        self.max_attempt_num = max_attempt_num
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        return
+
+    def configure(self, max_attempt_num: int) -> None:
+        self.max_attempt_num = max_attempt_num
+
+    @staticmethod
+    def is_retryable(kind: str) -> bool:
+        return kind != CLIENT_ERROR
+
+    def get_backoff(self, attempt_num: int, kind: str) -> float:
+        """
+        :param attempt_num: the number of attempts made so far
+        :param kind: the kind of the last failure
+        :return: the number of seconds to wait before the next attempt
+        """
+        if kind in {RATE_LIMITED, KEY_ERROR}:
+            return 0.0
+        return random.uniform(
+            0, min(self.max_backoff, self.initial_backoff * 2 ** (attempt_num - 1))
+        )
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of an LLM provider, shared by all LLM instances in the process.
+    After consecutive failed attempts, e.g., during an outage, the circuit opens and the requests
+    fail fast instead of waiting for their timeouts and retries. Once the circuit has been open
+    for a while, a single probe request is let through: its success closes the circuit, and its
+    failure opens the circuit again for twice as long.
+    Rate-limited attempts, client errors, and failures of API keys do not indicate an outage and
+    are not counted.
+    It also counts the retries of the requests to the provider.
+    """
+
+    FAILURE_THRESHOLD = 5
+    INITIAL_OPEN_SECONDS = 10.0
+    MAX_OPEN_SECONDS = 300.0
+
+    def __init__(self, provider: str) -> None:
+        """
+        :param provider: the name of the provider
+        """
+        self.provider = provider
+        self.consecutive_failure_num = 0
+        self.open_until: Optional[float] = None
+        self.open_seconds = CircuitBreaker.INITIAL_OPEN_SECONDS
+        self.is_probing = False
+
+        self.retry_nums: Dict[str, int] = {}
+        self.failed_request_num = 0
+        self.open_num = 0
+        self.fast_failed_num = 0
+        self._lock = threading.Lock()
+        return
+
+    def allow(self) -> bool:
+        """
+        Check whether an attempt may be sent. Once the circuit has been open long enough,
+        the first caller is admitted as the probe.
+        """
+        with self._lock:
+            if self.open_until is None:
+                return True
+            if time.monotonic() >= self.open_until and not self.is_probing:
+                self.is_probing = True
+                return True
+            self.fast_failed_num += 1
+            return False
+
+    def record_success(self) -> None:
+        """
+        Record an attempt answered by the provider
+        """
+        with self._lock:
+            self.consecutive_failure_num = 0
+            self.open_until = None
+            self.open_seconds = CircuitBreaker.INITIAL_OPEN_SECONDS
+            self.is_probing = False
+
+    def record_failure(self, kind: str) -> None:
+        """
+        Record an attempt failed with an error
+        :param kind: the kind of the error
+        """
+        with self._lock:
+            if kind in {RATE_LIMITED, CLIENT_ERROR, KEY_ERROR}:
+                if self.is_probing:
+                    # The provider answered the probe
+                    self.is_probing = False
+                    self.open_until = None
+                return
+
+            now = time.monotonic()
+            self.consecutive_failure_num += 1
+            if self.is_probing:
+                self.is_probing = False
+                self.open_seconds = min(
+                    self.open_seconds * 2, CircuitBreaker.MAX_OPEN_SECONDS
+                )
+                self.open_until = now + self.open_seconds
+                self.open_num += 1
+            elif (
+                self.open_until is None
+                and self.consecutive_failure_num >= CircuitBreaker.FAILURE_THRESHOLD
+            ):
+                self.open_until = now + self.open_seconds
+                self.open_num += 1
+
+    def cancel(self) -> None:
+        """
+        Give up an admitted attempt without sending it, e.g., when the deadline is exceeded
+        """
+        with self._lock:
+            self.is_probing = False
+
+    def record_retry(self, kind: str) -> None:
+        """
+        Record the retry of a request
+        :param kind: the kind of the failure of the last attempt
+        """
+        with self._lock:
+            self.retry_nums[kind] = self.retry_nums.get(kind, 0) + 1
+
+    def record_failed_request(self) -> None:
+        """
+        Record a request failed after all its attempts
+        """
+        with self._lock:
+            self.failed_request_num += 1
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.open_until is not None
+
+    def __str__(self) -> str:
+        retry_num = sum(self.retry_nums.values())
+        retry_details = ", ".join(
+            f"{num} {kind}" for kind, num in sorted(self.retry_nums.items())
+        )
+        return (
+            f"{self.provider}: {retry_num} retried attempt(s)"
+            + (f" ({retry_details})" if retry_details else "")
+            + f", {self.failed_request_num} failed request(s), "
+            f"circuit opened {self.open_num} time(s), "
+            f"{self.fast_failed_num} fast-failed attempt(s)"
+        )
+
+
+_retry_policy = RetryPolicy()
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_retry_policy() -> RetryPolicy:
+    """
+    Get the retry policy shared in the process
+    """
+    return _retry_policy
+
+
+def get_circuit_breaker(provider: str) -> CircuitBreaker:
+    """
+    Get the circuit breaker of a provider, which is shared in the process
+    """
+    with _circuit_breakers_lock:
+        if provider not in _circuit_breakers:
+            _circuit_breakers[provider] = CircuitBreaker(provider)
+        return _circuit_breakers[provider]
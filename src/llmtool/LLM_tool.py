@@ -1,6 +1,25 @@
+import hashlib
+import time
 from llmtool.LLM_utils import *
+from llmtool.LLM_budget import *
+from llmtool.LLM_cache import *
+from llmtool.LLM_batch import *
+from llmtool.LLM_prompt_template import *
 from abc import ABC, abstractmethod
-from typing import Dict, Optional, Type, TypeVar, cast
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+    cast,
+)
 from ui.logger import Logger
 
 
@@ -22,6 +41,46 @@ class LLMToolOutput(ABC):
 
 
 T = TypeVar("T", bound=LLMToolOutput)
+R = TypeVar("R")
+
+# The follow-up turn asking the model to restate an unparsable response in the answer format
+REPAIR_PROMPT_TEMPLATE = PromptTemplate(
+    "Your response does not follow the required answer format. "
+    "Restate your final answer, without repeating the reasoning steps, "
+    "in exactly the following format:\n<ANSWER_FORMAT>"
+)
+
+
+class LLMQuery:
+    """
+    A query of an LLM tool. The invocations yield their queries, so that the synchronous and
+    asynchronous invocations share the same logic and only differ in how a query is sent.
+    """
+
+    def __init__(
+        self,
+        prompt: str,
+        early_stop: Optional[Callable[[str], bool]] = None,
+        prefix_length: int = 0,
+        model: Optional[LLM] = None,
+        output_schema: Optional[Dict[str, Any]] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> None:
+        """
+        :param prompt: the prompt
+        :param early_stop: the predicate stopping the generation once the answer is complete
+        :param prefix_length: the length of the prefix shared by the prompts of the tool
+        :param model: the model answering the query. None means the model of the tool.
+        :param output_schema: the JSON schema of a structured response, if any
+        :param history: the earlier turns of a multi-turn exchange, if any
+        """
+        self.prompt = prompt
+        self.early_stop = early_stop
+        self.prefix_length = prefix_length
+        self.model = model
+        self.output_schema = output_schema
+        self.history = history
+        return
 
 
 class LLMTool(ABC):
@@ -32,6 +91,13 @@ class LLMTool(ABC):
         language: str,
         max_query_num: int,
         logger: Logger,
+        budget: Optional[LLMBudget] = None,
+        persistent_cache: Optional[LLMResponseCache] = None,
+        deadline: Optional[float] = None,
+        max_output_length: Optional[int] = None,
+        stop_sequences: Optional[List[str]] = None,
+        batch_exporter: Optional[LLMBatchExporter] = None,
+        escalation_model_name: Optional[str] = None,
     ) -> None:
         self.language = language
         self.model_name = model_name
@@ -40,12 +106,65 @@ class LLMTool(ABC):
         self.max_query_num = max_query_num
         self.logger = logger
 
-        self.model = LLM(model_name, self.logger, temperature)
+        # The budget may be shared with other LLM tools. None means unlimited.
+        self.budget = budget
+        # The maximum number of seconds of a query, including the retries of failed requests.
+        # None means that only the request timeouts of the provider apply.
+        self.deadline = deadline
+
+        # The generation limits are per tool, e.g., verdicts need fewer output tokens
+        self.model = LLM(
+            model_name,
+            self.logger,
+            temperature,
+            max_output_length=max_output_length,
+            stop_sequences=stop_sequences,
+        )
+        # Cascade: the inputs answered by self.model with unparsable or low-confidence responses
+        # are escalated to a stronger model. None disables the cascade.
+        self.escalation_model: Optional[LLM] = None
+        if escalation_model_name is not None:
+            self.escalation_model = LLM(
+                escalation_model_name,
+                self.logger,
+                temperature,
+                max_output_length=max_output_length,
+                stop_sequences=stop_sequences,
+            )
+        # The responses of a cascade are cached apart from the responses of its first model
+        self.cache_model_name = (
+            model_name
+            if escalation_model_name is None
+            else f"{model_name}->{escalation_model_name}"
+        )
         self.cache: Dict[LLMToolInput, LLMToolOutput] = {}
 
+        # Parsable responses keyed by the digest of the prompt.
+        # Unlike self.cache, it can be dumped to checkpoints and reused by another run.
+        self.response_cache: Dict[str, str] = {}
+
+        # Responses shared across runs and processes. None disables the persistent cache.
+        self.persistent_cache = persistent_cache
+        # The digest of the prompt template file, set by _load_prompt_file
+        self.template_version = ""
+
+        # If given, the prompts are exported to an offline batch instead of being sent,
+        # and the inputs of the exported batched prompts wait for the batched responses
+        self.batch_exporter = batch_exporter
+        self.pending_inputs: Set[LLMToolInput] = set()
+
         self.input_token_cost = 0
         self.output_token_cost = 0
+        # The queries sent, including the follow-up turns repairing unparsable responses,
+        # each of which is charged to the budget
         self.total_query_num = 0
+        # The wall-clock time of the queries, including retries and rate limiting
+        self.query_seconds = 0.0
+        self.escalation_num = 0
+        # The responses from which no output is parsed, each of which is repaired or re-queried
+        self.unparsable_num = 0
+        self.repair_num = 0
+        self.repaired_num = 0
 
     def invoke(self, input: LLMToolInput, cls: Type[T]) -> Optional[T]:
         """
@@ -54,46 +173,514 @@ class LLMTool(ABC):
         :param cls: the class of the output
         :return: the output of the LLM tool
         """
-        output = self._invoke(input)
+        return self.__cast_output(self._invoke(input), cls)
+
+    def _invoke(self, input: LLMToolInput) -> Optional[LLMToolOutput]:
+        output, prompt = self.__prepare_invoke(input)
+        if output is not None:
+            return output
+        return self.__run_queries(self.__get_invoke_queries(input, prompt))
+
+    async def ainvoke(self, input: LLMToolInput, cls: Type[T]) -> Optional[T]:
+        """
+        Asynchronous counterpart of invoke. The LLM is queried on the running event loop.
+        :param input: the input of the LLM tool
+        :param cls: the class of the output
+        :return: the output of the LLM tool
+        """
+        output, prompt = self.__prepare_invoke(input)
         if output is None:
-            return None
+            output = await self.__arun_queries(self.__get_invoke_queries(input, prompt))
+        return self.__cast_output(output, cls)
 
+    @staticmethod
+    def __cast_output(output: Optional[LLMToolOutput], cls: Type[T]) -> Optional[T]:
+        if output is None:
+            return None
         if not isinstance(output, cls):
             raise TypeError(f"Expected output of type {cls}, but got {type(output)}")
-
         return cast(T, output)
 
-    def _invoke(self, input: LLMToolInput) -> Optional[LLMToolOutput]:
+    def __get_invoke_queries(
+        self, input: LLMToolInput, prompt: str
+    ) -> Generator[LLMQuery, str, Optional[LLMToolOutput]]:
+        """
+        The queries of an invocation, shared by _invoke and ainvoke.
+        The generator yields the queries, receives their responses, and returns the output.
+        """
+        single_query_num = 0
+        response = ""
+        model = self.model
+        output: Optional[LLMToolOutput] = None
+        # The low-confidence answer of the cheap model, used if the escalation fails
+        fallback: Optional[Tuple[str, LLMToolOutput]] = None
+        while single_query_num <= self.max_query_num:
+            single_query_num += 1
+            response = yield LLMQuery(
+                prompt,
+                self._get_early_stop(input),
+                self._get_prompt_prefix_length(input),
+                model,
+                self._get_output_schema(input),
+            )
+            self.logger.print_log("Response:", "\n", response)
+            output = self._parse_response(response, input)
+            self.__count_unparsable(response, output is None)
+            if output is None:
+                repaired_response = yield from self.__get_repair_queries(
+                    self._get_repair_prompts(input),
+                    response,
+                    model,
+                    self._get_output_schema(input),
+                )
+                if repaired_response is not None:
+                    output = self._parse_response(repaired_response, input)
+                    if output is not None:
+                        response = repaired_response
+                        self.repaired_num += 1
+            if not self.__is_repeated(model, output):
+                break
+            if output is not None:
+                fallback = (response, output)
+            elif response == "" and not self.__can_escalate(model):
+                # The request has failed after its retries, so it is not repeated
+                break
+            model = self.__escalate(model)
+        if output is None and fallback is not None:
+            response, output = fallback
+
+        self.__finish_invoke(input, prompt, response, output)
+        return output
+
+    def __run_queries(self, queries: Generator[LLMQuery, str, R]) -> R:
+        """
+        Send the queries of an invocation one by one
+        :param queries: the generator yielding the queries and receiving their responses
+        :return: the value returned by the generator
+        """
+        try:
+            query = next(queries)
+            while True:
+                query = queries.send(self.__query(query))
+        except StopIteration as stop:
+            return stop.value
+
+    async def __arun_queries(self, queries: Generator[LLMQuery, str, R]) -> R:
+        """
+        Asynchronous counterpart of __run_queries
+        """
+        try:
+            query = next(queries)
+            while True:
+                query = queries.send(await self.__aquery(query))
+        except StopIteration as stop:
+            return stop.value
+
+    def __is_repeated(self, model: LLM, output: Optional[LLMToolOutput]) -> bool:
+        """
+        Check whether the query is repeated, by the same model if the response is unparsable,
+        or by the escalation model if the answer of the cheap model is not confident
+        """
+        if output is None:
+            return True
+        return self.__can_escalate(model) and not self._is_confident(output)
+
+    def __count_unparsable(self, response: str, is_unparsable: bool) -> None:
+        """
+        Count an unparsable response. The responses of failed requests are not counted.
+        """
+        if response != "" and is_unparsable:
+            self.unparsable_num += 1
+
+    def __can_escalate(self, model: LLM) -> bool:
+        return self.escalation_model is not None and model is not self.escalation_model
+
+    def __escalate(self, model: LLM) -> LLM:
+        """
+        Get the model answering the next query, which is the escalation model if any
+        """
+        if not self.__can_escalate(model):
+            return model
+        assert self.escalation_model is not None
+        self.logger.print_log(
+            f"Escalate the query to {self.escalation_model.online_model_name}"
+        )
+        self.escalation_num += 1
+        return self.escalation_model
+
+    def __prepare_invoke(
+        self, input: LLMToolInput
+    ) -> Tuple[Optional[LLMToolOutput], str]:
+        """
+        Look up the caches before querying the LLM.
+        :return: the cached output if any, and the prompt of the input
+        """
         class_name = type(self).__name__
         self.logger.print_console(f"The LLM Tool {class_name} is invoked.")
         if input in self.cache:
             self.logger.print_log("Cache hit.")
-            return self.cache[input]
+            return self.cache[input], ""
+        if input in self.pending_inputs:
+            raise ResponsePendingError()
 
         prompt = self._get_prompt(input)
         self.logger.print_log("Prompt:", "\n", prompt)
 
+        response = self.__lookup_response(prompt)
+        if response is not None:
+            output = self._parse_response(response, input)
+            if output is not None:
+                self.logger.print_log("Response cache hit.")
+                self.cache[input] = output
+                return output, prompt
+        return None, prompt
+
+    def __finish_invoke(
+        self,
+        input: LLMToolInput,
+        prompt: str,
+        response: str,
+        output: Optional[LLMToolOutput],
+    ) -> None:
+        """
+        Cache the output of an invocation
+        """
+        if output is not None:
+            self.cache[input] = output
+            self.__store_response(prompt, response)
+
+    def invoke_batch(
+        self, inputs: Sequence[LLMToolInput], cls: Type[T]
+    ) -> List[Optional[T]]:
+        """
+        Invoke the LLM tool with several inputs in a single prompt.
+        The inputs that are not answered by the batched response are invoked separately.
+        :param inputs: the inputs of the LLM tool
+        :param cls: the class of the outputs
+        :return: the outputs of the LLM tool, in the order of the inputs
+        """
+        pending_inputs, prompt, outputs = self.__prepare_invoke_batch(inputs)
+        if len(pending_inputs) > 1:
+            try:
+                self.__run_queries(
+                    self.__get_invoke_batch_queries(pending_inputs, prompt, outputs)
+                )
+            except ResponsePendingError:
+                self.pending_inputs.update(pending_inputs)
+                raise
+        return [self.invoke(input, cls) for input in inputs]
+
+    async def ainvoke_batch(
+        self, inputs: Sequence[LLMToolInput], cls: Type[T]
+    ) -> List[Optional[T]]:
+        """
+        Asynchronous counterpart of invoke_batch
+        :param inputs: the inputs of the LLM tool
+        :param cls: the class of the outputs
+        :return: the outputs of the LLM tool, in the order of the inputs
+        """
+        pending_inputs, prompt, outputs = self.__prepare_invoke_batch(inputs)
+        if len(pending_inputs) > 1:
+            try:
+                await self.__arun_queries(
+                    self.__get_invoke_batch_queries(pending_inputs, prompt, outputs)
+                )
+            except ResponsePendingError:
+                self.pending_inputs.update(pending_inputs)
+                raise
+        return [await self.ainvoke(input, cls) for input in inputs]
+
+    def __get_invoke_batch_queries(
+        self,
+        pending_inputs: List[LLMToolInput],
+        prompt: str,
+        outputs: List[Optional[LLMToolOutput]],
+    ) -> Generator[LLMQuery, str, None]:
+        """
+        The queries of a batched invocation, shared by invoke_batch and ainvoke_batch.
+        Partially answered batches are accepted. The rest is invoked separately.
+        :param outputs: the outputs parsed from the cached response, if any
+        """
         single_query_num = 0
-        output = None
-        while True:
-            if single_query_num > self.max_query_num:
-                break
+        response = None
+        while (
+            all(output is None for output in outputs)
+            and single_query_num <= self.max_query_num
+        ):
             single_query_num += 1
-            response, input_token_cost, output_token_cost = self.model.infer(
-                prompt, True
+            response = yield LLMQuery(
+                prompt,
+                self._get_batch_early_stop(pending_inputs),
+                self._get_batch_prompt_prefix_length(pending_inputs),
+                output_schema=self._get_batch_output_schema(pending_inputs),
             )
             self.logger.print_log("Response:", "\n", response)
-            self.input_token_cost += input_token_cost
-            self.output_token_cost += output_token_cost
-            output = self._parse_response(response, input)
+            if response == "":
+                # The request has failed after its retries
+                break
+            outputs = self._parse_batch_response(response, pending_inputs)
+            self.__count_unparsable(response, all(output is None for output in outputs))
+            if all(output is None for output in outputs):
+                repaired_response = yield from self.__get_repair_queries(
+                    self._get_batch_repair_prompts(pending_inputs),
+                    response,
+                    self.model,
+                    self._get_batch_output_schema(pending_inputs),
+                )
+                if repaired_response is not None:
+                    outputs = self._parse_batch_response(
+                        repaired_response, pending_inputs
+                    )
+                    if any(output is not None for output in outputs):
+                        response = repaired_response
+                        self.repaired_num += 1
+            outputs = self.__filter_confident_outputs(outputs)
+        self.__finish_invoke_batch(pending_inputs, prompt, response, outputs)
+
+    def __prepare_invoke_batch(
+        self, inputs: Sequence[LLMToolInput]
+    ) -> Tuple[List[LLMToolInput], str, List[Optional[LLMToolOutput]]]:
+        """
+        Collect the uncached inputs of a batch and look up the response cache.
+        :return: the uncached inputs, the batched prompt, and the outputs parsed from the cached response.
+        The prompt is only constructed if there are more than one uncached inputs.
+        """
+        pending_inputs: List[LLMToolInput] = []
+        for input in inputs:
+            if input not in self.cache and input not in pending_inputs:
+                pending_inputs.append(input)
+        outputs: List[Optional[LLMToolOutput]] = [None] * len(pending_inputs)
+        if len(pending_inputs) <= 1:
+            return pending_inputs, "", outputs
+
+        class_name = type(self).__name__
+        self.logger.print_console(
+            f"The LLM Tool {class_name} is invoked with a batch of {len(pending_inputs)} inputs."
+        )
+        prompt = self._get_batch_prompt(pending_inputs)
+        self.logger.print_log("Prompt:", "\n", prompt)
+
+        response = self.__lookup_response(prompt)
+        if response is not None:
+            self.logger.print_log("Response cache hit.")
+            outputs = self.__filter_confident_outputs(
+                self._parse_batch_response(response, pending_inputs)
+            )
+        return pending_inputs, prompt, outputs
 
+    def __filter_confident_outputs(
+        self, outputs: List[Optional[LLMToolOutput]]
+    ) -> List[Optional[LLMToolOutput]]:
+        """
+        Discard the low-confidence outputs of a batched response of the cheap model,
+        so that their inputs are invoked separately and escalated
+        """
+        if self.escalation_model is None:
+            return outputs
+        return [
+            output if output is not None and self._is_confident(output) else None
+            for output in outputs
+        ]
+
+    def __finish_invoke_batch(
+        self,
+        pending_inputs: List[LLMToolInput],
+        prompt: str,
+        response: Optional[str],
+        outputs: List[Optional[LLMToolOutput]],
+    ) -> None:
+        """
+        Cache the outputs of a batched invocation
+        """
+        if response is not None and any(output is not None for output in outputs):
+            self.__store_response(prompt, response)
+        for input, output in zip(pending_inputs, outputs):
             if output is not None:
-                break
+                self.cache[input] = output
 
-        self.total_query_num += single_query_num
-        if output is not None:
-            self.cache[input] = output
-        return output
+    @staticmethod
+    def __get_prompt_digest(prompt: str) -> str:
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    def __lookup_response(self, prompt: str) -> Optional[str]:
+        """
+        Look up the response of a prompt in the response cache and then the persistent cache
+        """
+        prompt_digest = self.__get_prompt_digest(prompt)
+        response = self.response_cache.get(prompt_digest)
+        if response is None and self.persistent_cache is not None:
+            response = self.persistent_cache.get(
+                self.cache_model_name,
+                self.temperature,
+                type(self).__name__,
+                self.get_template_version(),
+                prompt_digest,
+            )
+            if response is not None:
+                self.response_cache[prompt_digest] = response
+        return response
+
+    def __store_response(self, prompt: str, response: str) -> None:
+        prompt_digest = self.__get_prompt_digest(prompt)
+        self.response_cache[prompt_digest] = response
+        if self.persistent_cache is not None:
+            self.persistent_cache.put(
+                self.cache_model_name,
+                self.temperature,
+                type(self).__name__,
+                self.get_template_version(),
+                prompt_digest,
+                response,
+            )
+
+    def _load_prompt_file(self, prompt_file: str) -> Dict:
+        """
+        Load the JSON prompt template file, which is done once when the tool is constructed
+        :param prompt_file: the path of the prompt template file
+        :return: the prompt template dict
+        """
+        with open(prompt_file, "rb") as f:
+            content = f.read()
+        self.prompt_file = prompt_file
+        self.template_version = hashlib.sha256(content).hexdigest()
+        return json.loads(content)
+
+    def get_template_version(self) -> str:
+        """
+        Get the version of the prompt template, i.e., the digest of the template file.
+        Responses cached with other versions of the template are not reused.
+        """
+        return self.template_version
+
+    def __query(self, query: LLMQuery) -> str:
+        """
+        Query the model and charge the budget.
+        Raise BudgetExhaustedError without querying if the budget is exhausted.
+        :return: the response
+        """
+        model = self.__start_query(query)
+        start_time = time.monotonic()
+        response, input_token_cost, output_token_cost = model.infer(
+            query.prompt,
+            True,
+            self.deadline,
+            query.early_stop,
+            query.prefix_length,
+            query.output_schema,
+            query.history,
+        )
+        self.__charge(model, input_token_cost, output_token_cost, start_time)
+        return response
+
+    async def __aquery(self, query: LLMQuery) -> str:
+        """
+        Asynchronous counterpart of __query
+        """
+        model = self.__start_query(query)
+        start_time = time.monotonic()
+        response, input_token_cost, output_token_cost = await model.ainfer(
+            query.prompt,
+            True,
+            self.deadline,
+            query.early_stop,
+            query.prefix_length,
+            query.output_schema,
+            query.history,
+        )
+        self.__charge(model, input_token_cost, output_token_cost, start_time)
+        return response
+
+    def __start_query(self, query: LLMQuery) -> LLM:
+        """
+        Export the prompt in an offline scan, and reserve a query of the budget
+        :return: the model answering the query
+        """
+        model = query.model if query.model is not None else self.model
+        self.__export(query.prompt, model, query.output_schema)
+        if self.budget is not None:
+            self.budget.reserve_query()
+        self.total_query_num += 1
+        return model
+
+    def __get_repair_queries(
+        self,
+        repair_prompts: Optional[Tuple[str, str]],
+        response: str,
+        model: LLM,
+        output_schema: Optional[Dict[str, Any]],
+    ) -> Generator[LLMQuery, str, Optional[str]]:
+        """
+        Ask the model to restate an unparsable response in the answer format in a follow-up turn,
+        instead of sending the whole prompt again. The exchange opens with the question without
+        the code, so that the repair is much shorter than the prompt.
+        :param repair_prompts: the question and the answer format, if the tool repairs responses
+        :param response: the unparsable response
+        :return: the repaired response, or None if the response is not repaired, e.g.,
+        in an offline scan
+        """
+        if repair_prompts is None or response == "" or self.batch_exporter is not None:
+            return None
+        question, answer_format = repair_prompts
+        self.repair_num += 1
+        self.logger.print_log("Ask the model to repair the unparsable response")
+        repaired_response = yield LLMQuery(
+            REPAIR_PROMPT_TEMPLATE.render({"ANSWER_FORMAT": answer_format}),
+            model=model,
+            output_schema=output_schema,
+            history=[
+                {"role": "user", "content": question},
+                {"role": "assistant", "content": response},
+            ],
+        )
+        self.logger.print_log("Repaired response:", "\n", repaired_response)
+        return repaired_response if repaired_response != "" else None
+
+    def __charge(
+        self,
+        model: LLM,
+        input_token_cost: int,
+        output_token_cost: int,
+        start_time: float,
+    ) -> None:
+        """
+        Record the tokens and the time of a query, and charge the budget
+        """
+        self.input_token_cost += input_token_cost
+        self.output_token_cost += output_token_cost
+        self.query_seconds += time.monotonic() - start_time
+        if self.budget is not None:
+            self.budget.charge(
+                input_token_cost, output_token_cost, model.online_model_name
+            )
+
+    def __export(
+        self, prompt: str, model: LLM, output_schema: Optional[Dict[str, Any]]
+    ) -> None:
+        """
+        Export the prompt to the offline batch, if any, and raise ResponsePendingError
+        """
+        if self.batch_exporter is None:
+            return
+        self.batch_exporter.add(
+            get_batch_custom_id(type(self).__name__, self.__get_prompt_digest(prompt)),
+            model.get_request_body(prompt, output_schema),
+        )
+        self.logger.print_log("Prompt exported to the offline batch.")
+        raise ResponsePendingError()
+
+    def dump_response_cache(self) -> Dict[str, str]:
+        """
+        Dump the parsable responses, e.g., for checkpointing.
+        :return: the map from prompt digests to responses
+        """
+        return self.response_cache.copy()
+
+    def load_response_cache(self, response_cache: Dict[str, str]) -> None:
+        """
+        Load the responses dumped by a previous run.
+        :param response_cache: the map from prompt digests to responses
+        """
+        self.response_cache.update(response_cache)
 
     @abstractmethod
     def _get_prompt(self, input: LLMToolInput) -> str:
@@ -104,3 +691,119 @@ class LLMTool(ABC):
         self, response: str, input: Optional[LLMToolInput] = None
     ) -> Optional[LLMToolOutput]:
         pass
+
+    def _is_confident(self, output: LLMToolOutput) -> bool:
+        """
+        Check whether the answer of the cheap model is accepted without escalation.
+        The default True only escalates unparsable responses.
+        """
+        return True
+
+    def _get_prompt_prefix_length(self, input: LLMToolInput) -> int:
+        """
+        Get the length of the prefix of the prompt shared by all the prompts of the tool,
+        which is cached by the provider. The default 0 marks no prefix.
+        """
+        return 0
+
+    def _get_batch_prompt_prefix_length(self, inputs: List[LLMToolInput]) -> int:
+        """
+        Counterpart of _get_prompt_prefix_length for batched prompts
+        """
+        return 0
+
+    def get_usage_summary(self) -> str:
+        """
+        Summarize the tokens and the time spent by the tool, including the input tokens served
+        from the prompt cache of the provider and the queries escalated to the stronger model
+        """
+        model_names = self.model.online_model_name
+        cached_input_token_num = self.model.cached_input_token_num
+        if self.escalation_model is not None:
+            model_names += f" -> {self.escalation_model.online_model_name}"
+            cached_input_token_num += self.escalation_model.cached_input_token_num
+        average_seconds = (
+            self.query_seconds / self.total_query_num
+            if self.total_query_num > 0
+            else 0.0
+        )
+        summary = (
+            f"{type(self).__name__} ({model_names}): {self.input_token_cost} input token(s) "
+            f"({cached_input_token_num} cached), {self.output_token_cost} output token(s), "
+            f"{self.total_query_num} query(ies), {self.query_seconds:.1f} s "
+            f"({average_seconds:.2f} s/query), "
+            f"{self.unparsable_num} unparsable response(s), "
+            f"{self.repaired_num}/{self.repair_num} repaired"
+        )
+        if self.escalation_model is not None:
+            summary += f", {self.escalation_num} escalation(s)"
+        return summary
+
+    def _get_early_stop(self, input: LLMToolInput) -> Optional[Callable[[str], bool]]:
+        """
+        Get the predicate checking whether a partial response already contains the answer.
+        If a predicate is returned, the response is streamed and its generation is stopped once
+        the predicate holds. The default None waits for the complete response.
+        """
+        return None
+
+    def _get_batch_early_stop(
+        self, inputs: List[LLMToolInput]
+    ) -> Optional[Callable[[str], bool]]:
+        """
+        Counterpart of _get_early_stop for batched prompts
+        """
+        return None
+
+    def _get_repair_prompts(self, input: LLMToolInput) -> Optional[Tuple[str, str]]:
+        """
+        Get the prompts of the exchange repairing an unparsable response, in which the model
+        restates its answer in the answer format instead of answering the whole prompt again.
+        :return: the question of the input without the code, and the answer format.
+        The default None re-queries the whole prompt.
+        """
+        return None
+
+    def _get_batch_repair_prompts(
+        self, inputs: List[LLMToolInput]
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Counterpart of _get_repair_prompts for batched prompts
+        """
+        return None
+
+    def _get_output_schema(self, input: LLMToolInput) -> Optional[Dict[str, Any]]:
+        """
+        Get the JSON schema of the response, for the tools answering in structured output.
+        If a schema is returned, the provider is asked for a JSON response conforming to it,
+        and the response is not streamed. The default None asks for a free-text response.
+        """
+        return None
+
+    def _get_batch_output_schema(
+        self, inputs: List[LLMToolInput]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Counterpart of _get_output_schema for batched prompts
+        """
+        return None
+
+    def _get_batch_prompt(self, inputs: List[LLMToolInput]) -> str:
+        """
+        Construct a single prompt for several inputs.
+        Tools supporting batched invocation override this method and _parse_batch_response.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support batched invocation"
+        )
+
+    def _parse_batch_response(
+        self, response: str, inputs: List[LLMToolInput]
+    ) -> List[Optional[LLMToolOutput]]:
+        """
+        Parse the response of a batched prompt.
+        :return: the outputs in the order of the inputs. None for the unanswered inputs.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support batched invocation"
+        )
@@ -1,7 +1,7 @@
 # Imports
 from openai import *
 from pathlib import Path
-from typing import Tuple
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple
 import google.generativeai as genai
 from zhipuai import ZhipuAI
 import anthropic
@@ -11,265 +11,1403 @@ import tiktoken
 import time
 import os
 import concurrent.futures
-from functools import partial
+import httpx
+import asyncio
+from functools import lru_cache, partial
 import threading
 
+import hashlib
 import json
- # FIXME: an isue when installing botocore and boto3. I comment this function temporarily.
-#from botocore.config import Config
-#from botocore.exceptions import BotoCoreError, ClientError
+
+# FIXME: an isue when installing botocore and boto3. I comment this function temporarily.
+# from botocore.config import Config
+# from botocore.exceptions import BotoCoreError, ClientError
 # import boto3
 from ui.logger import Logger
+from llmtool.LLM_rate_limiter import *
+from llmtool.LLM_client_pool import *
+from llmtool.LLM_recorder import *
+from llmtool.LLM_endpoint import *
+from llmtool.LLM_retry import *
+from llmtool.LLM_key_pool import *
+
+
+def get_usage(response) -> Optional[Tuple[int, int, int]]:
+    """
+    Get the numbers of tokens reported in a response of a provider SDK
+    :return: the numbers of input, output, and cached input tokens,
+    or None if the response has no usage
+    """
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        # OpenAI, OpenAI-compatible APIs, e.g., DeepSeek, and Zhipu AI
+        if getattr(usage, "prompt_tokens", None) is not None:
+            cached_token_num = getattr(
+                getattr(usage, "prompt_tokens_details", None), "cached_tokens", None
+            )
+            if cached_token_num is None:
+                # DeepSeek reports the cache hits separately
+                cached_token_num = getattr(usage, "prompt_cache_hit_tokens", None)
+            return (
+                usage.prompt_tokens,
+                usage.completion_tokens or 0,
+                cached_token_num or 0,
+            )
+        # Anthropic, whose input tokens exclude the tokens read from or written to the cache
+        if getattr(usage, "input_tokens", None) is not None:
+            cache_read_token_num = getattr(usage, "cache_read_input_tokens", None) or 0
+            cache_creation_token_num = (
+                getattr(usage, "cache_creation_input_tokens", None) or 0
+            )
+            return (
+                usage.input_tokens + cache_read_token_num + cache_creation_token_num,
+                usage.output_tokens or 0,
+                cache_read_token_num,
+            )
+    # Gemini
+    usage_metadata = getattr(response, "usage_metadata", None)
+    if (
+        usage_metadata is not None
+        and getattr(usage_metadata, "prompt_token_count", None) is not None
+    ):
+        return (
+            usage_metadata.prompt_token_count,
+            usage_metadata.candidates_token_count or 0,
+            getattr(usage_metadata, "cached_content_token_count", None) or 0,
+        )
+    return None
+
+
+@lru_cache(maxsize=None)
+def get_encoding(online_model_name: str) -> tiktoken.Encoding:
+    """
+    Get the tokenizer of a model, which is loaded once per model in the process.
+    It is only used when the provider does not report the usage, or to estimate the input tokens
+    for the rate limiter. For the models of other providers than OpenAI, cl100k_base is an
+    approximation.
+    """
+    try:
+        return tiktoken.encoding_for_model(online_model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def get_chunk_text(chunk) -> str:
+    """
+    Get the text in a chunk of a streamed response of a provider SDK
+    """
+    # OpenAI, OpenAI-compatible APIs, e.g., DeepSeek, and Zhipu AI
+    choices = getattr(chunk, "choices", None)
+    if choices:
+        return getattr(choices[0].delta, "content", None) or ""
+    # Anthropic
+    delta = getattr(chunk, "delta", None)
+    if delta is not None:
+        return getattr(delta, "text", None) or ""
+    # Gemini
+    if getattr(chunk, "candidates", None):
+        try:
+            return chunk.text
+        except ValueError:
+            return ""
+    return ""
+
+
+class StreamReader:
+    """
+    Accumulate the chunks of a streamed response.
+    The early-stop predicate is checked whenever a line is completed, and only sees the complete
+    lines, so that a partially streamed answer, e.g., "Answer: Ye", is never parsed.
+    """
+
+    def __init__(self, early_stop: Callable[[str], bool]) -> None:
+        """
+        :param early_stop: the predicate deciding whether the response received so far
+        already contains the answer
+        """
+        self.early_stop = early_stop
+        self.parts: List[str] = []
+        self.input_token_num: Optional[int] = None
+        self.output_token_num: Optional[int] = None
+        self.cached_token_num = 0
+        self.is_stopped = False
+        return
+
+    def feed(self, chunk) -> bool:
+        """
+        Add a chunk to the response
+        :return: whether the rest of the response can be discarded
+        """
+        self.__update_usage(chunk)
+        text = get_chunk_text(chunk)
+        if not text:
+            return False
+        self.parts.append(text)
+        if "\n" not in text:
+            return False
+        response = "".join(self.parts)
+        self.parts = [response]
+        complete_response = response[: response.rfind("\n") + 1]
+        if self.early_stop(complete_response):
+            self.parts = [complete_response]
+            self.is_stopped = True
+        return self.is_stopped
+
+    def __update_usage(self, chunk) -> None:
+        usage = get_usage(chunk)
+        if usage is None and getattr(chunk, "message", None) is not None:
+            # Anthropic reports the input tokens at the start of the message
+            usage = get_usage(chunk.message)
+        if usage is not None:
+            self.input_token_num, self.output_token_num, self.cached_token_num = usage
+            return
+        output_token_num = getattr(getattr(chunk, "usage", None), "output_tokens", None)
+        if output_token_num is not None:
+            # ... and the output tokens at the end of the message
+            self.output_token_num = output_token_num
+
+    def get_result(self) -> Tuple[str, Optional[Tuple[int, int, int]]]:
+        """
+        :return: the response, and the usage reported by the provider. The usage of a response
+        stopped early is unknown, as it is only reported at the end of the stream.
+        """
+        usage = None
+        if (
+            not self.is_stopped
+            and self.input_token_num is not None
+            and self.output_token_num is not None
+        ):
+            usage = (self.input_token_num, self.output_token_num, self.cached_token_num)
+        return "".join(self.parts), usage
+
+
+class ProviderRequest:
+    """
+    A request to the provider serving a model, built once per inference.
+    The synchronous and asynchronous inferences send the same request, and only differ in the
+    client calling the SDK.
+    """
+
+    def __init__(
+        self,
+        get_create: Callable[[Optional[str], bool], Callable[..., Any]],
+        kwargs: Dict[str, Any],
+        get_text: Callable[[Any], str],
+        timeout: float,
+        early_stop: Optional[Callable[[str], bool]] = None,
+        error_prefix: str = "API error",
+        key_pool: Optional[APIKeyPool] = None,
+        is_async_supported: bool = True,
+    ) -> None:
+        """
+        :param get_create: the function getting the SDK method creating a response, given the
+        API key and whether the client is async. The method takes the request timeout as the
+        keyword argument timeout.
+        :param kwargs: the other keyword arguments of the method, e.g., the messages
+        :param get_text: the function getting the text of a complete response
+        :param timeout: the timeout of a request in seconds
+        :param early_stop: the early-stop predicate, if the response is streamed
+        :param error_prefix: the prefix of the logged errors
+        :param key_pool: the API keys of the provider, one of which is selected per attempt
+        :param is_async_supported: whether the SDK has an async client. Otherwise, an async
+        request runs the synchronous client in the default executor.
+        """
+        self.get_create = get_create
+        self.kwargs = kwargs
+        self.get_text = get_text
+        self.timeout = timeout
+        self.early_stop = early_stop
+        self.error_prefix = error_prefix
+        self.key_pool = key_pool
+        self.is_async_supported = is_async_supported
+        return
+
+
+# The steps of the attempts of a request, which are run by LLM.run_with_retry or
+# LLM.arun_with_retry
+RETRY_ACQUIRE = "acquire"
+RETRY_CALL = "call"
+RETRY_SLEEP = "sleep"
 
 
 class LLM:
     """
     An online inference model using different LLMs:
-    - Gemini
+    - Any model served by an OpenAI-compatible endpoint, e.g., vLLM or llama.cpp server
     - OpenAI: GPT-3.5, GPT-4, o3-mini
     - DeepSeek: V3, R1 (uses OpenAI-compatible API)
     - Claude: 3.5 and 3.7 (via API key or AWS Bedrock)
     - GLM: Zhipu AI models
     """
 
+    # Claude requires the maximum number of output tokens
+    DEFAULT_MAX_OUTPUT_LENGTH = 4096
+    # The name of the JSON schema of a structured response, or the tool submitting it
+    ANSWER_TOOL_NAME = "answer"
+
     def __init__(
         self,
         online_model_name: str,
         logger: Logger,
         temperature: float = 0.0,
         system_role: str = "You are an experienced programmer and good at understanding programs written in mainstream programming languages.",
-        max_output_length: int = 4096,
+        max_output_length: Optional[int] = None,
+        stop_sequences: Optional[List[str]] = None,
     ) -> None:
+        """
+        :param online_model_name: the model name
+        :param logger: the logger
+        :param temperature: the temperature
+        :param system_role: the system prompt
+        :param max_output_length: the maximum number of output tokens. None means the default of the provider.
+        :param stop_sequences: the sequences stopping the generation
+        """
         self.online_model_name = online_model_name
-        self.encoding = tiktoken.encoding_for_model(
-            "gpt-3.5-turbo-0125"
-        )  # We only use gpt-3.5 to measure token cost
         self.temperature = temperature
         self.systemRole = system_role
         self.logger = logger
         self.max_output_length = max_output_length
+        self.stop_sequences = stop_sequences
+        # The input tokens served from the prompt cache of the provider
+        self.cached_input_token_num = 0
+        self._lock = threading.Lock()
+        # The model is served by its own endpoint if registered, whatever its name is
+        self.endpoint = get_endpoint(online_model_name)
+
+        # The rate limiter is shared by all LLM instances of the same provider
+        self.rate_limiter = get_rate_limiter(LLM.get_provider(online_model_name))
+        # The retry policy is shared by all LLM instances, and the circuit breaker by all
+        # LLM instances of the same provider
+        self.retry_policy = get_retry_policy()
+        self.circuit_breaker = get_circuit_breaker(LLM.get_provider(online_model_name))
+        # The clients are shared by all LLM instances, keeping their connections alive
+        self.client_pool = get_client_pool()
+        # The recorder is shared by all LLM instances, recording or replaying the inferences
+        self.recorder = get_llm_recorder()
         return
 
+    @property
+    def encoding(self) -> tiktoken.Encoding:
+        """
+        The tokenizer of the model, loaded on the first use
+        """
+        return get_encoding(self.online_model_name)
+
+    @staticmethod
+    def get_provider(online_model_name: str) -> str:
+        """
+        Get the provider serving the model, following the dispatch in __get_request
+        """
+        endpoint = get_endpoint(online_model_name)
+        if endpoint is not None:
+            return endpoint.get_provider()
+        if "gemini" in online_model_name:
+            return "google"
+        elif "gpt" in online_model_name or "o3-mini" in online_model_name:
+            return "openai"
+        elif "claude" in online_model_name:
+            return "anthropic"
+        elif "deepseek" in online_model_name:
+            return "deepseek"
+        elif "glm" in online_model_name:
+            return "zhipuai"
+        return online_model_name
+
+    def get_request_body(
+        self, message: str, output_schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Get the body of the chat completion request of a prompt in the format of OpenAI,
+        e.g., for the batch API of a provider
+        :param output_schema: the JSON schema of the response, if any
+        """
+        body: Dict[str, Any] = {
+            "model": self.online_model_name,
+            "messages": [
+                {"role": "system", "content": self.systemRole},
+                {"role": "user", "content": message},
+            ],
+        }
+        if "o3-mini" in self.online_model_name:
+            body.update(
+                self.__get_generation_kwargs(
+                    max_tokens_key="max_completion_tokens", stop_key=None
+                )
+            )
+        else:
+            body["temperature"] = self.temperature
+            body.update(self.__get_generation_kwargs())
+        body.update(self.__get_response_format_kwargs(output_schema))
+        return body
+
     def infer(
-        self, message: str, is_measure_cost: bool = False
+        self,
+        message: str,
+        is_measure_cost: bool = False,
+        deadline: Optional[float] = None,
+        early_stop: Optional[Callable[[str], bool]] = None,
+        prefix_length: int = 0,
+        output_schema: Optional[Dict[str, Any]] = None,
+        history: Optional[List[Dict[str, str]]] = None,
     ) -> Tuple[str, int, int]:
+        """
+        :param message: the prompt
+        :param is_measure_cost: whether to count the input and output tokens
+        :param deadline: the maximum number of seconds of the inference, including retries.
+        None means that only the request timeout of the provider applies.
+        :param early_stop: the predicate checking whether a partial response already contains
+        the answer. If given, the response is streamed and the generation is cancelled
+        once the predicate holds.
+        :param prefix_length: the length of the prefix of the prompt shared by other prompts,
+        e.g., the task and the examples, which is marked for the prompt caching of the provider
+        :param output_schema: the JSON schema of the response. If given, the provider is asked
+        for a JSON response, conforming to the schema where the provider supports it, e.g.,
+        by the structured outputs of OpenAI or the tool calling of Claude
+        :param history: the earlier turns of a multi-turn exchange, i.e., the user prompts and
+        the assistant responses preceding the prompt. None means a single-turn exchange.
+        :return: the response, and the numbers of input and output tokens
+        """
         self.logger.print_log(self.online_model_name, "is running")
-        output = ""
-        if "gemini" in self.online_model_name:
-            output = self.infer_with_gemini(message)
-        elif "gpt" in self.online_model_name:
-            output = self.infer_with_openai_model(message)
-        elif "o3-mini" in self.online_model_name:
-            output = self.infer_with_o3_mini_model(message)
-        elif "claude" in self.online_model_name:
-            output = self.infer_with_claude_key(message)
-            # output = self.infer_with_claude_aws_bedrock(message)
-        elif "deepseek" in self.online_model_name:
-            output = self.infer_with_deepseek_model(message)
-        elif "glm" in self.online_model_name:
-            output = self.infer_with_glm_model(message)
+        if output_schema is not None:
+            # A JSON response is only parsable once it is complete
+            early_stop = None
+        if self.recorder.is_replaying():
+            output, usage = self.recorder.replay(
+                self.online_model_name, self.systemRole, message, history
+            )
         else:
-            raise ValueError("Unsupported model name")
+            start_time = time.monotonic()
+            output, usage = self.__infer_online(
+                message,
+                deadline,
+                early_stop,
+                prefix_length,
+                output_schema,
+                history,
+            )
+            if self.recorder.is_recording():
+                self.recorder.record(
+                    self.online_model_name,
+                    self.systemRole,
+                    message,
+                    output,
+                    usage,
+                    time.monotonic() - start_time,
+                    history,
+                )
 
-        input_token_cost = (
-            0
-            if not is_measure_cost
-            else len(self.encoding.encode(self.systemRole))
-            + len(self.encoding.encode(message))
+        input_token_cost, output_token_cost = self.__get_token_cost(
+            message, output, usage, is_measure_cost, history
         )
-        output_token_cost = (
-            0 if not is_measure_cost else len(self.encoding.encode(output))
+        return output, input_token_cost, output_token_cost
+
+    def __infer_online(
+        self,
+        message: str,
+        deadline: Optional[float],
+        early_stop: Optional[Callable[[str], bool]],
+        prefix_length: int,
+        output_schema: Optional[Dict[str, Any]],
+        history: Optional[List[Dict[str, str]]],
+    ) -> Tuple[str, Optional[Tuple[int, int, int]]]:
+        """
+        Send the prompt to the provider serving the model
+        :return: the response, and the usage reported by the provider
+        """
+        request = self.__get_request(
+            message, early_stop, prefix_length, output_schema, history
+        )
+        return self.__run_request(request, message, deadline)
+
+    async def ainfer(
+        self,
+        message: str,
+        is_measure_cost: bool = False,
+        deadline: Optional[float] = None,
+        early_stop: Optional[Callable[[str], bool]] = None,
+        prefix_length: int = 0,
+        output_schema: Optional[Dict[str, Any]] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> Tuple[str, int, int]:
+        """
+        Asynchronous counterpart of infer. The request is awaited on the running event loop
+        instead of blocking a worker thread.
+        """
+        self.logger.print_log(self.online_model_name, "is running")
+        if output_schema is not None:
+            early_stop = None
+        if self.recorder.is_replaying():
+            output, usage = await self.recorder.areplay(
+                self.online_model_name, self.systemRole, message, history
+            )
+        else:
+            start_time = time.monotonic()
+            output, usage = await self.__ainfer_online(
+                message,
+                deadline,
+                early_stop,
+                prefix_length,
+                output_schema,
+                history,
+            )
+            if self.recorder.is_recording():
+                self.recorder.record(
+                    self.online_model_name,
+                    self.systemRole,
+                    message,
+                    output,
+                    usage,
+                    time.monotonic() - start_time,
+                    history,
+                )
+
+        input_token_cost, output_token_cost = self.__get_token_cost(
+            message, output, usage, is_measure_cost, history
         )
         return output, input_token_cost, output_token_cost
 
-    def run_with_timeout(self, func, timeout):
-        """Run a function with timeout that works in multiple threads"""
-        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(func)
-            try:
-                return future.result(timeout=timeout)
-            except concurrent.futures.TimeoutError:
-                ("Operation timed out")
-                return ""
-            except Exception as e:
-                self.logger.print_log(f"Operation failed: {e}")
-                return ""
+    async def __ainfer_online(
+        self,
+        message: str,
+        deadline: Optional[float],
+        early_stop: Optional[Callable[[str], bool]],
+        prefix_length: int,
+        output_schema: Optional[Dict[str, Any]],
+        history: Optional[List[Dict[str, str]]],
+    ) -> Tuple[str, Optional[Tuple[int, int, int]]]:
+        """
+        Asynchronous counterpart of __infer_online
+        """
+        request = self.__get_request(
+            message, early_stop, prefix_length, output_schema, history
+        )
+        return await self.__arun_request(request, message, deadline)
+
+    def __get_token_cost(
+        self,
+        message: str,
+        output: str,
+        usage: Optional[Tuple[int, int, int]],
+        is_measure_cost: bool,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> Tuple[int, int]:
+        """
+        Get the numbers of input and output tokens of an inference.
+        The usage reported by the provider is preferred over the local tokenizer.
+        """
+        if usage is not None:
+            with self._lock:
+                self.cached_input_token_num += usage[2]
+        if not is_measure_cost:
+            return 0, 0
+        if usage is not None:
+            return usage[0], usage[1]
+        input_token_cost = len(self.encoding.encode(self.systemRole)) + len(
+            self.encoding.encode(message)
+        )
+        for turn in history or []:
+            input_token_cost += len(self.encoding.encode(turn["content"]))
+        output_token_cost = len(self.encoding.encode(output))
+        return input_token_cost, output_token_cost
+
+    def __get_generation_kwargs(
+        self,
+        max_tokens_key: Optional[str] = "max_tokens",
+        stop_key: Optional[str] = "stop",
+    ) -> Dict[str, Any]:
+        """
+        Get the keyword arguments limiting the generation, which are only passed if configured
+        :param max_tokens_key: the name of the maximum number of output tokens in the API, if any
+        :param stop_key: the name of the stop sequences in the API, if any
+        """
+        kwargs: Dict[str, Any] = {}
+        if max_tokens_key is not None and self.max_output_length is not None:
+            kwargs[max_tokens_key] = self.max_output_length
+        if stop_key is not None and self.stop_sequences:
+            kwargs[stop_key] = self.stop_sequences
+        return kwargs
 
-    def infer_with_gemini(self, message: str) -> str:
-        """Infer using the Gemini model from Google Generative AI"""
-        gemini_model = genai.GenerativeModel("gemini-pro")
+    def __get_chat_messages(
+        self, message: str, history: Optional[List[Dict[str, str]]]
+    ) -> List[Dict[str, str]]:
+        """
+        Get the messages of OpenAI-compatible APIs, i.e., the system role, the earlier turns,
+        and the prompt
+        """
+        return [
+            {"role": "system", "content": self.systemRole},
+            *(history or []),
+            {"role": "user", "content": message},
+        ]
 
-        def call_api():
-            message_with_role = self.systemRole + "\n" + message
-            safety_settings = [
+    def __get_claude_messages(
+        self,
+        message: str,
+        prefix_length: int,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> List[Dict]:
+        """
+        Get the messages of Claude. The system role and the shared prefix of the prompt form
+        a separate content block marked as a breakpoint of the prompt cache.
+        In a multi-turn exchange, the system role precedes the first turn instead.
+        """
+        if history:
+            first_turn, *turns = history
+            return [
                 {
-                    "category": "HARM_CATEGORY_DANGEROUS",
-                    "threshold": "BLOCK_NONE",
+                    "role": first_turn["role"],
+                    "content": f"{self.systemRole}\n\n{first_turn['content']}",
                 },
-                # ...existing safety settings...
+                *turns,
+                {"role": "user", "content": message},
             ]
-            response = gemini_model.generate_content(
-                message_with_role,
-                safety_settings=safety_settings,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=self.temperature
+        prompt = f"{self.systemRole}\n\n{message}"
+        if prefix_length <= 0 or prefix_length >= len(message):
+            return [{"role": "user", "content": prompt}]
+        split_index = len(prompt) - len(message) + prefix_length
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": prompt[:split_index],
+                        "cache_control": {"type": "ephemeral"},
+                    },
+                    {"type": "text", "text": prompt[split_index:]},
+                ],
+            }
+        ]
+
+    def __get_gemini_contents(
+        self, message: str, history: Optional[List[Dict[str, str]]]
+    ) -> Any:
+        """
+        Get the contents of Gemini, where the system role precedes the first turn
+        """
+        if not history:
+            return self.systemRole + "\n" + message
+        turns = [*history, {"role": "user", "content": message}]
+        return [
+            {
+                "role": "model" if turn["role"] == "assistant" else "user",
+                "parts": [
+                    (
+                        f"{self.systemRole}\n{turn['content']}"
+                        if i == 0
+                        else turn["content"]
+                    )
+                ],
+            }
+            for i, turn in enumerate(turns)
+        ]
+
+    @staticmethod
+    def __get_prompt_cache_kwargs(message: str, prefix_length: int) -> Dict[str, Any]:
+        """
+        Get the keyword arguments of OpenAI routing the prompts with the same prefix to the same
+        prompt cache. OpenAI caches the prompt prefixes automatically.
+        """
+        if prefix_length <= 0:
+            return {}
+        prefix_digest = hashlib.sha256(
+            message[:prefix_length].encode("utf-8")
+        ).hexdigest()
+        return {"prompt_cache_key": prefix_digest[:32]}
+
+    @staticmethod
+    def __get_response_format_kwargs(
+        output_schema: Optional[Dict[str, Any]], is_schema_supported: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Get the keyword arguments of OpenAI-compatible APIs constraining the response to JSON
+        :param output_schema: the JSON schema of the response, if any
+        :param is_schema_supported: whether the API enforces JSON schemas. Otherwise, only
+        a JSON object is requested, whose fields are described by the prompt.
+        """
+        if output_schema is None:
+            return {}
+        if not is_schema_supported:
+            return {"response_format": {"type": "json_object"}}
+        return {
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": LLM.ANSWER_TOOL_NAME,
+                    "schema": output_schema,
+                    "strict": True,
+                },
+            }
+        }
+
+    @staticmethod
+    def __get_claude_tool_kwargs(
+        output_schema: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """
+        Get the keyword arguments of Claude forcing the answer to be submitted by tool calling,
+        whose input conforms to the JSON schema of the response
+        """
+        if output_schema is None:
+            return {}
+        return {
+            "tools": [
+                {
+                    "name": LLM.ANSWER_TOOL_NAME,
+                    "description": "Submit the answer",
+                    "input_schema": output_schema,
+                }
+            ],
+            "tool_choice": {"type": "tool", "name": LLM.ANSWER_TOOL_NAME},
+        }
+
+    @staticmethod
+    def __get_claude_text(response) -> str:
+        """
+        Get the text of a response of Claude. An answer submitted by tool calling is returned
+        as the JSON of its input.
+        """
+        for block in response.content:
+            if block.type == "tool_use":
+                return json.dumps(block.input)
+        return response.content[0].text
+
+    @staticmethod
+    def __get_stream_kwargs(
+        early_stop: Optional[Callable[[str], bool]], is_usage_requested: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Get the keyword arguments streaming the response, if it may be stopped early
+        :param early_stop: the early-stop predicate
+        :param is_usage_requested: whether to request the usage in the last chunk,
+        which is needed by OpenAI-compatible APIs
+        """
+        if early_stop is None:
+            return {}
+        if is_usage_requested:
+            return {"stream": True, "stream_options": {"include_usage": True}}
+        return {"stream": True}
+
+    def __read_stream(
+        self, stream, early_stop: Callable[[str], bool]
+    ) -> Tuple[str, Optional[Tuple[int, int, int]]]:
+        """
+        Read a streamed response until it ends or the early-stop predicate holds
+        :return: the response, and the usage reported by the provider
+        """
+        reader = StreamReader(early_stop)
+        for chunk in stream:
+            if reader.feed(chunk):
+                # Closing the stream cancels the generation of the rest of the response
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    close()
+                self.logger.print_log("Stopped reading the response early")
+                break
+        return reader.get_result()
+
+    async def __aread_stream(
+        self, stream, early_stop: Callable[[str], bool]
+    ) -> Tuple[str, Optional[Tuple[int, int, int]]]:
+        """
+        Asynchronous counterpart of __read_stream
+        """
+        reader = StreamReader(early_stop)
+        async for chunk in stream:
+            if reader.feed(chunk):
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    await close()
+                self.logger.print_log("Stopped reading the response early")
+                break
+        return reader.get_result()
+
+    def __get_openai_client(self, api_key, base_url=None, is_async=False):
+        """Get the pooled client of OpenAI or an OpenAI-compatible API"""
+        if is_async:
+            return self.client_pool.get_async_client(
+                ("openai", api_key, base_url),
+                lambda: AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    max_retries=0,
+                    http_client=DefaultAsyncHttpxClient(
+                        **self.client_pool.get_http_client_kwargs()
+                    ),
                 ),
             )
-            return response.text
-
-        tryCnt = 0
-        while tryCnt < 5:
-            tryCnt += 1
-            try:
-                output = self.run_with_timeout(call_api, timeout=50)
-                if output:
-                    self.logger.print_log("Inference succeeded...")
-                    return output
-            except Exception as e:
-                self.logger.print_log(f"API error: {e}")
-            time.sleep(2)
+        return self.client_pool.get_client(
+            ("openai", api_key, base_url),
+            lambda: OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=0,
+                http_client=DefaultHttpxClient(
+                    **self.client_pool.get_http_client_kwargs()
+                ),
+            ),
+        )
 
-        return ""
+    def __get_anthropic_client(self, api_key, is_async=False):
+        """Get the pooled client of Anthropic"""
+        if is_async:
+            return self.client_pool.get_async_client(
+                ("anthropic", api_key),
+                lambda: anthropic.AsyncAnthropic(
+                    api_key=api_key,
+                    max_retries=0,
+                    http_client=anthropic.DefaultAsyncHttpxClient(
+                        **self.client_pool.get_http_client_kwargs()
+                    ),
+                ),
+            )
+        return self.client_pool.get_client(
+            ("anthropic", api_key),
+            lambda: anthropic.Anthropic(
+                api_key=api_key,
+                max_retries=0,
+                http_client=anthropic.DefaultHttpxClient(
+                    **self.client_pool.get_http_client_kwargs()
+                ),
+            ),
+        )
 
-    def infer_with_openai_model(self, message):
-        """Infer using the OpenAI model"""
-        api_key = os.environ.get("OPENAI_API_KEY").split(":")[0]
-        model_input = [
-            {"role": "system", "content": self.systemRole},
-            {"role": "user", "content": message},
-        ]
+    def __get_zhipuai_client(self, api_key):
+        """Get the pooled client of Zhipu AI"""
+        return self.client_pool.get_client(
+            ("zhipuai", api_key),
+            lambda: ZhipuAI(
+                api_key=api_key,
+                max_retries=0,
+                http_client=httpx.Client(**self.client_pool.get_http_client_kwargs()),
+            ),
+        )
 
-        def call_api():
-            client = OpenAI(api_key=api_key)
-            response = client.chat.completions.create(
-                model=self.online_model_name,
-                messages=model_input,
-                temperature=self.temperature,
+    def __get_gemini_model(self, model_name, is_async=False):
+        """
+        Get the pooled Gemini model.
+        An async model creates its gRPC client lazily in the event loop using it.
+        """
+        if is_async:
+            return self.client_pool.get_async_client(
+                ("gemini", model_name), lambda: genai.GenerativeModel(model_name)
             )
-            return response.choices[0].message.content
+        return self.client_pool.get_client(
+            ("gemini", model_name), lambda: genai.GenerativeModel(model_name)
+        )
 
+    def run_with_retry(
+        self,
+        call_api,
+        message,
+        timeout,
+        error_prefix="API error",
+        deadline=None,
+        key_pool=None,
+    ):
+        """
+        Run a request under the rate limiter and the circuit breaker of the provider, and retry it
+        if it fails or returns nothing, following the retry policy. A rate-limited request is
+        retried once the rate limiter admits it again, and a client error is not retried.
+        The timeout of each request is enforced by the SDK, so a timed-out request does not
+        leave a thread behind.
+        :param call_api: the function sending the request with the given timeout, and the API key
+        if the provider has a key pool, which returns the response and the usage reported by
+        the provider
+        :param message: the prompt
+        :param timeout: the timeout of a request in seconds
+        :param error_prefix: the prefix of the logged errors
+        :param deadline: the maximum number of seconds of all the attempts
+        :param key_pool: the API keys of the provider, one of which is selected per attempt
+        :return: the response, and the numbers of input and output tokens reported by the provider
+        """
+        steps = self.__get_retry_steps(
+            message, timeout, error_prefix, deadline, key_pool
+        )
+        result, error = None, None
+        while True:
+            try:
+                if error is None:
+                    step, value = steps.send(result)
+                else:
+                    step, value = steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result, error = None, None
+            if step == RETRY_ACQUIRE:
+                self.rate_limiter.acquire(value)
+            elif step == RETRY_SLEEP:
+                time.sleep(value)
+            else:
+                try:
+                    result = call_api(*value)
+                except Exception as e:
+                    error = e
+
+    async def arun_with_retry(
+        self,
+        call_api,
+        message,
+        timeout,
+        error_prefix="API error",
+        deadline=None,
+        key_pool=None,
+    ):
+        """
+        Asynchronous counterpart of run_with_retry.
+        A timed-out request is cancelled, in case the SDK does not enforce the timeout.
+        """
+        steps = self.__get_retry_steps(
+            message, timeout, error_prefix, deadline, key_pool
+        )
+        result, error = None, None
+        while True:
+            try:
+                if error is None:
+                    step, value = steps.send(result)
+                else:
+                    step, value = steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result, error = None, None
+            if step == RETRY_ACQUIRE:
+                await self.rate_limiter.aacquire(value)
+            elif step == RETRY_SLEEP:
+                await asyncio.sleep(value)
+            else:
+                try:
+                    result = await asyncio.wait_for(call_api(*value), timeout=value[0])
+                except (Exception, asyncio.CancelledError) as e:
+                    error = e
+
+    def __get_retry_steps(
+        self,
+        message: str,
+        timeout: float,
+        error_prefix: str,
+        deadline: Optional[float],
+        key_pool: Optional[APIKeyPool],
+    ) -> Generator[Tuple[str, Any], Any, Tuple[str, Optional[Tuple[int, int, int]]]]:
+        """
+        The attempts of a request, shared by run_with_retry and arun_with_retry, which only
+        differ in how they wait and send. The generator yields the steps
+        - (RETRY_ACQUIRE, the input tokens): wait until the rate limiter admits the attempt
+        - (RETRY_CALL, the arguments of call_api): send the attempt. Its result, or the exception
+        it raised, is sent back to the generator.
+        - (RETRY_SLEEP, the seconds): back off before the next attempt
+        and returns the response and the usage reported by the provider.
+        """
+        input_token_num = self.__estimate_input_token_num(message)
+        deadline_time = time.monotonic() + deadline if deadline is not None else None
         tryCnt = 0
-        while tryCnt < 5:
+        while tryCnt < self.retry_policy.max_attempt_num:
             tryCnt += 1
+            yield RETRY_ACQUIRE, input_token_num
+            if not self.__admit(deadline_time):
+                break
+            is_admitted, api_key = self.__acquire_api_key(key_pool)
+            if not is_admitted:
+                break
+            request_timeout = self.__get_request_timeout(timeout, deadline_time)
+            start_time = time.time()
             try:
-                output = self.run_with_timeout(call_api, timeout=100)
-                if output:
-                    return output
+                call_args = (
+                    (request_timeout,)
+                    if key_pool is None
+                    else (request_timeout, api_key)
+                )
+                output, usage = yield RETRY_CALL, call_args
+            except asyncio.CancelledError:
+                self.rate_limiter.release()
+                self.circuit_breaker.cancel()
+                if key_pool is not None and api_key is not None:
+                    key_pool.release(api_key)
+                raise
             except Exception as e:
-                self.logger.print_log(f"API error: {e}")
-            time.sleep(2)
+                kind = self.__record_failure(e, error_prefix, key_pool, api_key)
+                if not self.__is_retried(kind, tryCnt):
+                    break
+                yield RETRY_SLEEP, self.__get_backoff(tryCnt, kind, deadline_time)
+                continue
 
-        return ""
+            self.circuit_breaker.record_success()
+            if key_pool is not None and api_key is not None:
+                key_pool.release(api_key)
+            self.rate_limiter.release(
+                time.time() - start_time if output else None,
+                self.__get_output_token_num(output, usage),
+            )
+            if output:
+                return output, usage
+            if not self.__is_retried(EMPTY_RESPONSE, tryCnt):
+                break
+            yield RETRY_SLEEP, self.__get_backoff(tryCnt, EMPTY_RESPONSE, deadline_time)
 
-    def infer_with_o3_mini_model(self, message):
-        """Infer using the o3-mini model"""
-        api_key = os.environ.get("OPENAI_API_KEY").split(":")[0]
-        model_input = [
-            {"role": "system", "content": self.systemRole},
-            {"role": "user", "content": message},
-        ]
+        self.circuit_breaker.record_failed_request()
+        return "", None
 
-        def call_api():
-            client = OpenAI(api_key=api_key)
-            response = client.chat.completions.create(
-                model=self.online_model_name, messages=model_input
+    def __admit(self, deadline_time: Optional[float]) -> bool:
+        """
+        Check whether an attempt admitted by the rate limiter may be sent
+        :return: False if the deadline is exceeded or the circuit of the provider is open,
+        in which case the rate limiter is released
+        """
+        if self.__get_request_timeout(1, deadline_time) <= 0:
+            self.rate_limiter.release()
+            self.logger.print_log("Deadline exceeded")
+            return False
+        if not self.circuit_breaker.allow():
+            self.rate_limiter.release()
+            self.logger.print_log(
+                f"Circuit of {self.circuit_breaker.provider} is open. Failing fast"
             )
-            return response.choices[0].message.content
+            return False
+        return True
 
-        tryCnt = 0
-        while tryCnt < 5:
-            tryCnt += 1
-            try:
-                output = self.run_with_timeout(call_api, timeout=100)
-                if output:
-                    return output
-            except Exception as e:
-                self.logger.print_log(f"API error: {e}")
-            time.sleep(2)
+    def __acquire_api_key(
+        self, key_pool: Optional[APIKeyPool]
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Select the API key of an admitted attempt, if the provider has a key pool
+        :return: whether the attempt may be sent, and its API key. If all the keys have been
+        removed, the attempt is not sent, and the rate limiter is released.
+        """
+        if key_pool is None:
+            return True, None
+        api_key = key_pool.acquire()
+        if api_key is None:
+            self.rate_limiter.release()
+            self.circuit_breaker.cancel()
+            self.logger.print_log(f"No valid API key of {key_pool.provider} is left")
+            return False, None
+        return True, api_key
+
+    def __record_failure(
+        self,
+        error: BaseException,
+        error_prefix: str,
+        key_pool: Optional[APIKeyPool] = None,
+        api_key: Optional[str] = None,
+    ) -> str:
+        """
+        Release the rate limiter and the API key, and record the failure of an attempt
+        :return: the kind of the failure
+        """
+        kind = classify_error(error)
+        retry_after = get_retry_after(error)
+        if (
+            key_pool is not None
+            and api_key is not None
+            and key_pool.release(api_key, error, kind == RATE_LIMITED, retry_after)
+        ):
+            # The other keys of the provider keep serving the requests
+            kind = KEY_ERROR
+            self.rate_limiter.release()
+        else:
+            self.rate_limiter.release(
+                is_rate_limited=kind == RATE_LIMITED, retry_after=retry_after
+            )
+        self.circuit_breaker.record_failure(kind)
+        if kind == TIMEOUT:
+            self.logger.print_log("Operation timed out")
+        else:
+            self.logger.print_log(f"{error_prefix}: {error}")
+        return kind
 
-        return ""
+    def __is_retried(self, kind: str, attempt_num: int) -> bool:
+        """
+        Check whether a request is retried after its failed attempt, recording the retry if so
+        """
+        if not self.retry_policy.is_retryable(kind):
+            return False
+        if attempt_num >= self.retry_policy.max_attempt_num:
+            return False
+        self.circuit_breaker.record_retry(kind)
+        return True
 
-    def infer_with_deepseek_model(self, message):
+    def __get_backoff(
+        self, attempt_num: int, kind: str, deadline_time: Optional[float]
+    ) -> float:
         """
-        Infer using the DeepSeek model (V3, R1, etc.)
-        DeepSeek uses OpenAI-compatible API format
+        Get the backoff before the next attempt, bounded by the remaining time before the deadline
         """
-        api_key = os.environ.get("DEEPSEEK_API_KEY")
-        if not api_key:
-            self.logger.print_log("DeepSeek API key not found in environment variables")
-            return ""
-            
-        model_input = [
+        return self.__get_request_timeout(
+            self.retry_policy.get_backoff(attempt_num, kind), deadline_time
+        )
+
+    def __get_key_pool(self, *env_names: str) -> Optional[APIKeyPool]:
+        """
+        Get the API key pool of the provider. Several keys may be given in an environment
+        variable, separated by ':'.
+        :param env_names: the environment variables of the API keys, in the order of precedence
+        :return: None if no API key is given
+        """
+        for env_name in env_names:
+            api_keys = os.environ.get(env_name)
+            if api_keys:
+                return get_key_pool(LLM.get_provider(self.online_model_name), api_keys)
+        return None
+
+    def __estimate_input_token_num(self, message: str) -> int:
+        """
+        Estimate the input tokens of a request for the rate limiter.
+        The prompt is only tokenized if the tokens per minute are limited.
+        """
+        if not self.rate_limiter.is_token_limited():
+            return 0
+        return len(self.encoding.encode(self.systemRole + message))
+
+    def __get_output_token_num(
+        self, output: str, usage: Optional[Tuple[int, int, int]]
+    ) -> int:
+        """
+        Get the output tokens of a request charged to the rate limiter
+        """
+        if not output:
+            return 0
+        if usage is not None:
+            return usage[1]
+        if not self.rate_limiter.is_token_limited():
+            return 0
+        return len(self.encoding.encode(output))
+
+    @staticmethod
+    def __get_request_timeout(timeout: float, deadline_time: Optional[float]) -> float:
+        """
+        Bound the timeout of a request by the remaining time before the deadline
+        """
+        if deadline_time is None:
+            return timeout
+        return max(0.0, min(timeout, deadline_time - time.monotonic()))
+
+    def __send(
+        self, request: ProviderRequest, timeout: float, api_key: Optional[str] = None
+    ) -> Tuple[str, Optional[Tuple[int, int, int]]]:
+        """
+        Send a request with the synchronous client of the provider
+        :return: the response, and the usage reported by the provider
+        """
+        create = request.get_create(api_key, False)
+        response = create(timeout=timeout, **request.kwargs)
+        if request.early_stop is not None:
+            return self.__read_stream(response, request.early_stop)
+        return request.get_text(response), get_usage(response)
+
+    async def __asend(
+        self, request: ProviderRequest, timeout: float, api_key: Optional[str] = None
+    ) -> Tuple[str, Optional[Tuple[int, int, int]]]:
+        """
+        Asynchronous counterpart of __send. If the SDK has no async client, the request runs
+        in the default executor.
+        """
+        if not request.is_async_supported:
+            return await asyncio.to_thread(self.__send, request, timeout, api_key)
+        create = request.get_create(api_key, True)
+        response = await create(timeout=timeout, **request.kwargs)
+        if request.early_stop is not None:
+            return await self.__aread_stream(response, request.early_stop)
+        return request.get_text(response), get_usage(response)
+
+    @staticmethod
+    def __get_chat_text(response) -> str:
+        """
+        Get the text of a response of an OpenAI-compatible API
+        """
+        return response.choices[0].message.content
+
+    def __get_request(
+        self,
+        message: str,
+        early_stop: Optional[Callable[[str], bool]],
+        prefix_length: int,
+        output_schema: Optional[Dict[str, Any]],
+        history: Optional[List[Dict[str, str]]],
+    ) -> Optional[ProviderRequest]:
+        """
+        Build the request to the provider serving the model
+        :return: None if the API key of the provider is not found
+        """
+        args = (message, early_stop, prefix_length, output_schema, history)
+        if self.endpoint is not None:
+            return self.__get_endpoint_request(*args)
+        elif "gemini" in self.online_model_name:
+            return self.__get_gemini_request(*args)
+        elif "gpt" in self.online_model_name:
+            return self.__get_openai_request(*args)
+        elif "o3-mini" in self.online_model_name:
+            return self.__get_o3_mini_request(*args)
+        elif "claude" in self.online_model_name:
+            return self.__get_claude_request(*args)
+        elif "deepseek" in self.online_model_name:
+            return self.__get_deepseek_request(*args)
+        elif "glm" in self.online_model_name:
+            return self.__get_glm_request(*args)
+        raise ValueError("Unsupported model name")
+
+    def __run_request(
+        self,
+        request: Optional[ProviderRequest],
+        message: str,
+        deadline: Optional[float],
+    ) -> Tuple[str, Optional[Tuple[int, int, int]]]:
+        """
+        Send a request with retries
+        """
+        if request is None:
+            return "", None
+        return self.run_with_retry(
+            partial(self.__send, request),
+            message,
+            request.timeout,
+            request.error_prefix,
+            deadline,
+            request.key_pool,
+        )
+
+    async def __arun_request(
+        self,
+        request: Optional[ProviderRequest],
+        message: str,
+        deadline: Optional[float],
+    ) -> Tuple[str, Optional[Tuple[int, int, int]]]:
+        """
+        Asynchronous counterpart of __run_request
+        """
+        if request is None:
+            return "", None
+        return await self.arun_with_retry(
+            partial(self.__asend, request),
+            message,
+            request.timeout,
+            request.error_prefix,
+            deadline,
+            request.key_pool,
+        )
+
+    def __get_gemini_request(
+        self, message, early_stop, prefix_length, output_schema, history
+    ) -> Optional[ProviderRequest]:
+        """Build the request to the Gemini model from Google Generative AI"""
+
+        def get_create(api_key, is_async):
+            gemini_model = self.__get_gemini_model("gemini-pro", is_async=is_async)
+            generate_content = (
+                gemini_model.generate_content_async
+                if is_async
+                else gemini_model.generate_content
+            )
+            # Gemini takes the timeout in the request options
+            return lambda timeout, **kwargs: generate_content(
+                request_options={"timeout": timeout}, **kwargs
+            )
+
+        safety_settings = [
             {
-                "role": "system",
-                "content": self.systemRole,
+                "category": "HARM_CATEGORY_DANGEROUS",
+                "threshold": "BLOCK_NONE",
             },
-            {"role": "user", "content": message},
+            # ...existing safety settings...
         ]
+        return ProviderRequest(
+            get_create,
+            {
+                "contents": self.__get_gemini_contents(message, history),
+                "safety_settings": safety_settings,
+                "generation_config": genai.types.GenerationConfig(
+                    temperature=self.temperature,
+                    max_output_tokens=self.max_output_length,
+                    stop_sequences=self.stop_sequences,
+                    response_mime_type=(
+                        "application/json" if output_schema is not None else None
+                    ),
+                ),
+                **self.__get_stream_kwargs(early_stop),
+            },
+            lambda response: response.text,
+            timeout=50,
+            early_stop=early_stop,
+        )
 
-        def call_api():
-            client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com/v1")
-            response = client.chat.completions.create(
-                model=self.online_model_name,
-                messages=model_input,
-                temperature=self.temperature,
-            )
-            return response.choices[0].message.content
+    def __get_openai_request(
+        self, message, early_stop, prefix_length, output_schema, history
+    ) -> Optional[ProviderRequest]:
+        """Build the request to the OpenAI model"""
+        key_pool = self.__get_key_pool("OPENAI_API_KEY")
+        if key_pool is None:
+            self.logger.print_log("OpenAI API key not found in environment variables")
+            return None
+        return ProviderRequest(
+            lambda api_key, is_async: self.__get_openai_client(
+                api_key, is_async=is_async
+            ).chat.completions.create,
+            {
+                "model": self.online_model_name,
+                "messages": self.__get_chat_messages(message, history),
+                "temperature": self.temperature,
+                **self.__get_generation_kwargs(),
+                **self.__get_response_format_kwargs(output_schema),
+                **self.__get_prompt_cache_kwargs(message, prefix_length),
+                **self.__get_stream_kwargs(early_stop, is_usage_requested=True),
+            },
+            self.__get_chat_text,
+            timeout=100,
+            early_stop=early_stop,
+            key_pool=key_pool,
+        )
 
-        tryCnt = 0
-        while tryCnt < 5:
-            tryCnt += 1
-            try:
-                output = self.run_with_timeout(call_api, timeout=300)
-                if output:
-                    return output
-            except Exception as e:
-                self.logger.print_log(f"DeepSeek API error: {e}")
-            time.sleep(2)
+    def __get_endpoint_request(
+        self, message, early_stop, prefix_length, output_schema, history
+    ) -> Optional[ProviderRequest]:
+        """Build the request to the model served by an OpenAI-compatible endpoint"""
+        assert self.endpoint is not None
+        endpoint = self.endpoint
+        return ProviderRequest(
+            lambda api_key, is_async: self.__get_openai_client(
+                endpoint.api_key, base_url=endpoint.base_url, is_async=is_async
+            ).chat.completions.create,
+            {
+                "model": self.online_model_name,
+                "messages": self.__get_chat_messages(message, history),
+                "temperature": self.temperature,
+                **self.__get_generation_kwargs(),
+                **self.__get_response_format_kwargs(output_schema),
+                **self.__get_stream_kwargs(early_stop, is_usage_requested=True),
+            },
+            self.__get_chat_text,
+            timeout=endpoint.timeout,
+            early_stop=early_stop,
+        )
 
-        return ""
+    def __get_o3_mini_request(
+        self, message, early_stop, prefix_length, output_schema, history
+    ) -> Optional[ProviderRequest]:
+        """Build the request to the o3-mini model"""
+        key_pool = self.__get_key_pool("OPENAI_API_KEY")
+        if key_pool is None:
+            self.logger.print_log("OpenAI API key not found in environment variables")
+            return None
+        # o-series models do not support stop sequences
+        return ProviderRequest(
+            lambda api_key, is_async: self.__get_openai_client(
+                api_key, is_async=is_async
+            ).chat.completions.create,
+            {
+                "model": self.online_model_name,
+                "messages": self.__get_chat_messages(message, history),
+                **self.__get_generation_kwargs(
+                    max_tokens_key="max_completion_tokens", stop_key=None
+                ),
+                **self.__get_response_format_kwargs(output_schema),
+                **self.__get_prompt_cache_kwargs(message, prefix_length),
+                **self.__get_stream_kwargs(early_stop, is_usage_requested=True),
+            },
+            self.__get_chat_text,
+            timeout=100,
+            early_stop=early_stop,
+            key_pool=key_pool,
+        )
 
-    def infer_with_claude_key(self, message):
+    def __get_deepseek_request(
+        self, message, early_stop, prefix_length, output_schema, history
+    ) -> Optional[ProviderRequest]:
         """
-        Infer using the Claude model with API key
+        Build the request to the DeepSeek model (V3, R1, etc.)
+        DeepSeek uses OpenAI-compatible API format
         """
-        api_key = os.environ.get("ANTHROPIC_API_KEY") or os.environ.get("CLAUDE_API_KEY")
-        if not api_key:
-            self.logger.print_log("Claude API key not found in environment variables")
-            return ""
-            
-        model_input = [
-            {"role": "user", "content": f"{self.systemRole}\n\n{message}"}
-        ]
-
-        def call_api():
-            client = anthropic.Anthropic(api_key=api_key)
-            response = client.messages.create(
-                model=self.online_model_name,
-                max_tokens=4096,
-                temperature=self.temperature,
-                messages=model_input
-            )
-            return response.content[0].text
+        key_pool = self.__get_key_pool("DEEPSEEK_API_KEY")
+        if key_pool is None:
+            self.logger.print_log("DeepSeek API key not found in environment variables")
+            return None
+        return ProviderRequest(
+            lambda api_key, is_async: self.__get_openai_client(
+                api_key, base_url="https://api.deepseek.com/v1", is_async=is_async
+            ).chat.completions.create,
+            {
+                "model": self.online_model_name,
+                "messages": self.__get_chat_messages(message, history),
+                "temperature": self.temperature,
+                **self.__get_generation_kwargs(),
+                **self.__get_response_format_kwargs(
+                    output_schema, is_schema_supported=False
+                ),
+                **self.__get_stream_kwargs(early_stop, is_usage_requested=True),
+            },
+            self.__get_chat_text,
+            timeout=300,
+            early_stop=early_stop,
+            error_prefix="DeepSeek API error",
+            key_pool=key_pool,
+        )
 
-        tryCnt = 0
-        while tryCnt < 5:
-            tryCnt += 1
-            try:
-                output = self.run_with_timeout(call_api, timeout=300)
-                if output:
-                    return output
-            except Exception as e:
-                self.logger.print_log(f"Claude API error: {e}")
-            time.sleep(2)
+    def __get_claude_request(
+        self, message, early_stop, prefix_length, output_schema, history
+    ) -> Optional[ProviderRequest]:
+        """
+        Build the request to the Claude model with API key
+        """
+        key_pool = self.__get_key_pool("ANTHROPIC_API_KEY", "CLAUDE_API_KEY")
+        if key_pool is None:
+            self.logger.print_log("Claude API key not found in environment variables")
+            return None
+        return ProviderRequest(
+            lambda api_key, is_async: self.__get_anthropic_client(
+                api_key, is_async=is_async
+            ).messages.create,
+            {
+                "model": self.online_model_name,
+                "max_tokens": self.max_output_length or LLM.DEFAULT_MAX_OUTPUT_LENGTH,
+                "temperature": self.temperature,
+                "messages": self.__get_claude_messages(message, prefix_length, history),
+                **self.__get_generation_kwargs(
+                    max_tokens_key=None, stop_key="stop_sequences"
+                ),
+                **self.__get_claude_tool_kwargs(output_schema),
+                **self.__get_stream_kwargs(early_stop),
+            },
+            self.__get_claude_text,
+            timeout=300,
+            early_stop=early_stop,
+            error_prefix="Claude API error",
+            key_pool=key_pool,
+        )
 
-        return ""
+    def __get_glm_request(
+        self, message, early_stop, prefix_length, output_schema, history
+    ) -> Optional[ProviderRequest]:
+        """
+        Build the request to the GLM model.
+        The Zhipu AI SDK has no async client.
+        """
+        key_pool = self.__get_key_pool("GLM_API_KEY")
+        if key_pool is None:
+            self.logger.print_log("GLM API key not found in environment variables")
+            return None
+        return ProviderRequest(
+            lambda api_key, is_async: self.__get_zhipuai_client(
+                api_key
+            ).chat.completions.create,
+            {
+                "model": self.online_model_name,
+                "messages": self.__get_chat_messages(message, history),
+                "temperature": self.temperature,
+                **self.__get_generation_kwargs(),
+                **self.__get_response_format_kwargs(
+                    output_schema, is_schema_supported=False
+                ),
+                **self.__get_stream_kwargs(early_stop),
+            },
+            self.__get_chat_text,
+            timeout=100,
+            early_stop=early_stop,
+            key_pool=key_pool,
+            is_async_supported=False,
+        )
 
     def infer_with_claude_aws_bedrock(self, message):
         """Infer using the Claude model via AWS Bedrock"""
         # FIXME: an issue when installing boto3. I comment this function temporarily.
         raise NotImplementedError("AWS Bedrock is not supported")
-    
+
         timeout = 500
         model_input = [
             {
@@ -284,7 +1422,8 @@ class LLM:
             body = json.dumps(
                 {
                     "messages": model_input,
-                    "max_tokens": self.max_output_length,
+                    "max_tokens": self.max_output_length
+                    or LLM.DEFAULT_MAX_OUTPUT_LENGTH,
                     "anthropic_version": "bedrock-2023-05-31",
                     "temperature": self.temperature,
                     "top_k": 50,
@@ -295,7 +1434,8 @@ class LLM:
             body = json.dumps(
                 {
                     "messages": model_input,
-                    "max_tokens": self.max_output_length,
+                    "max_tokens": self.max_output_length
+                    or LLM.DEFAULT_MAX_OUTPUT_LENGTH,
                     "thinking": {
                         "type": "enabled",
                         "budget_tokens": 2048,
@@ -304,7 +1444,7 @@ class LLM:
                 }
             )
 
-        def call_api():
+        def call_api(timeout):
             client = boto3.client(
                 "bedrock-runtime",
                 region_name="us-west-2",
@@ -330,9 +1470,9 @@ class LLM:
         while tryCnt < 5:
             tryCnt += 1
             try:
-                output = self.run_with_timeout(call_api, timeout=timeout)
+                output = call_api(timeout)
                 if output:
-                    return output
+                    return output, None
             except concurrent.futures.TimeoutError:
                 self.logger.print_log(
                     f"Timeout occurred, increasing timeout for next attempt"
@@ -342,35 +1482,4 @@ class LLM:
                 self.logger.print_log(f"API error: {str(e)}")
             time.sleep(2)
 
-        return ""
-
-    def infer_with_glm_model(self, message):
-        """Infer using the GLM model"""
-        api_key = os.environ.get("GLM_API_KEY")
-        model_input = [
-            {"role": "system", "content": self.systemRole},
-            {"role": "user", "content": message},
-        ]
-
-        def call_api():
-            client = ZhipuAI(api_key=api_key)
-            response = client.chat.completions.create(
-                model=self.online_model_name,
-                messages=model_input,
-                temperature=self.temperature,
-            )
-            return response.choices[0].message.content
-
-        tryCnt = 0
-        while tryCnt < 5:
-            tryCnt += 1
-            try:
-                output = self.run_with_timeout(call_api, timeout=100)
-                if output:
-                    # print("Raw response from GLM model: ", output)
-                    return output
-            except Exception as e:
-                self.logger.print_log(f"API error: {e}")
-            time.sleep(2)
-
-        return ""
+        return "", None
@@ -1,7 +1,7 @@
 from os import path
 import json
 import time
-from typing import List, Set, Optional, Dict
+from typing import Any, List, Set, Optional, Dict
 from llmtool.LLM_utils import *
 from llmtool.LLM_tool import *
 from memory.syntactic.function import *
@@ -10,6 +10,71 @@ from memory.syntactic.api import *
 
 BASE_PATH = Path(__file__).resolve().parent.parent.parent
 
+# The JSON schemas of the structured responses, which follow the free-text answer format.
+# Every field is required and no other field is allowed, as the strict structured outputs
+# of OpenAI require.
+PROPAGATION_TYPES = ["Argument", "Return", "Parameter", "Sink"]
+PATHS_SCHEMA: Dict[str, Any] = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "path": {"type": "string"},
+            "propagations": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "type": {"type": "string", "enum": PROPAGATION_TYPES},
+                        "name": {"type": "string"},
+                        "function": {"type": "string"},
+                        "index": {"type": "integer"},
+                        "line": {"type": "integer"},
+                        "dependency": {"type": "string"},
+                    },
+                    "required": [
+                        "type",
+                        "name",
+                        "function",
+                        "index",
+                        "line",
+                        "dependency",
+                    ],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["path", "propagations"],
+        "additionalProperties": False,
+    },
+}
+ANSWER_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {"reasoning": {"type": "string"}, "paths": PATHS_SCHEMA},
+    "required": ["reasoning", "paths"],
+    "additionalProperties": False,
+}
+BATCH_ANSWER_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "sources": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "source": {"type": "integer"},
+                    "reasoning": {"type": "string"},
+                    "paths": PATHS_SCHEMA,
+                },
+                "required": ["source", "reasoning", "paths"],
+                "additionalProperties": False,
+            },
+        }
+    },
+    "required": ["sources"],
+    "additionalProperties": False,
+}
+
 
 class IntraDataFlowAnalyzerInput(LLMToolInput):
     def __init__(
@@ -53,6 +118,14 @@ class IntraDataFlowAnalyzer(LLMTool):
         language: str,
         max_query_num: int,
         logger: Logger,
+        budget: Optional[LLMBudget] = None,
+        persistent_cache: Optional[LLMResponseCache] = None,
+        deadline: Optional[float] = None,
+        max_output_length: Optional[int] = None,
+        stop_sequences: Optional[List[str]] = None,
+        batch_exporter: Optional[LLMBatchExporter] = None,
+        escalation_model_name: Optional[str] = None,
+        is_structured_output: bool = False,
     ) -> None:
         """
         :param model_name: the model name
@@ -60,55 +133,311 @@ class IntraDataFlowAnalyzer(LLMTool):
         :param language: the programming language
         :param max_query_num: the maximum number of queries if the model fails
         :param logger: the logger
+        :param budget: the LLM budget shared with other LLM tools
+        :param persistent_cache: the LLM response cache shared across runs
+        :param deadline: the maximum number of seconds of a query, including retries
+        :param max_output_length: the maximum number of output tokens of a query
+        :param stop_sequences: the sequences stopping the generation
+        :param batch_exporter: the exporter of the prompts of an offline scan
+        :param escalation_model_name: the stronger model answering the queries that the model
+        fails to answer confidently
+        :param is_structured_output: whether the model answers in JSON conforming to a schema,
+        which is parsed strictly, instead of free text
         """
-        super().__init__(model_name, temperature, language, max_query_num, logger)
-        self.prompt_file = (
+        super().__init__(
+            model_name,
+            temperature,
+            language,
+            max_query_num,
+            logger,
+            budget,
+            persistent_cache,
+            deadline,
+            max_output_length,
+            stop_sequences,
+            batch_exporter,
+            escalation_model_name,
+        )
+        prompt_template_dict = self._load_prompt_file(
             f"{BASE_PATH}/prompt/{language}/dfbscan/intra_dataflow_analyzer.json"
         )
+        # The structured output is only available if the prompts describe the JSON answer format
+        self.is_structured_output = (
+            is_structured_output and "answer_format_json" in prompt_template_dict
+        )
+        answer_format = prompt_template_dict[
+            "answer_format_json" if self.is_structured_output else "answer_format_cot"
+        ]
+        # The task, the rules, the examples, and the answer format form a prefix shared by all the
+        # prompts, which is followed by the function and the question
+        prefix = prompt_template_dict["task"]
+        prefix += "\n" + "\n".join(prompt_template_dict["analysis_rules"])
+        prefix += "\n" + "\n".join(prompt_template_dict["analysis_examples"])
+        prefix += "\n" + "".join(prompt_template_dict.get("answer_meta_prompts", []))
+
+        prompt = "".join(prompt_template_dict["meta_prompts"])
+        prompt = prompt.replace("<QUESTION>", prompt_template_dict["question_template"])
+        self.answer_format = "\n".join(answer_format)
+        self.prompt_template = PromptTemplate(
+            prompt, prefix.replace("<ANSWER>", self.answer_format)
+        )
+        # The task and the questions, without the function, open the exchange repairing
+        # an unparsable response
+        self.task = prompt_template_dict["task"]
+        self.repair_question_template = PromptTemplate(
+            self.task + "\n" + prompt_template_dict["question_template"]
+        )
+
+        # The templates of batched prompts are absent for some languages
+        self.batch_prompt_template: Optional[PromptTemplate] = None
+        self.batch_question_template: Optional[PromptTemplate] = None
+        self.batch_answer_format = ""
+        if "batch_meta_prompts" in prompt_template_dict:
+            self.batch_answer_format = "\n".join(
+                prompt_template_dict[
+                    "batch_answer_format_json"
+                    if self.is_structured_output
+                    else "batch_answer_format"
+                ]
+                + answer_format
+            )
+            self.batch_prompt_template = PromptTemplate(
+                "".join(prompt_template_dict["batch_meta_prompts"]),
+                prefix.replace("<ANSWER>", self.batch_answer_format),
+            )
+            self.batch_question_template = PromptTemplate(
+                prompt_template_dict["batch_question_template"]
+            )
         return
 
     def _get_prompt(self, input: LLMToolInput) -> str:
         if not isinstance(input, IntraDataFlowAnalyzerInput):
             raise TypeError("Expect IntraDataFlowAnalyzerInput")
-        with open(self.prompt_file, "r") as f:
-            prompt_template_dict = json.load(f)
-        prompt = prompt_template_dict["task"]
-        prompt += "\n" + "\n".join(prompt_template_dict["analysis_rules"])
-        prompt += "\n" + "\n".join(prompt_template_dict["analysis_examples"])
-        prompt += "\n" + "".join(prompt_template_dict["meta_prompts"])
-        prompt = prompt.replace(
-            "<ANSWER>", "\n".join(prompt_template_dict["answer_format_cot"])
-        )
-        prompt = prompt.replace("<QUESTION>", prompt_template_dict["question_template"])
+        values = self.__get_function_facts(input)
+        values.update(self.__get_source_facts(input))
+        return self.prompt_template.render(values)
 
-        prompt = (
-            prompt.replace("<FUNCTION>", input.function.lined_code)
-            .replace("<SRC_NAME>", input.summary_start.name)
-            .replace(
-                "<SRC_LINE>",
-                str(
-                    input.summary_start.line_number
-                    - input.function.start_line_number
-                    + 1
-                ),
-            )
-        )
+    def _get_repair_prompts(self, input: LLMToolInput) -> Optional[Tuple[str, str]]:
+        if not isinstance(input, IntraDataFlowAnalyzerInput):
+            raise TypeError("Expect IntraDataFlowAnalyzerInput")
+        if self.answer_format == "":
+            return None
+        question = self.repair_question_template.render(self.__get_source_facts(input))
+        return question, self.answer_format
+
+    def _get_batch_repair_prompts(
+        self, inputs: List[LLMToolInput]
+    ) -> Optional[Tuple[str, str]]:
+        if self.batch_answer_format == "":
+            return None
+        questions = "\n".join(self.__get_batch_questions(inputs))
+        return self.task + "\n" + questions, self.batch_answer_format
+
+    @staticmethod
+    def __get_source_facts(input: IntraDataFlowAnalyzerInput) -> Dict[str, str]:
+        """
+        Get the name and the relative line number of the source value
+        """
+        return {
+            "SRC_NAME": input.summary_start.name,
+            "SRC_LINE": str(
+                input.summary_start.line_number - input.function.start_line_number + 1
+            ),
+        }
+
+    def _get_prompt_prefix_length(self, input: LLMToolInput) -> int:
+        return self.prompt_template.get_prefix_length({})
 
+    def _get_batch_prompt_prefix_length(self, inputs: List[LLMToolInput]) -> int:
+        if self.batch_prompt_template is None:
+            return 0
+        return self.batch_prompt_template.get_prefix_length({})
+
+    def _get_batch_prompt(self, inputs: List[LLMToolInput]) -> str:
+        """
+        Construct a single prompt asking for the propagation of several source values in the same function.
+        """
+        if self.batch_prompt_template is None or self.batch_question_template is None:
+            return super()._get_batch_prompt(inputs)
+        questions = self.__get_batch_questions(inputs)
+        first_input = inputs[0]
+        assert isinstance(first_input, IntraDataFlowAnalyzerInput)
+        values = self.__get_function_facts(first_input)
+        values["QUESTION"] = "\n".join(questions)
+        return self.batch_prompt_template.render(values)
+
+    def __get_batch_questions(self, inputs: List[LLMToolInput]) -> List[str]:
+        """
+        Get the numbered questions of the source values in the same function
+        """
+        assert self.batch_question_template is not None
+        batch_inputs: List[IntraDataFlowAnalyzerInput] = []
+        for input in inputs:
+            if not isinstance(input, IntraDataFlowAnalyzerInput):
+                raise TypeError("Expect IntraDataFlowAnalyzerInput")
+            batch_inputs.append(input)
+        function = batch_inputs[0].function
+        if any(
+            input.function.function_id != function.function_id
+            for input in batch_inputs
+        ):
+            raise ValueError("Expect the inputs in the same function")
+
+        questions = []
+        for i, input in enumerate(batch_inputs):
+            values = self.__get_source_facts(input)
+            values["SRC_INDEX"] = str(i + 1)
+            questions.append(self.batch_question_template.render(values))
+        return questions
+
+    def __get_function_facts(self, input: IntraDataFlowAnalyzerInput) -> Dict[str, str]:
+        """
+        Get the code, sink values, call statements, and return values of the function
+        to be filled into the prompt.
+        """
         sinks_str = "Sink values in this function:\n"
         for sink_value in input.sink_values:
             sinks_str += f"- {sink_value[0]} at line {sink_value[1]}\n"
-        prompt = prompt.replace("<SINK_VALUES>", sinks_str)
 
         calls_str = "Call statements in this function:\n"
         for call_statement in input.call_statements:
             calls_str += f"- {call_statement[0]} at line {call_statement[1]}\n"
-        prompt = prompt.replace("<CALL_STATEMENTS>", calls_str)
 
         rets_str = "Return values in this function:\n"
         for ret_val in input.ret_values:
             rets_str += f"- {ret_val[0]} at line {ret_val[1]}\n"
-        prompt = prompt.replace("<RETURN_VALUES>", rets_str)
-        return prompt
+        return {
+            "FUNCTION": input.function.lined_code,
+            "SINK_VALUES": sinks_str,
+            "CALL_STATEMENTS": calls_str,
+            "RETURN_VALUES": rets_str,
+        }
+
+    def _get_output_schema(self, input: LLMToolInput) -> Optional[Dict[str, Any]]:
+        return ANSWER_SCHEMA if self.is_structured_output else None
+
+    def _get_batch_output_schema(
+        self, inputs: List[LLMToolInput]
+    ) -> Optional[Dict[str, Any]]:
+        return BATCH_ANSWER_SCHEMA if self.is_structured_output else None
+
+    def _parse_batch_response(
+        self, response: str, inputs: List[LLMToolInput]
+    ) -> List[Optional[LLMToolOutput]]:
+        """
+        Split the response into the sections starting with "Source N:" and parse each section
+        as the response for the N-th input. If a source is answered several times, e.g., when the
+        questions are restated before the answers, the last section is used.
+        A structured response is split into the answers with the source numbers instead.
+        """
+        if self.is_structured_output:
+            return self.__parse_structured_batch_response(response, inputs)
+        source_header_re = re.compile(r"^\W*Source\s*(\d+)\s*:", re.MULTILINE)
+        headers = list(source_header_re.finditer(response))
+
+        sections: Dict[int, str] = {}
+        for i, header in enumerate(headers):
+            end = headers[i + 1].start() if i + 1 < len(headers) else len(response)
+            sections[int(header.group(1))] = response[header.end() : end]
+
+        outputs: List[Optional[LLMToolOutput]] = []
+        for i, input in enumerate(inputs):
+            section = sections.get(i + 1)
+            outputs.append(
+                self._parse_response(section, input) if section is not None else None
+            )
+        return outputs
+
+    def _is_confident(self, output: LLMToolOutput) -> bool:
+        """
+        A response without any path does not follow the answer format
+        """
+        if not isinstance(output, IntraDataFlowAnalyzerOutput):
+            raise TypeError("Expect IntraDataFlowAnalyzerOutput")
+        return len(output.reachable_values) > 0
+
+    def __parse_structured_batch_response(
+        self, response: str, inputs: List[LLMToolInput]
+    ) -> List[Optional[LLMToolOutput]]:
+        """
+        Parse the answers of a structured response to a batched prompt.
+        An answer violating the schema leaves its input unanswered.
+        """
+        answer = self.__load_json(response)
+        sources = answer.get("sources") if isinstance(answer, dict) else None
+        answers: Dict[int, Any] = {}
+        if isinstance(sources, list):
+            for source_answer in sources:
+                if isinstance(source_answer, dict) and type(
+                    source_answer.get("source")
+                ) is int:
+                    answers[source_answer["source"]] = source_answer
+
+        outputs: List[Optional[LLMToolOutput]] = []
+        for i, input in enumerate(inputs):
+            paths = self.__parse_structured_paths(answers.get(i + 1))
+            outputs.append(
+                self.__get_output(paths, input) if paths is not None else None
+            )
+        return outputs
+
+    @staticmethod
+    def __load_json(response: str) -> Any:
+        """
+        Load the JSON object in a structured response. The object may be wrapped in a code
+        block by the providers that do not enforce JSON responses.
+        :return: the object, or None if the response is not JSON
+        """
+        start, end = response.find("{"), response.rfind("}")
+        if start < 0 or end < start:
+            return None
+        try:
+            return json.loads(response[start : end + 1])
+        except json.JSONDecodeError:
+            return None
+
+    @staticmethod
+    def __parse_structured_paths(answer: Any) -> Optional[List[Dict]]:
+        """
+        Extract the execution paths and their propagation details from a structured answer,
+        in the same form as from a free-text answer.
+        :return: the paths, or None if the answer violates the schema
+        """
+        if not isinstance(answer, dict) or not isinstance(answer.get("paths"), list):
+            return None
+        paths: List[Dict] = []
+        for i, path in enumerate(answer["paths"]):
+            if not isinstance(path, dict) or not isinstance(
+                path.get("propagations"), list
+            ):
+                return None
+            propagation_details = []
+            for propagation in path["propagations"]:
+                if (
+                    not isinstance(propagation, dict)
+                    or propagation.get("type") not in PROPAGATION_TYPES
+                    or not isinstance(propagation.get("name"), str)
+                    or type(propagation.get("index")) is not int
+                    or type(propagation.get("line")) is not int
+                ):
+                    return None
+                propagation_details.append(
+                    {
+                        "type": propagation["type"],
+                        "name": propagation["name"].strip(),
+                        "function": str(propagation.get("function")).strip(),
+                        "index": str(propagation["index"]),
+                        "line": str(propagation["line"]),
+                    }
+                )
+            paths.append(
+                {
+                    "path_number": str(i + 1),
+                    "execution_path": str(path.get("path", "")).strip(),
+                    "propagation_details": propagation_details,
+                }
+            )
+        return paths
 
     def _parse_response(
         self, response: str, input: Optional[LLMToolInput] = None
@@ -121,8 +450,17 @@ class IntraDataFlowAnalyzer(LLMTool):
             input (IntraDataFlowAnalyzerInput): The input object containing function details.
 
         Returns:
-            IntraDataFlowAnalyzerOutput: The output containing reachable values for each path.
+            IntraDataFlowAnalyzerOutput: The output containing reachable values for each path,
+            or None if a structured response violates the schema or a free-text response has
+            no path, since the answer format lists every path, even one without propagation.
         """
+        if self.is_structured_output:
+            structured_paths = self.__parse_structured_paths(self.__load_json(response))
+            if structured_paths is None:
+                self.logger.print_log("The structured response violates the schema")
+                return None
+            return self.__get_output(structured_paths, input)
+
         paths: List[Dict] = []
 
         # Regex to match a path header line, e.g., "Path 1: Lines 2 -> 3"
@@ -173,7 +511,17 @@ class IntraDataFlowAnalyzer(LLMTool):
 
         if current_path:
             paths.append(current_path)
+        if len(paths) == 0:
+            self.logger.print_log("The response has no path")
+            return None
+        return self.__get_output(paths, input)
 
+    def __get_output(
+        self, paths: List[Dict], input: Optional[LLMToolInput]
+    ) -> IntraDataFlowAnalyzerOutput:
+        """
+        Get the values reachable along the execution paths
+        """
         assert input is not None, "input cannot be none"
         if not isinstance(input, IntraDataFlowAnalyzerInput):
             raise TypeError("Expect IntraDataFlowAnalyzerInput")
@@ -1,6 +1,6 @@
 from os import path
 import json
-from typing import List, Dict
+from typing import Callable, List, Dict, Set, Tuple
 from llmtool.LLM_utils import *
 from llmtool.LLM_tool import *
 from memory.syntactic.function import *
@@ -39,6 +39,8 @@ class PathValidatorOutput(LLMToolOutput):
 
 
 class PathValidator(LLMTool):
+    ANSWER_PATTERN = re.compile(r"Answer:\s*(\w+)")
+
     def __init__(
         self,
         model_name: str,
@@ -46,6 +48,13 @@ class PathValidator(LLMTool):
         language: str,
         max_query_num: int,
         logger: Logger,
+        budget: Optional[LLMBudget] = None,
+        persistent_cache: Optional[LLMResponseCache] = None,
+        deadline: Optional[float] = None,
+        max_output_length: Optional[int] = None,
+        stop_sequences: Optional[List[str]] = None,
+        batch_exporter: Optional[LLMBatchExporter] = None,
+        escalation_model_name: Optional[str] = None,
     ) -> None:
         """
         :param model_name: the model name
@@ -53,24 +62,230 @@ class PathValidator(LLMTool):
         :param language: the programming language
         :param max_query_num: the maximum number of queries if the model fails
         :param logger: the logger
+        :param budget: the LLM budget shared with other LLM tools
+        :param persistent_cache: the LLM response cache shared across runs
+        :param deadline: the maximum number of seconds of a query, including retries
+        :param max_output_length: the maximum number of output tokens of a query
+        :param stop_sequences: the sequences stopping the generation
+        :param batch_exporter: the exporter of the prompts of an offline scan
+        :param escalation_model_name: the stronger model answering the queries that the model
+        fails to answer confidently
         """
-        super().__init__(model_name, temperature, language, max_query_num, logger)
-        self.prompt_file = f"{BASE_PATH}/prompt/{language}/dfbscan/path_validator.json"
+        super().__init__(
+            model_name,
+            temperature,
+            language,
+            max_query_num,
+            logger,
+            budget,
+            persistent_cache,
+            deadline,
+            max_output_length,
+            stop_sequences,
+            batch_exporter,
+            escalation_model_name,
+        )
+        prompt_template_dict = self._load_prompt_file(
+            f"{BASE_PATH}/prompt/{language}/dfbscan/path_validator.json"
+        )
+        # The task, the rules, the examples, and the answer format form a prefix shared by all the
+        # prompts, which is followed by the program and the question
+        prefix = prompt_template_dict["task"]
+        prefix += "\n" + "\n".join(prompt_template_dict["analysis_rules"])
+        prefix += "\n" + "\n".join(prompt_template_dict["analysis_examples"])
+        prefix += "\n" + "".join(prompt_template_dict.get("answer_meta_prompts", []))
+        prefix += "\n"
+        meta_prompt = "".join(prompt_template_dict["meta_prompts"])
+        question = "\n".join(prompt_template_dict["question_template"])
+
+        self.answer_format = "\n".join(prompt_template_dict["answer_format"])
+        self.prompt_template = PromptTemplate(
+            meta_prompt.replace("<QUESTION>", question),
+            prefix.replace("<ANSWER>", self.answer_format),
+        )
+        # The task and the question, without the program, open the exchange repairing
+        # an unparsable response
+        self.repair_question_template = PromptTemplate(
+            prompt_template_dict["task"] + "\n" + question
+        )
+
+        # The templates of batched prompts are absent for some languages
+        self.batch_prompt_template: Optional[PromptTemplate] = None
+        self.batch_repair_question_template: Optional[PromptTemplate] = None
+        self.batch_answer_format = ""
+        if "batch_question_template" in prompt_template_dict:
+            batch_question = "\n".join(prompt_template_dict["batch_question_template"])
+            self.batch_answer_format = "\n".join(
+                prompt_template_dict["batch_answer_format"]
+            )
+            self.batch_prompt_template = PromptTemplate(
+                meta_prompt.replace("<QUESTION>", batch_question),
+                prefix.replace("<ANSWER>", self.batch_answer_format),
+            )
+            self.batch_repair_question_template = PromptTemplate(
+                prompt_template_dict["task"] + "\n" + batch_question
+            )
+        self.function_token_nums: Dict[int, int] = {}
         return
 
     def _get_prompt(self, input: LLMToolInput) -> str:
         if not isinstance(input, PathValidatorInput):
             raise TypeError("expect PathValidatorInput")
-        with open(self.prompt_file, "r") as f:
-            prompt_template_dict = json.load(f)
-        prompt = prompt_template_dict["task"]
-        prompt += "\n" + "\n".join(prompt_template_dict["analysis_rules"])
-        prompt += "\n" + "\n".join(prompt_template_dict["analysis_examples"])
-        prompt += "\n" + "".join(prompt_template_dict["meta_prompts"])
-        prompt = prompt.replace(
-            "<ANSWER>", "\n".join(prompt_template_dict["answer_format"])
-        ).replace("<QUESTION>", "\n".join(prompt_template_dict["question_template"]))
+        return self.prompt_template.render(
+            {
+                "PATH": "\n".join(self.__get_path_lines(input)),
+                "BUG_TYPE": input.bug_type,
+                "PROGRAM": self.__get_program([input]),
+            }
+        )
+
+    def _get_repair_prompts(self, input: LLMToolInput) -> Optional[Tuple[str, str]]:
+        if not isinstance(input, PathValidatorInput):
+            raise TypeError("expect PathValidatorInput")
+        question = self.repair_question_template.render(
+            {
+                "PATH": "\n".join(self.__get_path_lines(input)),
+                "BUG_TYPE": input.bug_type,
+            }
+        )
+        return question, self.answer_format
+
+    def _get_batch_repair_prompts(
+        self, inputs: List[LLMToolInput]
+    ) -> Optional[Tuple[str, str]]:
+        if self.batch_repair_question_template is None:
+            return None
+        batch_inputs: List[PathValidatorInput] = []
+        for input in inputs:
+            if not isinstance(input, PathValidatorInput):
+                raise TypeError("expect PathValidatorInput")
+            batch_inputs.append(input)
+        question = self.batch_repair_question_template.render(
+            {
+                "PATHS": self.__get_paths(batch_inputs),
+                "BUG_TYPE": batch_inputs[0].bug_type,
+            }
+        )
+        return question, self.batch_answer_format
+
+    def _get_prompt_prefix_length(self, input: LLMToolInput) -> int:
+        if not isinstance(input, PathValidatorInput):
+            raise TypeError("expect PathValidatorInput")
+        return self.prompt_template.get_prefix_length({"BUG_TYPE": input.bug_type})
+
+    def _get_batch_prompt_prefix_length(self, inputs: List[LLMToolInput]) -> int:
+        if self.batch_prompt_template is None:
+            return 0
+        input = inputs[0]
+        if not isinstance(input, PathValidatorInput):
+            raise TypeError("expect PathValidatorInput")
+        return self.batch_prompt_template.get_prefix_length(
+            {"BUG_TYPE": input.bug_type}
+        )
+
+    def _get_batch_prompt(self, inputs: List[LLMToolInput]) -> str:
+        """
+        Construct a single prompt validating several paths. The code of the functions shared
+        by the paths is included only once.
+        """
+        if self.batch_prompt_template is None:
+            return super()._get_batch_prompt(inputs)
+        batch_inputs: List[PathValidatorInput] = []
+        for input in inputs:
+            if not isinstance(input, PathValidatorInput):
+                raise TypeError("expect PathValidatorInput")
+            batch_inputs.append(input)
+
+        return self.batch_prompt_template.render(
+            {
+                "PATHS": self.__get_paths(batch_inputs),
+                "BUG_TYPE": batch_inputs[0].bug_type,
+                "PROGRAM": self.__get_program(batch_inputs),
+            }
+        )
+
+    def pack_batches(
+        self,
+        inputs: List[PathValidatorInput],
+        max_batch_size: int,
+        max_batch_token_num: int = 32000,
+    ) -> List[List[PathValidatorInput]]:
+        """
+        Pack the inputs into batches for invoke_batch. Paths over the same functions are placed
+        next to each other, and a batch is closed when it is full or the code of its functions
+        exceeds the token limit.
+        :param inputs: the inputs of the path validator
+        :param max_batch_size: the maximum number of paths in a batch
+        :param max_batch_token_num: the maximum number of tokens of the function code in a batch
+        :return: the batches
+        """
+        if max_batch_size <= 1:
+            return [[input] for input in inputs]
+
+        sorted_inputs = sorted(
+            inputs,
+            key=lambda input: sorted(
+                {
+                    function.function_id
+                    for function in input.values_to_functions.values()
+                    if function is not None
+                }
+            ),
+        )
+        batches: List[List[PathValidatorInput]] = []
+        batch: List[PathValidatorInput] = []
+        batch_function_ids: Set[int] = set()
+        batch_token_num = 0
+        for input in sorted_inputs:
+            functions = {
+                function.function_id: function
+                for function in input.values_to_functions.values()
+                if function is not None
+            }
+            new_token_num = sum(
+                self.__get_function_token_num(function)
+                for function_id, function in functions.items()
+                if function_id not in batch_function_ids
+            )
+            if len(batch) > 0 and (
+                len(batch) >= max_batch_size
+                or batch_token_num + new_token_num > max_batch_token_num
+            ):
+                batches.append(batch)
+                batch, batch_function_ids, batch_token_num = [], set(), 0
+                new_token_num = sum(
+                    self.__get_function_token_num(function)
+                    for function in functions.values()
+                )
+            batch.append(input)
+            batch_function_ids.update(functions.keys())
+            batch_token_num += new_token_num
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
+
+    def __get_function_token_num(self, function: Function) -> int:
+        if function.function_id not in self.function_token_nums:
+            self.function_token_nums[function.function_id] = len(
+                self.model.encoding.encode(function.lined_code)
+            )
+        return self.function_token_nums[function.function_id]
+
+    def __get_paths(self, inputs: List[PathValidatorInput]) -> str:
+        """
+        Describe the numbered paths of a batch
+        """
+        paths_str = ""
+        for i, input in enumerate(inputs):
+            paths_str += f"Path {i + 1}:\n```\n"
+            paths_str += "\n".join(self.__get_path_lines(input))
+            paths_str += "\n```\n"
+        return paths_str
 
+    def __get_path_lines(self, input: PathValidatorInput) -> List[str]:
+        """
+        Describe the values along the path with their functions and relative line numbers.
+        """
         value_lines = []
         for value in input.values:
             value_line = " - " + str(value)
@@ -84,22 +299,26 @@ class PathValidator(LLMTool):
                 + str(value.line_number - function.start_line_number + 1)
             )
             value_lines.append(value_line)
-        prompt = prompt.replace("<PATH>", "\n".join(value_lines))
-        prompt = prompt.replace("<BUG_TYPE>", input.bug_type)
-
-        program = "\n".join(
-            [
-                "```\n" + func.lined_code + "\n```\n" if func is not None else "\n"
-                for func in input.values_to_functions.values()
-            ]
+        return value_lines
+
+    def __get_program(self, inputs: List[PathValidatorInput]) -> str:
+        """
+        Concatenate the code of the functions involved in the paths. Each function appears once,
+        even if several values of the paths are located in it.
+        """
+        functions: Dict[int, Function] = {}
+        for input in inputs:
+            for function in input.values_to_functions.values():
+                if function is not None and function.function_id not in functions:
+                    functions[function.function_id] = function
+        return "\n".join(
+            ["```\n" + function.lined_code + "\n```\n" for function in functions.values()]
         )
-        prompt = prompt.replace("<PROGRAM>", program)
-        return prompt
 
     def _parse_response(
         self, response: str, input: Optional[LLMToolInput] = None
     ) -> Optional[LLMToolOutput]:
-        answer_match = re.search(r"Answer:\s*(\w+)", response)
+        answer_match = PathValidator.ANSWER_PATTERN.search(response)
         if answer_match:
             answer = answer_match.group(1).strip()
             output = PathValidatorOutput(answer == "Yes", response)
@@ -108,3 +327,65 @@ class PathValidator(LLMTool):
             self.logger.print_log(f"Answer not found in output")
             output = None
         return output
+
+    def _is_confident(self, output: LLMToolOutput) -> bool:
+        """
+        A verdict other than Yes or No, e.g., "Unknown", is not confident
+        """
+        if not isinstance(output, PathValidatorOutput):
+            raise TypeError("expect PathValidatorOutput")
+        answer_match = PathValidator.ANSWER_PATTERN.search(output.explanation_str)
+        return answer_match is not None and answer_match.group(1) in {"Yes", "No"}
+
+    def _get_early_stop(
+        self, input: LLMToolInput
+    ) -> Optional[Callable[[str], bool]]:
+        """
+        Only the verdict is parsed, so the response is not awaited after the answer line
+        """
+        return lambda response: PathValidator.ANSWER_PATTERN.search(response) is not None
+
+    def _get_batch_early_stop(
+        self, inputs: List[LLMToolInput]
+    ) -> Optional[Callable[[str], bool]]:
+        """
+        Stop the response once every path of the batch is answered
+        """
+        path_numbers = set(range(1, len(inputs) + 1))
+        return lambda response: path_numbers.issubset(
+            self.__get_answer_sections(response).keys()
+        )
+
+    def __get_answer_sections(self, response: str) -> Dict[int, str]:
+        """
+        Split the response into the sections starting with "Path N:".
+        If a path is answered several times, the last section containing an answer is used.
+        :return: the map from path numbers to the sections containing answers
+        """
+        path_header_re = re.compile(r"^\W*Path\s*(\d+)\s*:", re.MULTILINE)
+        headers = list(path_header_re.finditer(response))
+
+        sections: Dict[int, str] = {}
+        for i, header in enumerate(headers):
+            end = headers[i + 1].start() if i + 1 < len(headers) else len(response)
+            section = response[header.end() : end]
+            if PathValidator.ANSWER_PATTERN.search(section):
+                sections[int(header.group(1))] = section
+        return sections
+
+    def _parse_batch_response(
+        self, response: str, inputs: List[LLMToolInput]
+    ) -> List[Optional[LLMToolOutput]]:
+        """
+        Parse the verdict of the section "Path N:" for the N-th input
+        """
+        sections = self.__get_answer_sections(response)
+        outputs: List[Optional[LLMToolOutput]] = []
+        for i, input in enumerate(inputs):
+            answer_section = sections.get(i + 1)
+            outputs.append(
+                self._parse_response(answer_section.strip(), input)
+                if answer_section is not None
+                else None
+            )
+        return outputs
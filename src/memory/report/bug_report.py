@@ -1,6 +1,7 @@
+import hashlib
 from memory.syntactic.function import *
 from memory.syntactic.value import *
-from typing import Dict
+from typing import Dict, Iterable
 
 
 class BugReport:
@@ -23,8 +24,32 @@ class BugReport:
         self.relevant_functions = relevant_functions
         self.explanation = explanation
         self.is_human_confirmed_true = is_human_confirmed_true
+        self.fingerprint = BugReport.compute_fingerprint(
+            buggy_value, relevant_functions.values()
+        )
         return
 
+    @staticmethod
+    def compute_fingerprint(
+        buggy_value: Value, relevant_functions: Iterable[Function]
+    ) -> str:
+        """
+        Compute a fingerprint identifying the bug report by its buggy value and relevant functions.
+        Function ids depend on the parsing order, so functions are identified by their locations,
+        which keeps the fingerprint stable across runs on the same code.
+        :param buggy_value: the buggy value
+        :param relevant_functions: the relevant functions
+        :return: the hex digest of the fingerprint
+        """
+        function_keys = sorted(
+            {
+                f"{function.file_path}:{function.function_name}:{function.start_line_number}"
+                for function in relevant_functions
+            }
+        )
+        content = "\n".join([str(buggy_value)] + function_keys)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
     def to_dict(self) -> dict:
         return {
             "bug_type": self.bug_type,
@@ -49,18 +74,16 @@ class BugReport:
                 if self.is_human_confirmed_true is not None
                 else "unknown"
             ),
+            "fingerprint": self.fingerprint,
         }
 
     def __str__(self):
         return str(self.to_dict())
 
     def __hash__(self) -> int:
-        relevant_functions_ids = [
-            function.function_id for function in self.relevant_functions.values()
-        ]
-        return hash((self.buggy_value, tuple(sorted(relevant_functions_ids))))
+        return hash(self.fingerprint)
 
     def __eq__(self, value: object) -> bool:
         if not isinstance(value, BugReport):
             return False
-        return hash(self) == hash(value)
+        return self.fingerprint == value.fingerprint
@@ -0,0 +1,149 @@
+import json
+import os
+import queue
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from memory.report.bug_report import *
+
+
+class BugReportWriter:
+    """
+    Append-only sink of bug reports.
+    Reports are appended to a JSONL file by a single writer thread, which flushes and fsyncs
+    the file in batches. The JSONL file is compacted into the JSON file consumed by the web UI
+    when the writer is closed.
+    """
+
+    def __init__(
+        self,
+        res_dir_path: str,
+        jsonl_file_name: str = "detect_info.jsonl",
+        json_file_name: str = "detect_info.json",
+        flush_batch_size: int = 16,
+        flush_interval: float = 1.0,
+    ) -> None:
+        """
+        :param res_dir_path: the result directory
+        :param jsonl_file_name: the name of the append-only JSONL file
+        :param json_file_name: the name of the compacted JSON file
+        :param flush_batch_size: the maximum number of records written before an fsync
+        :param flush_interval: the maximum number of seconds between two fsyncs
+        """
+        self.jsonl_path = os.path.join(res_dir_path, jsonl_file_name)
+        self.json_path = os.path.join(res_dir_path, json_file_name)
+        self.flush_batch_size = flush_batch_size
+        self.flush_interval = flush_interval
+
+        # None is the stop signal sent by close()
+        self._queue: "queue.Queue[Optional[Tuple[int, dict]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        return
+
+    def start(self) -> None:
+        """
+        Start the writer thread
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._write_loop, name="BugReportWriter", daemon=True
+            )
+            self._thread.start()
+
+    def append(self, report_id: int, bug_report: BugReport) -> None:
+        """
+        Enqueue a bug report. The report is serialized by the caller, so that later
+        changes of the report object do not race with the writer thread.
+        :param report_id: the id of the bug report
+        :param bug_report: the bug report
+        """
+        self._queue.put((report_id, bug_report.to_dict()))
+
+    def close(self) -> Dict[str, dict]:
+        """
+        Drain the queue, stop the writer thread, and compact the JSONL file
+        :return: the compacted bug reports
+        """
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+        return self.compact()
+
+    def read_reports(self) -> Dict[str, dict]:
+        """
+        Read the bug reports streamed to the JSONL file, including the ones of previous runs
+        in the same result directory. A truncated last line, e.g., left by a crash, is skipped.
+        :return: the map from report ids to bug reports
+        """
+        bug_report_dict: Dict[str, dict] = {}
+        if not os.path.exists(self.jsonl_path):
+            return bug_report_dict
+        with open(self.jsonl_path, "r") as jsonl_file:
+            for line in jsonl_file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                bug_report_dict[str(record["id"])] = record["report"]
+        return bug_report_dict
+
+    def compact(self) -> Dict[str, dict]:
+        """
+        Compact the JSONL file into the JSON file. The JSON file is replaced atomically.
+        :return: the compacted bug reports
+        """
+        bug_report_dict = self.read_reports()
+        tmp_path = self.json_path + ".tmp"
+        with open(tmp_path, "w") as bug_info_file:
+            json.dump(bug_report_dict, bug_info_file, indent=4)
+        os.replace(tmp_path, self.json_path)
+        return bug_report_dict
+
+    def _is_last_line_truncated(self) -> bool:
+        """
+        Check whether the JSONL file ends without a newline, e.g., after a crash
+        """
+        if not os.path.exists(self.jsonl_path) or os.path.getsize(self.jsonl_path) == 0:
+            return False
+        with open(self.jsonl_path, "rb") as jsonl_file:
+            jsonl_file.seek(-1, os.SEEK_END)
+            return jsonl_file.read(1) != b"\n"
+
+    def _write_loop(self) -> None:
+        is_last_line_truncated = self._is_last_line_truncated()
+        with open(self.jsonl_path, "a") as jsonl_file:
+            if is_last_line_truncated:
+                # End the truncated line, so that it does not swallow the first new record
+                jsonl_file.write("\n")
+            pending_num = 0
+            last_flush_time = time.monotonic()
+            while True:
+                try:
+                    item = self._queue.get(timeout=self.flush_interval)
+                    if item is None:
+                        break
+                    report_id, report = item
+                    jsonl_file.write(json.dumps({"id": report_id, "report": report}))
+                    jsonl_file.write("\n")
+                    pending_num += 1
+                except queue.Empty:
+                    # No new report within the flush interval
+                    pass
+
+                if pending_num > 0 and (
+                    pending_num >= self.flush_batch_size
+                    or time.monotonic() - last_flush_time >= self.flush_interval
+                ):
+                    jsonl_file.flush()
+                    os.fsync(jsonl_file.fileno())
+                    pending_num = 0
+                    last_flush_time = time.monotonic()
+
+            jsonl_file.flush()
+            os.fsync(jsonl_file.fileno())
+        return
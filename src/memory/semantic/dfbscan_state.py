@@ -1,5 +1,5 @@
 import threading
-from typing import List, Tuple, Dict, Set
+from typing import List, Tuple, Dict, Set, Optional, Iterable
 from memory.syntactic.function import *
 from memory.syntactic.value import *
 from memory.report.bug_report import *
@@ -29,6 +29,9 @@ class DFBScanState(State):
         self._bug_reports: Dict[int, BugReport] = {}
         self._total_bug_count = 0
 
+        # Fingerprints of the bug reports, used for deduplication
+        self._bug_report_fingerprints: Set[str] = set()
+
         # Create locks for each field
         self._reachable_values_lock = threading.Lock()
         self._external_value_match_lock = threading.Lock()
@@ -69,20 +72,23 @@ class DFBScanState(State):
                 self._potential_buggy_paths[src_value] = {}
             self._potential_buggy_paths[src_value][str(path)] = path
 
-    def update_bug_report(self, bug_report: BugReport) -> None:
+    def update_bug_report(self, bug_report: BugReport) -> Optional[int]:
         """
-        Update the bug scan state with the bug report, deduplicating based on equality
+        Update the bug scan state with the bug report, deduplicating based on fingerprints
         :param bug_report: the bug report
+        :return: the id of the bug report if it is new, otherwise None
         """
         with self._bug_reports_lock:
             # Check if identical bug report already exists
-            if bug_report in self._bug_reports.values():
-                return
+            if bug_report.fingerprint in self._bug_report_fingerprints:
+                return None
             # Add new unique bug report
-            self._bug_reports[self._total_bug_count] = bug_report
-
-        with self._total_bug_count_lock:
-            self._total_bug_count += 1
+            self._bug_report_fingerprints.add(bug_report.fingerprint)
+            with self._total_bug_count_lock:
+                report_id = self._total_bug_count
+                self._bug_reports[report_id] = bug_report
+                self._total_bug_count += 1
+        return report_id
 
     @property
     def reachable_values_per_path(
@@ -128,21 +134,57 @@ class DFBScanState(State):
         with self._total_bug_count_lock:
             return self._total_bug_count
 
+    @property
+    def bug_report_fingerprints(self) -> Set[str]:
+        """
+        Get the fingerprints of the bug reports
+        """
+        with self._bug_reports_lock:
+            return self._bug_report_fingerprints.copy()
+
+    def to_checkpoint(self) -> Dict:
+        """
+        Dump the bug report index to a JSON-serializable checkpoint.
+        The propagation facts are not dumped since they refer to function ids,
+        which are only valid in the current run.
+        """
+        with self._bug_reports_lock:
+            with self._total_bug_count_lock:
+                return {
+                    "total_bug_count": self._total_bug_count,
+                    "bug_report_fingerprints": sorted(self._bug_report_fingerprints),
+                }
+
+    def load_checkpoint(self, checkpoint: Dict) -> None:
+        """
+        Restore the bug report index from a checkpoint.
+        The restored reports are only indexed for deduplication, and new reports get fresh ids.
+        """
+        self.restore_bug_report_index(
+            checkpoint.get("bug_report_fingerprints", []),
+            checkpoint.get("total_bug_count", 0),
+        )
+
+    def restore_bug_report_index(
+        self, fingerprints: Iterable[str], total_bug_count: int
+    ) -> None:
+        """
+        Index the fingerprints of bug reports found by a previous run
+        :param fingerprints: the fingerprints of the previous bug reports
+        :param total_bug_count: the number of ids used by the previous bug reports
+        """
+        with self._bug_reports_lock:
+            self._bug_report_fingerprints.update(fingerprints)
+            with self._total_bug_count_lock:
+                self._total_bug_count = max(self._total_bug_count, total_bug_count)
+
     def check_existence(self, src: Value, relevant_functions: set[Function]) -> bool:
         """
         Check if the bug report with the same src and relevant functions already exists
         """
+        fingerprint = BugReport.compute_fingerprint(src, relevant_functions)
         with self._bug_reports_lock:
-            relevant_functions_ids = [
-                function.function_id for function in relevant_functions
-            ]
-            hash_value = hash((src, tuple(sorted(list(relevant_functions_ids)))))
-            is_exist = False
-            for report in self._bug_reports.values():
-                if hash(report) == hash_value:
-                    is_exist = True
-                    break
-            return is_exist
+            return fingerprint in self._bug_report_fingerprints
 
     def print_reachable_values_per_path(self) -> None:
         """
@@ -46,10 +46,42 @@ class RepoAudit:
         self.call_depth = args.call_depth
         self.max_symbolic_workers = args.max_symbolic_workers
         self.max_neural_workers = args.max_neural_workers
+        self.intra_dfa_workers = args.intra_dfa_workers
+        self.path_validation_workers = args.path_validation_workers
 
         self.bug_type = args.bug_type
         self.is_reachable = args.is_reachable
 
+        self.resume_dir = args.resume
+        self.checkpoint_interval = args.checkpoint_interval
+        self.intra_dfa_batch_size = args.intra_dfa_batch_size
+        self.path_validation_batch_size = args.path_validation_batch_size
+        self.max_llm_tokens = args.max_llm_tokens
+        self.max_llm_queries = args.max_llm_queries
+        self.max_scan_seconds = args.max_scan_seconds
+        self.async_inference = args.async_inference
+        # Responses are only reproducible with temperature 0, so the cache is off otherwise by default
+        # A recording is only complete if every prompt is sent to the provider, so the cache is
+        # also off by default when recording
+        self.use_llm_cache = args.llm_cache == "on" or (
+            args.llm_cache == "auto" and args.temperature == 0 and not args.llm_record
+        )
+        self.llm_cache_path = args.llm_cache_path
+        self.llm_cache_max_entries = args.llm_cache_max_entries
+        self.intra_dfa_timeout = args.intra_dfa_timeout
+        self.path_validation_timeout = args.path_validation_timeout
+        self.intra_dfa_max_tokens = args.intra_dfa_max_tokens
+        self.path_validation_max_tokens = args.path_validation_max_tokens
+        self.intra_dfa_stop = args.intra_dfa_stop
+        self.path_validation_stop = args.path_validation_stop
+        self.export_prompts = args.export_prompts
+        self.intra_dfa_model = args.intra_dfa_model
+        self.path_validation_model = args.path_validation_model
+        self.intra_dfa_escalation_model = args.intra_dfa_escalation_model
+        self.path_validation_escalation_model = args.path_validation_escalation_model
+        self.intra_dfa_structured_output = args.intra_dfa_structured_output
+        self.import_responses = args.import_responses
+
         suffixs = []
         if self.language == "Cpp":
             suffixs = ["cpp", "cc", "hpp", "c", "h"]
@@ -97,6 +129,42 @@ class RepoAudit:
             metascan_pipeline.start_scan()
 
         if self.args.scan_type == "dfbscan":
+            model_names = {
+                self.model_name,
+                self.intra_dfa_model,
+                self.path_validation_model,
+                self.intra_dfa_escalation_model,
+                self.path_validation_escalation_model,
+            } - {None}
+            if self.args.llm_endpoint:
+                # The endpoint serves the models of all the LLM tools
+                endpoint = LLMEndpoint(
+                    self.args.llm_endpoint,
+                    os.environ.get("LLM_ENDPOINT_API_KEY"),
+                    self.args.llm_endpoint_timeout,
+                )
+                for model_name in model_names:
+                    register_endpoint(model_name, endpoint)
+            # The limits apply to every provider serving the models of the LLM tools
+            for model_name in model_names:
+                get_rate_limiter(LLM.get_provider(model_name)).configure(
+                    self.args.max_requests_per_minute,
+                    self.args.max_tokens_per_minute,
+                    (
+                        self.args.llm_endpoint_max_concurrency
+                        if get_endpoint(model_name) is not None
+                        else None
+                    ),
+                )
+            get_client_pool().configure(self.args.max_llm_connections)
+            get_retry_policy().configure(self.args.llm_max_attempts)
+            configure_key_selection(self.args.llm_key_selection)
+            if self.args.llm_record:
+                get_llm_recorder().configure("record", self.args.llm_record)
+            elif self.args.llm_replay:
+                get_llm_recorder().configure(
+                    "replay", self.args.llm_replay, self.args.llm_replay_latency
+                )
             dfbscan_agent = DFBScanAgent(
                 self.bug_type,
                 self.is_reachable,
@@ -107,6 +175,33 @@ class RepoAudit:
                 self.temperature,
                 self.call_depth,
                 self.max_neural_workers,
+                resume_dir=self.resume_dir,
+                checkpoint_interval=self.checkpoint_interval,
+                intra_dfa_batch_size=self.intra_dfa_batch_size,
+                path_validation_batch_size=self.path_validation_batch_size,
+                max_llm_token_num=self.max_llm_tokens,
+                max_llm_query_num=self.max_llm_queries,
+                max_scan_seconds=self.max_scan_seconds,
+                async_inference=self.async_inference,
+                use_llm_cache=self.use_llm_cache,
+                llm_cache_path=self.llm_cache_path,
+                llm_cache_max_entry_num=self.llm_cache_max_entries,
+                intra_dfa_deadline=self.intra_dfa_timeout,
+                path_validation_deadline=self.path_validation_timeout,
+                intra_dfa_max_output_length=self.intra_dfa_max_tokens,
+                path_validation_max_output_length=self.path_validation_max_tokens,
+                intra_dfa_stop_sequences=self.intra_dfa_stop,
+                path_validation_stop_sequences=self.path_validation_stop,
+                export_prompts_path=self.export_prompts,
+                import_responses_path=self.import_responses,
+                intra_dfa_model_name=self.intra_dfa_model,
+                path_validation_model_name=self.path_validation_model,
+                intra_dfa_escalation_model_name=self.intra_dfa_escalation_model,
+                path_validation_escalation_model_name=self.path_validation_escalation_model,
+                intra_dfa_structured_output=self.intra_dfa_structured_output,
+                max_symbolic_workers=self.max_symbolic_workers,
+                intra_dfa_workers=self.intra_dfa_workers,
+                path_validation_workers=self.path_validation_workers,
             )
             dfbscan_agent.start_scan()
         return
@@ -179,6 +274,14 @@ class RepoAudit:
                 err_messages.append("Error: --bug -type is required for dfbscan.")
             if self.args.bug_type not in default_dfbscan_checkers[self.args.language]:
                 err_messages.append("Error: Invalid bug type provided.")
+            if self.args.resume and not os.path.isdir(self.args.resume):
+                err_messages.append("Error: --resume must be an existing result directory.")
+            if self.args.llm_record and self.args.llm_replay:
+                err_messages.append("Error: --llm-record and --llm-replay cannot be used together.")
+            if self.args.llm_replay and not os.path.isfile(self.args.llm_replay):
+                err_messages.append("Error: --llm-replay must be an existing recording.")
+            if self.args.import_responses and not os.path.isfile(self.args.import_responses):
+                err_messages.append("Error: --import-responses must be an existing file.")
         elif self.args.scan_type == "metascan":
             return (True, [])
         else:
@@ -203,7 +306,8 @@ def configure_args():
         "--max-symbolic-workers",
         type=int,
         default=30,
-        help="Max symbolic workers for parsing-based analysis",
+        help="Max symbolic workers for parsing-based analysis, and for each symbolic stage of "
+        "the dfbscan pipeline",
     )
 
     # Common parameters for dfbscan
@@ -218,10 +322,205 @@ def configure_args():
         default=1,
         help="Max neural workers for prompting-based analysis",
     )
+    parser.add_argument(
+        "--intra-dfa-workers",
+        type=int,
+        help="Max number of concurrent intra-procedural analyses (default: --max-neural-workers)",
+    )
+    parser.add_argument(
+        "--path-validation-workers",
+        type=int,
+        help="Max number of concurrent path validations (default: --max-neural-workers)",
+    )
+    parser.add_argument(
+        "--intra-dfa-model",
+        help="The LLM of intra-procedural analysis (default: --model-name)",
+    )
+    parser.add_argument(
+        "--path-validation-model",
+        help="The LLM of path validation (default: --model-name)",
+    )
+    parser.add_argument(
+        "--intra-dfa-escalation-model",
+        help="A stronger LLM answering the intra-procedural analysis queries that the model "
+        "answers with unparsable or low-confidence responses",
+    )
+    parser.add_argument(
+        "--path-validation-escalation-model",
+        help="A stronger LLM answering the path validation queries that the model "
+        "answers with unparsable or low-confidence responses",
+    )
+    parser.add_argument(
+        "--intra-dfa-structured-output",
+        action="store_true",
+        help="Ask the LLM of intra-procedural analysis for JSON answers conforming to a schema "
+        "(structured outputs or tool calling, where the provider supports them)",
+    )
     parser.add_argument("--bug-type", help="Bug type for dfbscan)")
     parser.add_argument(
         "--is-reachable", action="store_true", help="Flag for bugscan reachability"
     )
+    parser.add_argument(
+        "--intra-dfa-batch-size",
+        type=int,
+        default=1,
+        help="Max number of source values in the same function analyzed in one prompt (1 disables batching)",
+    )
+    parser.add_argument(
+        "--path-validation-batch-size",
+        type=int,
+        default=1,
+        help="Max number of paths of a source value validated in one prompt (1 disables batching)",
+    )
+    parser.add_argument(
+        "--async-inference",
+        action="store_true",
+        help="Query LLMs on an event loop, with up to --intra-dfa-workers and "
+        "--path-validation-workers requests in flight",
+    )
+    parser.add_argument(
+        "--max-requests-per-minute",
+        type=int,
+        help="Max number of requests per minute sent to the LLM provider with all its API keys "
+        "(unlimited by default)",
+    )
+    parser.add_argument(
+        "--max-tokens-per-minute",
+        type=int,
+        help="Max number of tokens per minute sent to the LLM provider with all its API keys "
+        "(unlimited by default)",
+    )
+    parser.add_argument(
+        "--llm-endpoint",
+        help="Base URL of an OpenAI-compatible endpoint serving --model-name and the models of the LLM tools, "
+        "e.g., a vLLM or llama.cpp server "
+        "(API key in LLM_ENDPOINT_API_KEY, if required)",
+    )
+    parser.add_argument(
+        "--llm-endpoint-max-concurrency",
+        type=int,
+        help="Max number of concurrent requests sent to --llm-endpoint (adaptive by default)",
+    )
+    parser.add_argument(
+        "--llm-endpoint-timeout",
+        type=float,
+        default=100,
+        help="Timeout (in seconds) of a request sent to --llm-endpoint",
+    )
+    parser.add_argument(
+        "--llm-max-attempts",
+        type=int,
+        default=5,
+        help="Max number of attempts of an LLM request, retried after an exponential backoff with jitter",
+    )
+    parser.add_argument(
+        "--llm-key-selection",
+        choices=KEY_SELECTIONS,
+        default=LEAST_LOADED,
+        help="Selection of the API key of an LLM request, if several keys of a provider are given "
+        "separated by ':', e.g., OPENAI_API_KEY=key1:key2",
+    )
+    parser.add_argument(
+        "--max-llm-connections",
+        type=int,
+        default=100,
+        help="Max number of keep-alive connections to the LLM provider",
+    )
+    parser.add_argument(
+        "--llm-cache",
+        choices=["auto", "on", "off"],
+        default="auto",
+        help="Persistent LLM response cache shared across runs (auto: on if --temperature is 0 "
+        "and --llm-record is not given, i.e., off with the default temperature 0.5)",
+    )
+    parser.add_argument(
+        "--llm-cache-path",
+        help="Path of the LLM response cache (default: cache/llm_response_cache.db)",
+    )
+    parser.add_argument(
+        "--llm-cache-max-entries",
+        type=int,
+        default=100000,
+        help="Max number of responses in the LLM response cache",
+    )
+    parser.add_argument(
+        "--llm-record",
+        help="Path of a JSON Lines file recording every LLM prompt, response, and latency of the scan",
+    )
+    parser.add_argument(
+        "--llm-replay",
+        help="Path of a recording of --llm-record, from which the LLM responses are replayed offline",
+    )
+    parser.add_argument(
+        "--llm-replay-latency",
+        action="store_true",
+        help="Return the replayed LLM responses after their recorded latencies",
+    )
+    parser.add_argument(
+        "--resume",
+        help="Result directory of an interrupted dfbscan run to resume from",
+    )
+    parser.add_argument(
+        "--export-prompts",
+        help="Offline scan: write the prompts of the next round to this JSON Lines file (in the format "
+        "of the OpenAI batch API) instead of querying the LLM",
+    )
+    parser.add_argument(
+        "--import-responses",
+        help="Offline scan: JSON Lines file of the responses to the prompts exported by the previous round",
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        type=int,
+        default=60,
+        help="Interval (in seconds) between two checkpoints of dfbscan",
+    )
+    parser.add_argument(
+        "--max-llm-tokens",
+        type=int,
+        help="Max number of input and output tokens spent by dfbscan (unlimited by default)",
+    )
+    parser.add_argument(
+        "--max-llm-queries",
+        type=int,
+        help="Max number of LLM queries issued by dfbscan (unlimited by default)",
+    )
+    parser.add_argument(
+        "--max-scan-seconds",
+        type=float,
+        help="Max wall-clock time (in seconds) of dfbscan (unlimited by default)",
+    )
+    parser.add_argument(
+        "--intra-dfa-timeout",
+        type=float,
+        help="Max time (in seconds) of an intra-procedural analysis query, including retries",
+    )
+    parser.add_argument(
+        "--path-validation-timeout",
+        type=float,
+        help="Max time (in seconds) of a path validation query, including retries",
+    )
+    parser.add_argument(
+        "--intra-dfa-max-tokens",
+        type=int,
+        help="Max number of output tokens of an intra-procedural analysis query (provider default if unset)",
+    )
+    parser.add_argument(
+        "--path-validation-max-tokens",
+        type=int,
+        help="Max number of output tokens of a path validation query (provider default if unset)",
+    )
+    parser.add_argument(
+        "--intra-dfa-stop",
+        action="append",
+        help="Sequence stopping the generation of an intra-procedural analysis query "
+        "(repeatable)",
+    )
+    parser.add_argument(
+        "--path-validation-stop",
+        action="append",
+        help="Sequence stopping the generation of a path validation query (repeatable)",
+    )
 
     args = parser.parse_args()
     return args
@@ -0,0 +1,80 @@
+import pytest
+
+from llmtool.dfbscan.intra_dataflow_analyzer import *
+from ui.logger import Logger
+
+FUNCTION = Function(
+    1,
+    "f",
+    "Object f(Object a, Object b) {\n  a.g();\n  return b;\n}",
+    10,
+    13,
+    None,  # type: ignore[arg-type]
+    "A.java",
+)
+
+
+@pytest.fixture
+def analyzer(tmp_path):
+    return IntraDataFlowAnalyzer(
+        "gpt-4o", 0.0, "Java", 5, Logger(str(tmp_path / "intra_dfa.log"))
+    )
+
+
+def get_input(name: str, index: int) -> IntraDataFlowAnalyzerInput:
+    src_value = Value(name, 10, ValueLabel.PARA, "A.java", index)
+    return IntraDataFlowAnalyzerInput(FUNCTION, src_value, [("a.g()", 2)], [], [])
+
+
+def get_sink_answer(path_number: int) -> str:
+    return (
+        f"Answer:\n- Path {path_number}: Lines 1 -> 2;\n"
+        "    - Type: Sink; Name: a; Function: None; Index: None; Line: 2; "
+        "Dependency: a is dereferenced\n"
+    )
+
+
+RETURN_ANSWER = (
+    "- Path 1: Lines 1 -> 3;\n"
+    "    - Type: Return; Name: b; Function: None; Index: 0; Line: 3; "
+    "Dependency: b is returned\n"
+)
+SINK = Value("a", 11, ValueLabel.SINK, "A.java")
+RETURN = Value("b", 12, ValueLabel.RET, "A.java", 0)
+
+
+def test_parse_response(analyzer):
+    output = analyzer._parse_response(get_sink_answer(1), get_input("a", 0))
+    assert isinstance(output, IntraDataFlowAnalyzerOutput)
+    assert output.reachable_values == [{SINK}]
+
+
+def test_parse_response_without_path(analyzer):
+    assert analyzer._parse_response("Answer: a is null", get_input("a", 0)) is None
+
+
+def test_parse_batch_response(analyzer):
+    inputs = [get_input("a", 0), get_input("b", 1)]
+    response = "Source 1:\n" + get_sink_answer(1) + "**Source 2:**\n" + RETURN_ANSWER
+    outputs = analyzer._parse_batch_response(response, inputs)
+    assert [output.reachable_values for output in outputs] == [[{SINK}], [{RETURN}]]
+
+
+def test_parse_batch_response_uses_last_answer(analyzer):
+    inputs = [get_input("a", 0), get_input("b", 1)]
+    # The questions are restated before the answers
+    response = (
+        "Source 1: a at line 1\nSource 2: b at line 1\n"
+        "Source 2:\n" + RETURN_ANSWER + "Source 1:\n" + get_sink_answer(1)
+    )
+    outputs = analyzer._parse_batch_response(response, inputs)
+    assert [output.reachable_values for output in outputs] == [[{SINK}], [{RETURN}]]
+
+
+def test_parse_batch_response_with_missing_answers(analyzer):
+    inputs = [get_input("a", 0), get_input("b", 1), get_input("c", 2)]
+    response = "Source 2:\nNo propagation\nSource 3:\n" + RETURN_ANSWER
+    outputs = analyzer._parse_batch_response(response, inputs)
+    assert outputs[0] is None
+    assert outputs[1] is None
+    assert outputs[2].reachable_values == [{RETURN}]
@@ -0,0 +1,88 @@
+import pytest
+
+from llmtool.dfbscan.path_validator import *
+from ui.logger import Logger
+
+FUNCTIONS = [
+    Function(
+        function_id,
+        f"f{function_id}",
+        "void f() {}",
+        1,
+        1,
+        None,  # type: ignore[arg-type]
+        "A.java",
+    )
+    for function_id in range(4)
+]
+
+
+@pytest.fixture
+def validator(tmp_path):
+    validator = PathValidator(
+        "gpt-4o", 0.0, "Java", 5, Logger(str(tmp_path / "path_validator.log"))
+    )
+    # Each function is counted as 100 tokens
+    validator.function_token_nums = {
+        function.function_id: 100 for function in FUNCTIONS
+    }
+    return validator
+
+
+def get_input(*function_ids: int) -> PathValidatorInput:
+    values = [
+        Value(f"v{i}", 1, ValueLabel.SRC if i == 0 else ValueLabel.SINK, "A.java")
+        for i in range(len(function_ids))
+    ]
+    values_to_functions: Dict[Value, Optional[Function]] = {
+        value: FUNCTIONS[function_id]
+        for value, function_id in zip(values, function_ids)
+    }
+    return PathValidatorInput("NPD", values, values_to_functions)
+
+
+def test_parse_response(validator):
+    output = validator._parse_response("The value is null.\nAnswer: Yes")
+    assert isinstance(output, PathValidatorOutput)
+    assert output.is_reachable
+    assert validator._parse_response("The value is not null.") is None
+
+
+def test_parse_batch_response(validator):
+    inputs = [get_input(0), get_input(1), get_input(2)]
+    # The paths are restated before the answers, and the second path is not answered
+    response = (
+        "Path 1:\n```\n - v0\n```\nPath 2:\n```\n - v0\n```\n"
+        "**Path 3:** The value is checked.\nAnswer: No\n"
+        "Path 1: The value is null.\nAnswer: Yes\n"
+    )
+    outputs = validator._parse_batch_response(response, inputs)
+    assert outputs[0].is_reachable
+    assert outputs[1] is None
+    assert not outputs[2].is_reachable
+
+
+def test_batch_early_stop(validator):
+    early_stop = validator._get_batch_early_stop([get_input(0), get_input(1)])
+    assert not early_stop("Path 1:\nAnswer: Yes\nPath 2:\nThe value")
+    assert early_stop("Path 1:\nAnswer: Yes\nPath 2:\nAnswer: No")
+
+
+def test_pack_batches_without_batching(validator):
+    inputs = [get_input(0), get_input(1)]
+    assert validator.pack_batches(inputs, 1) == [[inputs[0]], [inputs[1]]]
+
+
+def test_pack_batches_groups_paths_over_same_functions(validator):
+    inputs = [get_input(1, 2), get_input(0), get_input(1, 2), get_input(0, 3)]
+    batches = validator.pack_batches(inputs, 2)
+    assert batches == [[inputs[1], inputs[3]], [inputs[0], inputs[2]]]
+
+
+def test_pack_batches_bounds_function_tokens(validator):
+    inputs = [get_input(0, 1), get_input(0, 1), get_input(0, 2), get_input(3)]
+    # The shared functions are counted once
+    batches = validator.pack_batches(inputs, 4, max_batch_token_num=300)
+    assert batches == [inputs[:3], inputs[3:]]
+    batches = validator.pack_batches(inputs, 4, max_batch_token_num=200)
+    assert batches == [inputs[:2], inputs[2:3], inputs[3:]]
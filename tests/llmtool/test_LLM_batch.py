@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+from llmtool.LLM_batch import *
+
+
+def test_custom_id_round_trip():
+    custom_id = get_batch_custom_id("path-validator", "0123abcd")
+    assert parse_batch_custom_id(custom_id) == ("path-validator", "0123abcd")
+
+
+def test_plain_response():
+    assert get_batch_response_text({"custom_id": "t-d", "response": "Answer: Yes"}) == (
+        "Answer: Yes"
+    )
+
+
+def test_openai_response():
+    result = {
+        "custom_id": "t-d",
+        "response": {
+            "status_code": 200,
+            "body": {"choices": [{"message": {"content": "Answer: Yes"}}]},
+        },
+    }
+    assert get_batch_response_text(result) == "Answer: Yes"
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        {"status_code": 500, "body": {"choices": [{"message": {"content": "x"}}]}},
+        {"status_code": 200, "body": {"choices": []}},
+    ],
+)
+def test_failed_openai_response(response):
+    assert get_batch_response_text({"custom_id": "t-d", "response": response}) is None
+
+
+def test_anthropic_response():
+    result = {
+        "custom_id": "t-d",
+        "result": {
+            "type": "succeeded",
+            "message": {
+                "content": [
+                    {"type": "text", "text": "Answer: "},
+                    {"type": "text", "text": "Yes"},
+                ]
+            },
+        },
+    }
+    assert get_batch_response_text(result) == "Answer: Yes"
+
+
+def test_anthropic_tool_use_response():
+    answer = {"is_reachable": True, "explanation": "..."}
+    result = {
+        "custom_id": "t-d",
+        "result": {
+            "type": "succeeded",
+            "message": {
+                "content": [
+                    {"type": "text", "text": "Submitting the answer"},
+                    {"type": "tool_use", "name": "answer", "input": answer},
+                ]
+            },
+        },
+    }
+    assert json.loads(get_batch_response_text(result)) == answer
+
+
+def test_failed_anthropic_response():
+    result = {"custom_id": "t-d", "result": {"type": "errored", "error": {}}}
+    assert get_batch_response_text(result) is None
+
+
+def test_read_batch_responses(tmp_path):
+    results = [
+        {"custom_id": "intra_dfa-d1", "response": "Path 1: Lines 1 -> 2;"},
+        {
+            "custom_id": "path_validator-d2",
+            "response": {"body": {"choices": [{"message": {"content": "Yes"}}]}},
+        },
+        {
+            "custom_id": "path_validator-d3",
+            "result": {"message": {"content": [{"type": "text", "text": "No"}]}},
+        },
+        {"custom_id": "path_validator-d4", "result": {"type": "expired"}},
+        {"custom_id": "path_validator-d5", "response": ""},
+    ]
+    path = tmp_path / "responses.jsonl"
+    path.write_text(
+        "\n".join(json.dumps(result) for result in results) + "\n\n", encoding="utf-8"
+    )
+    assert read_batch_responses(str(path)) == {
+        "intra_dfa": {"d1": "Path 1: Lines 1 -> 2;"},
+        "path_validator": {"d2": "Yes", "d3": "No"},
+    }
+
+
+def test_exported_prompts_are_kept_once(tmp_path):
+    path = str(tmp_path / "prompts.jsonl")
+    exporter = LLMBatchExporter(path)
+    body = {"model": "gpt-4o", "messages": [{"role": "user", "content": "q"}]}
+    exporter.add("tool-d1", body)
+    exporter.add("tool-d1", body)
+    exporter.add("tool-d2", body)
+    exporter.write()
+    with open(path, "r", encoding="utf-8") as f:
+        requests = [json.loads(line) for line in f]
+    assert [request["custom_id"] for request in requests] == ["tool-d1", "tool-d2"]
+    assert requests[0]["url"] == "/v1/chat/completions"
+    assert requests[0]["body"] == body
@@ -0,0 +1,79 @@
+import threading
+import time
+
+import pytest
+
+from llmtool.LLM_budget import *
+
+
+def test_unlimited_budget():
+    budget = LLMBudget()
+    for _ in range(100):
+        budget.reserve_query()
+        budget.charge(10**6, 10**6)
+    assert not budget.is_exhausted()
+
+
+def test_query_limit():
+    budget = LLMBudget(max_query_num=2)
+    budget.reserve_query()
+    assert not budget.is_exhausted()
+    budget.reserve_query()
+    assert budget.is_exhausted()
+    with pytest.raises(BudgetExhaustedError):
+        budget.reserve_query()
+    assert budget.query_num == 2
+
+
+def test_token_limit():
+    budget = LLMBudget(max_token_num=100)
+    budget.reserve_query()
+    budget.charge(60, 30)
+    assert not budget.is_exhausted()
+    budget.reserve_query()
+    budget.charge(8, 2)
+    assert budget.is_exhausted()
+    with pytest.raises(BudgetExhaustedError):
+        budget.reserve_query()
+
+
+def test_time_limit(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    budget = LLMBudget(max_seconds=60)
+    budget.reserve_query()
+    now[0] += 60
+    assert budget.is_exhausted()
+    with pytest.raises(BudgetExhaustedError):
+        budget.reserve_query()
+
+
+def test_concurrent_reservations_do_not_exceed_query_limit():
+    budget = LLMBudget(max_query_num=50)
+    reserved_nums = []
+
+    def reserve() -> None:
+        reserved_num = 0
+        for _ in range(20):
+            try:
+                budget.reserve_query()
+                reserved_num += 1
+            except BudgetExhaustedError:
+                pass
+        reserved_nums.append(reserved_num)
+
+    threads = [threading.Thread(target=reserve) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(reserved_nums) == 50
+
+
+def test_tokens_are_charged_per_model():
+    budget = LLMBudget()
+    budget.charge(10, 1, "small")
+    budget.charge(20, 2, "large")
+    budget.charge(30, 3, "small")
+    assert budget.token_num == 66
+    assert budget.model_token_nums == {"small": [40, 4], "large": [20, 2]}
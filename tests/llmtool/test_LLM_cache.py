@@ -0,0 +1,74 @@
+import time
+from typing import Optional
+
+import pytest
+
+from llmtool.LLM_cache import *
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Each access is one second later than the previous one
+    now = [1000.0]
+
+    def tick() -> float:
+        now[0] += 1
+        return now[0]
+
+    monkeypatch.setattr(time, "time", tick)
+    return now
+
+
+def put(cache: LLMResponseCache, prompt_digest: str) -> None:
+    cache.put("model", 0.0, "tool", "v1", prompt_digest, f"response {prompt_digest}")
+
+
+def get(cache: LLMResponseCache, prompt_digest: str) -> Optional[str]:
+    return cache.get("model", 0.0, "tool", "v1", prompt_digest)
+
+
+def test_responses_persist_across_instances(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    put(LLMResponseCache(db_path), "a")
+    cache = LLMResponseCache(db_path)
+    assert get(cache, "a") == "response a"
+    assert get(cache, "b") is None
+    assert (cache.hit_num, cache.miss_num) == (1, 1)
+
+
+def test_responses_are_keyed_by_template_version(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "cache.db"))
+    put(cache, "a")
+    assert cache.get("model", 0.0, "tool", "v2", "a") is None
+    assert cache.get("model", 0.5, "tool", "v1", "a") is None
+
+
+def test_least_recently_used_responses_are_evicted(tmp_path, clock):
+    cache = LLMResponseCache(str(tmp_path / "cache.db"), max_entry_num=3)
+    for prompt_digest in ["a", "b", "c"]:
+        put(cache, prompt_digest)
+    assert get(cache, "a") == "response a"
+    put(cache, "d")
+    cache.evict()
+    assert get(cache, "b") is None
+    assert [get(cache, prompt_digest) for prompt_digest in ["a", "c", "d"]] == [
+        "response a",
+        "response c",
+        "response d",
+    ]
+
+
+def test_eviction_is_checked_periodically(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(LLMResponseCache, "EVICTION_CHECK_INTERVAL", 5)
+    cache = LLMResponseCache(str(tmp_path / "cache.db"), max_entry_num=2)
+    for prompt_digest in ["a", "b", "c", "d"]:
+        put(cache, prompt_digest)
+    assert get(cache, "a") == "response a"
+    put(cache, "e")
+    assert [get(cache, prompt_digest) for prompt_digest in "abcde"] == [
+        "response a",
+        None,
+        None,
+        None,
+        "response e",
+    ]
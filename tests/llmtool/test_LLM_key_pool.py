@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+from llmtool.LLM_key_pool import *
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code: int, message: str = "") -> None:
+        super().__init__(message or f"Error code: {status_code}")
+        self.status_code = status_code
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_round_robin_selection(clock):
+    pool = APIKeyPool("provider", ["key-a", "key-b", "key-c"], ROUND_ROBIN)
+    selected_keys = []
+    for _ in range(4):
+        api_key = pool.acquire()
+        pool.release(api_key)
+        selected_keys.append(api_key)
+    assert selected_keys == ["key-a", "key-b", "key-c", "key-a"]
+
+
+def test_least_loaded_selection(clock):
+    pool = APIKeyPool("provider", ["key-a", "key-b"], LEAST_LOADED)
+    assert pool.acquire() == "key-a"
+    assert pool.acquire() == "key-b"
+    pool.release("key-b")
+    assert pool.acquire() == "key-b"
+
+
+def test_rate_limited_key_cools_down(clock):
+    pool = APIKeyPool("provider", ["key-a", "key-b"], ROUND_ROBIN)
+    api_key = pool.acquire()
+    assert pool.release(api_key, ProviderError(429), True, retry_after=10.0)
+    assert [pool.acquire() for _ in range(2)] == ["key-b", "key-b"]
+    clock[0] += 10.0
+    assert pool.acquire() == "key-a"
+
+
+def test_all_keys_rate_limited(clock):
+    pool = APIKeyPool("provider", ["key-a", "key-b"], ROUND_ROBIN)
+    for api_key, retry_after in [("key-a", 5.0), ("key-b", 3.0)]:
+        assert pool.acquire() == api_key
+        is_retried = pool.release(api_key, ProviderError(429), True, retry_after)
+    # The provider is rate-limited as a whole, and the key unblocked first is selected
+    assert not is_retried
+    assert pool.acquire() == "key-b"
+
+
+def test_backoff_doubles_without_retry_after(clock):
+    pool = APIKeyPool("provider", ["key-a"])
+    for backoff in [1.0, 2.0, 4.0]:
+        pool.release(pool.acquire(), ProviderError(429), True)
+        assert pool.keys[0].blocked_until == clock[0] + backoff
+    pool.release(pool.acquire())
+    assert pool.keys[0].backoff == APIKeyPool.INITIAL_BACKOFF
+
+
+@pytest.mark.parametrize(
+    "error",
+    [ProviderError(401), ProviderError(429, "You exceeded your current quota")],
+)
+def test_key_error_removes_key(clock, error):
+    pool = APIKeyPool("provider", ["key-a", "key-b"], ROUND_ROBIN)
+    assert pool.release(pool.acquire(), error)
+    assert [pool.acquire() for _ in range(2)] == ["key-b", "key-b"]
+    assert not pool.release("key-b", error)
+    assert pool.acquire() is None
+
+
+def test_request_error_does_not_block_key(clock):
+    pool = APIKeyPool("provider", ["key-a", "key-b"], ROUND_ROBIN)
+    assert not pool.release(pool.acquire(), ProviderError(500))
+    pool.acquire()
+    assert pool.acquire() == "key-a"
@@ -0,0 +1,37 @@
+from llmtool.LLM_prompt_template import *
+
+
+def test_render_fills_slots():
+    template = PromptTemplate("Check <FUNCTION> for <BUG_TYPE>.")
+    assert (
+        template.render({"FUNCTION": "int f();", "BUG_TYPE": "NPD"})
+        == "Check int f(); for NPD."
+    )
+
+
+def test_render_keeps_slots_without_values():
+    template = PromptTemplate("Check <FUNCTION> for <BUG_TYPE>.")
+    assert template.render({"BUG_TYPE": "NPD"}) == "Check <FUNCTION> for NPD."
+
+
+def test_render_does_not_fill_slots_in_values():
+    template = PromptTemplate("<FUNCTION> <SRC_NAME>")
+    values = {"FUNCTION": "List<SRC_NAME> f();", "SRC_NAME": "p"}
+    assert template.render(values) == "List<SRC_NAME> f(); p"
+
+
+def test_prefix_is_shared_by_prompts():
+    template = PromptTemplate("Function: <FUNCTION>", prefix="Detect <BUG_TYPE>.\n")
+    prompts = [
+        template.render({"BUG_TYPE": "NPD", "FUNCTION": function})
+        for function in ["void f() {}", "int g() { return 0; }"]
+    ]
+    prefix_length = template.get_prefix_length({"BUG_TYPE": "NPD"})
+    assert prefix_length == len("Detect NPD.\n")
+    assert prompts[0][:prefix_length] == prompts[1][:prefix_length]
+    assert prompts[0][prefix_length:] == "Function: void f() {}"
+
+
+def test_hash_depends_on_text_only():
+    assert PromptTemplate("b", prefix="a").hash == PromptTemplate("ab").hash
+    assert PromptTemplate("a").hash != PromptTemplate("b").hash
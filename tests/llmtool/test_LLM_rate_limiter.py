@@ -0,0 +1,112 @@
+import time
+
+import pytest
+
+from llmtool.LLM_rate_limiter import *
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_token_bucket_refills_at_rate(clock):
+    bucket = TokenBucket(60)
+    assert bucket.reserve(60, clock[0]) == 0.0
+    # An empty bucket refills one token per second
+    assert bucket.reserve(1, clock[0]) == pytest.approx(1.0)
+    clock[0] += 11
+    assert bucket.reserve(10, clock[0]) == 0.0
+
+
+def test_token_bucket_overdraw_is_waited_for(clock):
+    bucket = TokenBucket(60)
+    assert bucket.reserve(90, clock[0]) == pytest.approx(30.0)
+
+
+def test_token_bucket_refill_is_capped(clock):
+    bucket = TokenBucket(60)
+    clock[0] += 3600
+    assert bucket.reserve(70, clock[0]) == pytest.approx(10.0)
+
+
+def test_unlimited_token_bucket():
+    assert TokenBucket().reserve(10**9, time.monotonic()) == 0.0
+
+
+def test_concurrency_doubles_in_slow_start(clock):
+    limiter = RateLimiter("provider", initial_concurrency=2, max_concurrency=8)
+    for _ in range(2):
+        limiter.acquire(0)
+    for _ in range(2):
+        limiter.release(latency=1.0)
+    assert limiter.concurrency_limit == 4
+    for _ in range(10):
+        limiter.acquire(0)
+        limiter.release(latency=1.0)
+    assert limiter.concurrency_limit == 8
+
+
+def test_rate_limit_halves_concurrency_once_per_round_trip(clock):
+    limiter = RateLimiter("provider", initial_concurrency=8)
+    limiter.acquire(0)
+    limiter.release(latency=1.0)
+    assert limiter.concurrency_limit == 9
+
+    for _ in range(3):
+        limiter.acquire(0)
+    for _ in range(3):
+        limiter.release(is_rate_limited=True, retry_after=5.0)
+    assert limiter.concurrency_limit == 4.5
+    assert limiter.rate_limited_num == 3
+    assert limiter.blocked_until == clock[0] + 5.0
+
+    # After the first decrease, the limit grows by one per round trip
+    clock[0] += 5.0
+    for _ in range(4):
+        limiter.acquire(0)
+    for _ in range(4):
+        limiter.release(latency=1.0)
+    assert 5 < limiter.concurrency_limit < 5.5
+
+
+def test_rate_limit_backoff_doubles_without_retry_after(clock):
+    limiter = RateLimiter("provider")
+    for backoff in [1.0, 2.0, 4.0]:
+        limiter.acquire(0)
+        limiter.release(is_rate_limited=True)
+        assert limiter.blocked_until == clock[0] + backoff
+        clock[0] += backoff
+    limiter.acquire(0)
+    limiter.release(latency=1.0)
+    assert limiter.backoff == RateLimiter.INITIAL_BACKOFF
+
+
+def test_latency_inflation_reduces_concurrency(clock):
+    limiter = RateLimiter("provider", initial_concurrency=10)
+    limiter.acquire(0)
+    limiter.release(latency=1.0)
+    clock[0] += 10
+    limiter.acquire(0)
+    limiter.release(latency=10.0)
+    assert limiter.concurrency_limit == pytest.approx(11 * 0.9)
+    assert not limiter.is_slow_start
+
+
+def test_get_retry_after():
+    class Response:
+        def __init__(self, headers):
+            self.headers = headers
+
+    class RateLimitError(Exception):
+        def __init__(self, headers):
+            super().__init__("rate limit exceeded")
+            self.status_code = 429
+            self.response = Response(headers)
+
+    assert get_retry_after(RateLimitError({"retry-after-ms": "1500"})) == 1.5
+    assert get_retry_after(RateLimitError({"retry-after": "3"})) == 3.0
+    assert get_retry_after(RateLimitError({})) is None
+    assert is_rate_limit_error(RateLimitError({}))
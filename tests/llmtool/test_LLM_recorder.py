@@ -0,0 +1,70 @@
+import asyncio
+
+from llmtool.LLM_recorder import *
+
+
+def record(path: str, inferences) -> None:
+    recorder = LLMRecorder()
+    recorder.configure("record", path)
+    for message, output, history in inferences:
+        recorder.record("model", "system", message, output, (10, 1, 0), 0.5, history)
+
+
+def test_responses_are_replayed_in_recorded_order(tmp_path):
+    path = str(tmp_path / "recording.jsonl")
+    record(path, [("q", "first", None), ("p", "other", None), ("q", "second", None)])
+    recorder = LLMRecorder()
+    recorder.configure("replay", path)
+    # The last response is repeated once the responses are used up
+    assert [recorder.replay("model", "system", "q")[0] for _ in range(3)] == [
+        "first",
+        "second",
+        "second",
+    ]
+    assert recorder.replay("model", "system", "p") == ("other", (10, 1, 0))
+    assert recorder.hit_num == 4
+
+
+def test_unrecorded_prompts_are_missed(tmp_path):
+    path = str(tmp_path / "recording.jsonl")
+    record(path, [("q", "response", None)])
+    recorder = LLMRecorder()
+    recorder.configure("replay", path)
+    assert recorder.replay("other-model", "system", "q") == ("", None)
+    assert recorder.replay("model", "other-system", "q") == ("", None)
+    assert recorder.miss_num == 2
+
+
+def test_turns_are_keyed_by_history(tmp_path):
+    path = str(tmp_path / "recording.jsonl")
+    history = [
+        {"role": "user", "content": "q"},
+        {"role": "assistant", "content": "malformed"},
+    ]
+    record(path, [("q", "malformed", None), ("restate", "repaired", history)])
+    recorder = LLMRecorder()
+    recorder.configure("replay", path)
+    assert recorder.replay("model", "system", "restate")[0] == ""
+    assert recorder.replay("model", "system", "restate", history)[0] == "repaired"
+
+
+def test_truncated_last_line_is_skipped(tmp_path):
+    path = str(tmp_path / "recording.jsonl")
+    record(path, [("q", "response", None)])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"key": "trunc')
+    recorder = LLMRecorder()
+    recorder.configure("replay", path)
+    assert recorder.replay("model", "system", "q")[0] == "response"
+
+
+def test_async_replay(tmp_path):
+    path = str(tmp_path / "recording.jsonl")
+    record(path, [("q", "first", None), ("q", "second", None)])
+    recorder = LLMRecorder()
+    recorder.configure("replay", path, is_latency_replayed=False)
+
+    async def replay_all():
+        return [(await recorder.areplay("model", "system", "q"))[0] for _ in range(2)]
+
+    assert asyncio.run(replay_all()) == ["first", "second"]
@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+from llmtool.LLM_retry import *
+
+
+class StatusError(Exception):
+    def __init__(self, status_code: int, message: str = "") -> None:
+        super().__init__(message or f"Error code: {status_code}")
+        self.status_code = status_code
+
+
+@pytest.mark.parametrize("status_code", [400, 401, 403, 404, 405, 413, 415, 422, 451])
+def test_client_errors_are_not_retried(status_code):
+    kind = classify_error(StatusError(status_code))
+    assert kind == CLIENT_ERROR
+    assert not RetryPolicy.is_retryable(kind)
+
+
+@pytest.mark.parametrize(
+    "status_code, kind",
+    [(408, TIMEOUT), (409, OTHER_ERROR), (429, RATE_LIMITED), (500, SERVER_ERROR)],
+)
+def test_transient_errors_are_retried(status_code, kind):
+    assert classify_error(StatusError(status_code)) == kind
+    assert RetryPolicy.is_retryable(kind)
+
+
+def test_status_code_decides_over_message():
+    assert (
+        classify_error(StatusError(400, "prompt id 142900 is invalid")) == CLIENT_ERROR
+    )
+    assert classify_error(Exception("Error code: 429 - rate limit")) == RATE_LIMITED
+    assert classify_error(Exception("connection reset")) == OTHER_ERROR
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def open_circuit(breaker: CircuitBreaker) -> None:
+    for _ in range(CircuitBreaker.FAILURE_THRESHOLD):
+        assert breaker.allow()
+        breaker.record_failure(SERVER_ERROR)
+
+
+def test_circuit_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("provider")
+    for _ in range(CircuitBreaker.FAILURE_THRESHOLD - 1):
+        breaker.record_failure(SERVER_ERROR)
+    breaker.record_success()
+    open_circuit(breaker)
+    assert breaker.is_open()
+    assert not breaker.allow()
+    assert breaker.fast_failed_num == 1
+
+
+@pytest.mark.parametrize("kind", [RATE_LIMITED, CLIENT_ERROR, KEY_ERROR])
+def test_circuit_ignores_failures_of_requests_and_keys(clock, kind):
+    breaker = CircuitBreaker("provider")
+    for _ in range(2 * CircuitBreaker.FAILURE_THRESHOLD):
+        breaker.record_failure(kind)
+    assert not breaker.is_open()
+
+
+def test_successful_probe_closes_circuit(clock):
+    breaker = CircuitBreaker("provider")
+    open_circuit(breaker)
+    clock[0] += CircuitBreaker.INITIAL_OPEN_SECONDS
+    assert breaker.allow()
+    # Only one probe is let through at a time
+    assert not breaker.allow()
+    breaker.record_success()
+    assert not breaker.is_open()
+    assert breaker.allow()
+
+
+def test_failed_probe_doubles_open_time(clock):
+    breaker = CircuitBreaker("provider")
+    open_circuit(breaker)
+    clock[0] += CircuitBreaker.INITIAL_OPEN_SECONDS
+    assert breaker.allow()
+    breaker.record_failure(TIMEOUT)
+    assert breaker.open_num == 2
+
+    clock[0] += 2 * CircuitBreaker.INITIAL_OPEN_SECONDS - 1
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.allow()
+
+
+def test_cancelled_probe_admits_another_probe(clock):
+    breaker = CircuitBreaker("provider")
+    open_circuit(breaker)
+    clock[0] += CircuitBreaker.INITIAL_OPEN_SECONDS
+    assert breaker.allow()
+    breaker.cancel()
+    assert breaker.allow()
@@ -0,0 +1,54 @@
+import json
+
+from memory.report.report_writer import *
+
+FUNCTION = Function(
+    1,
+    "f",
+    "Object f(Object a) {\n  return a.g();\n}",
+    10,
+    12,
+    None,  # type: ignore[arg-type]
+    "A.java",
+)
+
+
+def get_bug_report(name: str) -> BugReport:
+    buggy_value = Value(name, 11, ValueLabel.SRC, "A.java")
+    return BugReport("NPD", buggy_value, {1: FUNCTION}, f"{name} is null")
+
+
+def write_reports(writer: BugReportWriter, names) -> None:
+    writer.start()
+    for report_id, name in names:
+        writer.append(report_id, get_bug_report(name))
+    writer.close()
+
+
+def test_reports_are_compacted(tmp_path):
+    writer = BugReportWriter(str(tmp_path))
+    write_reports(writer, [(0, "a"), (1, "b")])
+    with open(tmp_path / "detect_info.json", "r") as json_file:
+        bug_report_dict = json.load(json_file)
+    assert list(bug_report_dict.keys()) == ["0", "1"]
+    assert bug_report_dict["1"]["explanation"] == "b is null"
+
+
+def test_truncated_last_line_is_skipped(tmp_path):
+    write_reports(BugReportWriter(str(tmp_path)), [(0, "a")])
+    # A crash leaves the last record half-written
+    with open(tmp_path / "detect_info.jsonl", "a") as jsonl_file:
+        jsonl_file.write('{"id": 1, "report": {"bug_type": "N')
+    assert list(BugReportWriter(str(tmp_path)).compact().keys()) == ["0"]
+
+
+def test_reports_after_truncated_last_line_are_kept(tmp_path):
+    write_reports(BugReportWriter(str(tmp_path)), [(0, "a")])
+    with open(tmp_path / "detect_info.jsonl", "a") as jsonl_file:
+        jsonl_file.write('{"id": 1, "report": {"bug_type": "N')
+    # The resumed scan reports the bug again
+    writer = BugReportWriter(str(tmp_path))
+    write_reports(writer, [(1, "b"), (2, "c")])
+    bug_report_dict = writer.compact()
+    assert list(bug_report_dict.keys()) == ["0", "1", "2"]
+    assert bug_report_dict["1"]["explanation"] == "b is null"